@@ -6,7 +6,10 @@ from binascii import b2a_hex
 from .readers import ByteReader
 from .hexdump import strescape, toout, ashex
 from .Datamodel import TableDefinition, Record
-from .Datafile import Datafile
+from .Datafile import Datafile, CorruptRecordError
+from . import parallel, kodcache, aio, columns, vocabulary, links
+from .recindex import RecordIndex, EMPTY, indexfingerprint, indexname
+from .query import Query
 import base64
 import struct
 import crodump.koddecoder
@@ -17,18 +20,45 @@ if sys.version_info[0] == 2:
 
 
 class Database:
-    """represent the entire database, consisting of Stru, Index and Bank files"""
+    """
+    represent the entire database, consisting of Stru, Index and Bank files
 
-    def __init__(self, dbdir, compact, kod=crodump.koddecoder.new()):
+    Single records can be read by several threads at once, using `get_record`, `stream_record`
+    or the `readrec` method of the Datafile objects: the files are read with positional reads,
+    and the .tad index is only modified while constructing the Database.
+    The `enumerate_*` methods should be used by one thread at a time.
+    """
+
+    def __init__(self, dbdir, compact, kod=crodump.koddecoder.new(), usemmap=False, verifycrc=False, jobs=None, recindex=None, budget=None, vocabulary=False):
         """
         `dbdir` is the directory containing the Cro*.dat and Cro*.tad files.
         `compact` if set, the .tad file is not cached in memory, making dumps 15 % slower
         `kod` is optionally a KOD coder object.
               by default the v3 KOD coding will be used.
+        `usemmap` if set, the .dat and .tad files are memory mapped instead of
+              read with a seek + read per record, `compact` is then ignored.
+        `verifycrc` if set, the crc32 of each compressed chunk is verified.
+        `jobs` the default nr of worker processes used for decoding CroBank records.
+        `recindex` if not None, a sidecar index of the CroBank records is used,
+              or built while reading the whole bank. An empty string stores the index
+              in the cache directory, otherwise it is the filename of the index.
+        `budget` optionally a MemoryBudget, bounding the memory used for caching the
+              .tad and .dat files, and for the records being decoded. `compact` is then ignored.
+        `vocabulary` if set, dictionary fields are resolved using the vocabulary database
+              in the Voc subdirectory, see `getvocabulary`.
         """
-        self.dbdir = dbdir
+        # the index and vocabulary are opened lazily, possibly after the caller changed directory.
+        self.dbdir = os.path.abspath(dbdir)
         self.compact = compact
         self.kod = kod
+        self.usemmap = usemmap
+        self.verifycrc = verifycrc
+        self.jobs = jobs
+        self.recindexname = os.path.abspath(recindex) if recindex else recindex
+        self.recindex = None
+        self.budget = budget
+        self.usevocabulary = vocabulary
+        self.vocabulary = None
 
         # Stru+Index+Bank for the components for most databases
         self.stru = self.getfile("Stru")
@@ -51,7 +81,7 @@ class Database:
             datname = self.getname(name, "dat")
             tadname = self.getname(name, "tad")
             if datname and tadname:
-                return Datafile(name, open(datname, "rb"), open(tadname, "rb"), self.compact, self.kod)
+                return Datafile(name, open(datname, "rb"), open(tadname, "rb"), self.compact, self.kod, self.usemmap, self.verifycrc, self.budget)
         except IOError:
             return
 
@@ -166,12 +196,12 @@ class Database:
         """
         dbinfo = self.stru.readrec(1)
         if dbinfo[:1] != b"\x03":
-            print("WARN: expected dbinfo to start with 0x03")
+            print("WARN: expected dbinfo to start with 0x03", file=stderr)
         try:
             dbdef = self.decode_db_definition(dbinfo[1:])
         except Exception as e:
-            print("ERROR decoding db definition: %s" % e)
-            print("This could possibly mean that you need to try with the --strucrack option")
+            print("ERROR decoding db definition: %s" % e, file=stderr)
+            print("This could possibly mean that you need to try with the --strucrack option", file=stderr)
             return
 
         for k, v in dbdef.items():
@@ -181,7 +211,184 @@ class Database:
                 if not files and k[4:] != "000":
                     yield TableDefinition(v, dbdef.get("BaseImage" + k[4:], b''))
 
-    def enumerate_records(self, table):
+    def enumerate_bank(self, physical=False, window=None):
+        """
+        Yields (recno, data) for all records in CroBank.
+
+        `physical` if set, records are read in the order they are stored in CroBank.dat,
+              deleted records are skipped.
+        `window` when reading in physical order, yield the records in record number order,
+              buffering at most `window` records.
+
+        Corrupt records, with a broken extension chain or compressed data,
+        are reported on stderr, and skipped.
+        """
+        def reporterror(recno, e):
+            print("Record %d broken: ERROR '%s'" % (recno, e), file=stderr)
+
+        if physical:
+            yield from self.bank.scanrecords(window, reporterror)
+            return
+        for i in range(self.bank.nrofrecords):
+            try:
+                data = self.bank.readrec(i + 1)
+            except CorruptRecordError as e:
+                reporterror(i + 1, e)
+                continue
+            yield i + 1, data
+
+    def enumerate_encoded(self, physical=False, window=None, recnums=None, onerror=None):
+        """
+        Yields (recno, encoded data) for all records in CroBank which are not deleted,
+        or only for the record numbers in `recnums`.
+
+        See `enumerate_bank` for the `physical` and `window` arguments.
+        Records with a corrupt extension chain are skipped after calling `onerror(recno, exception)`,
+        without `onerror` they are reported on stderr.
+        """
+        if onerror is None:
+            def onerror(recno, e):
+                print("Record %d broken: ERROR '%s'" % (recno, e), file=stderr)
+
+        if recnums is None:
+            if physical:
+                yield from self.bank.scanrecords(window, onerror, encoded=True)
+                return
+            recnums = range(1, self.bank.nrofrecords + 1)
+        elif physical and not window:
+            recnums = sorted(recnums, key=lambda recno: self.bank.tadoffset(recno - 1))
+
+        for recno in recnums:
+            try:
+                encdat = self.bank.readencodedrec(recno)
+            except CorruptRecordError as e:
+                onerror(recno, e)
+                continue
+            if encdat is not None:
+                yield recno, encdat
+
+    def getrecindex(self):
+        """
+        Returns the sidecar record index, a new, empty, index when none was stored yet,
+        or None when no index was requested.
+        """
+        if self.recindexname is None:
+            return
+        if self.recindex is None:
+            bankfingerprint = kodcache.fingerprint(self.dbdir, ("Bank",))
+            fingerprint = indexfingerprint(bankfingerprint, self.bank.kod)
+            self.recindexname = self.recindexname or indexname(bankfingerprint)
+            self.recindex = RecordIndex.load(self.recindexname, fingerprint)
+            if self.recindex is None or self.recindex.nrofrecords != self.bank.nrofrecords:
+                self.recindex = RecordIndex.fromtad(fingerprint, self.bank.nrofrecords, self.bank.tadparts())
+        return self.recindex
+
+    def getvocabulary(self):
+        """
+        Returns the Vocabulary of the database, which is read from the Voc subdirectory,
+        or from the cache, when first used. Returns None when the database has no Voc subdirectory.
+        """
+        if self.vocabulary is None:
+            vocdir = vocabulary.findvocdir(self.dbdir)
+            if not vocdir:
+                self.vocabulary = False
+            else:
+                opendb = lambda: Database(vocdir, self.compact, self.kod, self.usemmap, self.verifycrc, budget=self.budget)
+                self.vocabulary = vocabulary.loadvocabulary(vocdir, opendb, self.bank.kod)
+        if self.vocabulary is not False:
+            return self.vocabulary
+
+    def linkresolver(self, tables=None, cachesize=links.CACHESIZE):
+        """
+        Returns a LinkResolver for the link fields of the records in this database,
+        see the `links` module. `tables` are the tables which may be referenced, by default all.
+
+        usage:
+        resolver = db.linkresolver()
+        for rec in db.enumerate_records(tab):
+            print([resolver.keys(rec.fields[i].data) for i in links.linkindices(tab)])
+        """
+        return links.LinkResolver(self, tables, cachesize)
+
+    def enumerate_decoded(self, tables, physical=False, window=None, jobs=None, query=None, recnos=None):
+        """
+        Yields (recno, tableid, item) for all records in CroBank, in a single pass over the bank.
+
+        `tables` maps table ids to the list of field definitions, or to None for file tables.
+        `item` is a Record object, or for file tables the record data without the table id.
+        For empty records `tableid` is None, and for records of tables not in `tables` `item` is None.
+        Broken records are reported on stderr, and skipped.
+
+        With a complete sidecar index, only the records of `tables` are read,
+        otherwise the index is filled while reading the bank, and saved when done.
+        Without an index, records for other tables are skipped after decoding their table id.
+
+        See `enumerate_bank` for the `physical` and `window` arguments.
+        `jobs` the nr of worker processes decoding the records, by default the
+              `jobs` passed to the Database constructor is used.
+        `query` optionally a Query, records not matching it are returned with a None item.
+        `recnos` optionally a (first, last) tuple, only records in this range are read,
+              either may be None.
+
+        When the Database was opened with `vocabulary`, the dictionary fields of the records
+        are resolved, `query` conditions on dictionary fields are matched with the resolved values.
+        """
+        first, last = recnos or (None, None)
+        first, last = max(first or 1, 1), min(last or self.bank.nrofrecords, self.bank.nrofrecords)
+
+        index = self.getrecindex()
+        recnums = range(first, last + 1) if recnos else None
+        if index and index.iscomplete():
+            recnums = [recno for recno in index.records(tables) if first <= recno <= last]
+            for recno in range(first, last + 1):
+                tableid = index.tableids[recno - 1]
+                if tableid == EMPTY:
+                    yield recno, None, None
+                elif tableid < 0x100 and tableid not in tables:
+                    yield recno, tableid, None
+            index = None
+        peek = index is None
+
+        vocab = self.getvocabulary() if self.usevocabulary else None
+        dictfields = vocabulary.dictionaryfields(tables) if vocab else {}
+        # conditions on dictionary fields can only be matched after resolving them.
+        postconditions = None
+        if query and query.tableid in dictfields:
+            query, postconditions = query.split({i + 1 for i in dictfields[query.tableid]})
+
+        def reporterror(recno, e):
+            print("Record %d broken: ERROR '%s'" % (recno, e), file=stderr)
+            if index:
+                index.broken(recno)
+
+        records = self.enumerate_encoded(physical, window, recnums, reporterror)
+        jobs = jobs or self.jobs
+        if jobs and jobs > 1:
+            maxbytes = self.budget.inflight if self.budget else None
+            results = parallel.enumerate_parallel(self.bank, records, tables, jobs, query, peek, maxbytes)
+        else:
+            results = ((recno, len(encdat)) + parallel.decoderecord(recno, encdat, tables, self.bank.encoding, self.bank.kod, self.verifycrc, query, peek)
+                       for recno, encdat in records)
+
+        for recno, rawsize, tableid, decodedsize, item, error in results:
+            if dictfields and item is not None and tableid in dictfields:
+                vocab.resolverecord(item, dictfields[tableid])
+                if postconditions and tableid == query.tableid and not all(c.match(item) for c in postconditions):
+                    item = None
+            if index:
+                if error and tableid is None:
+                    index.broken(recno)
+                else:
+                    index.add(recno, tableid, rawsize, decodedsize)
+            if error:
+                print(error, file=stderr)
+            else:
+                yield recno, tableid, item
+
+        if index and index.iscomplete():
+            index.save(self.recindexname)
+
+    def enumerate_records(self, table, physical=False, window=None, jobs=None):
         """
         Yields a Record object for all records in CroBank matching
         the tableid from `table`
@@ -190,26 +397,110 @@ class Database:
         for tab in db.enumerate_tables():
             for rec in db.enumerate_records(tab):
                 print(sqlformatter(tab, rec))
+
+        See `enumerate_decoded` for the `physical`, `window` and `jobs` arguments.
         """
-        for i in range(self.bank.nrofrecords):
-            data = self.bank.readrec(i + 1)
-            if data and data[0] == table.tableid:
-                try:
-                    yield Record(i + 1, table.fields, data[1:])
-                except EOFError:
-                    print("Record %d too short: -- %s" % (i+1, ashex(data)), file=stderr)
-                except Exception as e:
-                    print("Record %d broken: ERROR '%s' -- %s" % (i+1, e, ashex(data)), file=stderr)
+        for recno, tableid, record in self.enumerate_decoded({table.tableid: table.fields}, physical, window, jobs):
+            if tableid == table.tableid and record is not None:
+                yield record
+
+    def aenumerate_records(self, table, batch_size=1000, physical=False, window=None, jobs=None, maxbatches=2):
+        """
+        Asynchronous version of `enumerate_records`, yields lists of at most `batch_size` Record objects.
+
+        The records are read and decoded on a worker thread, which is at most `maxbatches`
+        batches ahead of the consumer. Stopping the iteration, or cancelling the consuming task,
+        stops the worker thread.
+
+        usage:
+        async for records in db.aenumerate_records(tab, batch_size=500):
+            await index.add([[field.content for field in rec.fields] for rec in records])
+
+        See `enumerate_decoded` for the `physical`, `window` and `jobs` arguments.
+        """
+        def decodefields(record):
+            for field in record.fields:
+                field.content
+
+        return aio.abatches(lambda: self.enumerate_records(table, physical, window, jobs),
+                            batch_size, maxbatches, decodefields)
+
+    def iter_batches(self, table, batch_size=10000, arrays=None, physical=False, window=None, jobs=None):
+        """
+        Yields the records of `table` as column oriented batches of at most `batch_size` records,
+        dicts mapping the field names to lists or numpy arrays, see the `columns` module.
+        The columns are built from the raw values, without creating Field objects.
+
+        usage:
+        for batch in db.iter_batches(tab, batch_size=50000):
+            print(batch["Birthdate"].min())
+
+        See `enumerate_decoded` for the `physical`, `window` and `jobs` arguments.
+        """
+        builder = columns.ColumnBuilder(table, arrays)
+        return builder.batches(self.enumerate_records(table, physical, window, jobs), batch_size)
+
+    def dataframe(self, table, batch_size=100000, physical=False, window=None, jobs=None):
+        """
+        Returns all records of `table` as a pandas DataFrame, this needs pandas to be installed.
+        """
+        return columns.dataframe(table, self.enumerate_records(table, physical, window, jobs), batch_size)
 
-    def enumerate_files(self, table):
+    def query(self, table, columns=None, conditions=(), recnos=None, physical=False, window=None, jobs=None):
+        """
+        Yields the list of selected fields for the records in `table` matching all `conditions`.
+
+        `columns` the names of the fields to return, by default all fields.
+        `conditions` a list of Condition objects, or conditions in the `name=value`,
+              `name~value` or `name=low..high` form, see the `query` module.
+        `recnos` optionally a (first, last) tuple limiting the record numbers read.
+
+        usage:
+        for fields in db.query(tab, ["Name", "Date"], ["Name~Ivan", "Date=2001-01-01..2001-12-31"]):
+            print([field.content for field in fields])
+        """
+        q = Query(table, columns, conditions)
+        for recno, tableid, record in self.enumerate_decoded({table.tableid: table.fields}, physical, window, jobs, q, recnos):
+            if tableid == table.tableid and record is not None:
+                yield q.project(record)
+
+    def enumerate_files(self, table, physical=False, window=None, jobs=None):
         """
         Yield all file contents found in CroBank for `table`.
         This is most likely the table with id 0.
         """
-        for i in range(self.bank.nrofrecords):
-            data = self.bank.readrec(i + 1)
-            if data and data[0] == table.tableid:
-                yield i + 1, data[1:]
+        for recno, tableid, data in self.enumerate_decoded({table.tableid: None}, physical, window, jobs):
+            if tableid == table.tableid:
+                yield recno, data
+
+    def enumerate_all(self, tables, filetables=(), physical=False, window=None, jobs=None, stats=None):
+        """
+        Yields (table, item) for the records of all `tables` and `filetables`,
+        reading CroBank only once.
+        For `tables` item is a Record object, for `filetables` it is a (recno, data) tuple.
+
+        When a `stats` Counter is passed, it is updated with the nr of 'deleted', 'empty'
+        and 'unknown' records, the latter being records for tables not passed in.
+        """
+        byid = {table.tableid: table for table in filetables}
+        byid.update({table.tableid: table for table in tables})
+        fields = {table.tableid: None for table in filetables}
+        fields.update({table.tableid: table.fields for table in tables})
+
+        if stats is not None:
+            stats["deleted"] += self.bank.nrdeletedrecords()
+
+        for recno, tableid, item in self.enumerate_decoded(fields, physical, window, jobs):
+            if tableid is None:
+                if stats is not None:
+                    stats["empty"] += 1
+            elif item is None:
+                if stats is not None:
+                    stats["unknown"] += 1
+            elif fields[tableid] is None:
+                yield byid[tableid], (recno, item)
+            else:
+                yield byid[tableid], item
 
     def get_record(self, index, asbase64=False):
         """
@@ -221,6 +512,28 @@ class Database:
         else:
             return data[1:]
 
+    def stream_record(self, index):
+        """
+        Retrieve a single record from CroBank with record number `index` in parts, like `get_record`,
+        but without reading the entire record in memory. See `Datafile.decodeparts` for the parts.
+        Returns None for deleted records.
+        """
+        parts = self.bank.streamrec(int(index))
+        if parts is None:
+            return
+
+        def withouttableid():
+            skip = 1
+            for part in parts:
+                if part is None:
+                    skip = 1
+                elif skip:
+                    n = min(skip, len(part))
+                    part, skip = part[n:], skip - n
+                yield part
+
+        return withouttableid()
+
     def recdump(self, args):
         """
         Function for outputing record contents of the various .dat files.
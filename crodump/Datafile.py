@@ -1,26 +1,111 @@
 import io
+import mmap
+import os
 import struct
+import threading
 import zlib
 from .hexdump import tohex, toout
+from .tadindex import TadIndex, splitentry, DELETED
 import crodump.koddecoder
 
+# records are read with a single read when separated by no more than MAXREADGAP bytes,
+# up to a total of MAXREADSIZE bytes.
+MAXREADGAP = 0x10000
+MAXREADSIZE = 0x100000
+
+# os.pread is not available on all platforms, seek + read is then serialized using `seeklock`.
+pread = getattr(os, "pread", None)
+seeklock = threading.Lock()
+
+
+def readat(fh, ofs, size):
+    """
+    Read `size` bytes at offset `ofs` from the file `fh`, less at the end of the file.
+
+    The file position is not used, so several threads can read the same file at once.
+    Where os.pread is not available, like on Windows, the reads are serialized instead.
+    """
+    try:
+        fd = fh.fileno() if pread else None
+    except (AttributeError, io.UnsupportedOperation):
+        fd = None
+    if fd is None:
+        with seeklock:
+            fh.seek(ofs)
+            return fh.read(size)
+
+    data = pread(fd, size, ofs)
+    while 0 < len(data) < size:
+        more = pread(fd, size - len(data), ofs + len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+class CorruptRecordError(Exception):
+    """
+    Base class for the errors raised for a single corrupt record,
+    the other records can still be read.
+    """
+
+
+class CorruptChainError(CorruptRecordError):
+    """
+    Raised for records with a corrupt extension chain.
+    """
+
+
+class CompressionError(CorruptRecordError):
+    """
+    Raised for corrupt compressed records.
+    `chunk` is the index of the corrupt chunk, `offset` the position of that chunk in the record.
+    """
+    def __init__(self, reason, chunk, offset):
+        super().__init__("compressed chunk #%d at %04x: %s" % (chunk, offset, reason))
+        self.reason = reason
+        self.chunk = chunk
+        self.offset = offset
+
+
 class Datafile:
     """Represent a single .dat with it's .tad index file"""
 
-    def __init__(self, name, dat, tad, compact, kod):
+    def __init__(self, name, dat, tad, compact, kod, usemmap=False, verifycrc=False, budget=None):
         self.name = name
         self.dat = dat
         self.tad = tad
         self.compact = compact
+        self.verifycrc = verifycrc
+        # with a MemoryBudget, reads go through its caches, and `compact` is ignored.
+        self.budget = budget
+
+        # with `usemmap`, both the .dat and .tad are mapped in memory once,
+        # and records are returned as slices of the mapping.
+        self.datmap = self.mapfile(self.dat) if usemmap else None
+        self.tadmap = self.mapfile(self.tad) if usemmap else None
 
         self.readdathdr()
         self.readtad()
 
-        self.dat.seek(0, io.SEEK_END)
-        self.datsize = self.dat.tell()
+        if self.datmap is not None:
+            self.datsize = len(self.datmap)
+        else:
+            self.dat.seek(0, io.SEEK_END)
+            self.datsize = self.dat.tell()
 
         self.kod = kod if not kod or self.isencrypted() else crodump.koddecoder.new()
 
+    def mapfile(self, fh):
+        """
+        Return a read-only memoryview of the entire file `fh`.
+        """
+        fh.seek(0, io.SEEK_END)
+        if not fh.tell():
+            # empty files can not be mapped.
+            return memoryview(b"")
+        return memoryview(mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ))
+
     def isencrypted(self):
         return self.version in (b'01.04', b'01.05') or self.isv4()
 
@@ -47,8 +132,7 @@ class Datafile:
         Note that the 19 byte header if followed by 0xE9 random bytes, generated by
         'srand(time())' followed by 0xE9 times obfuscate(rand())
         """
-        self.dat.seek(0)
-        hdrdata = self.dat.read(19)
+        hdrdata = self.readdata(0, 19)
 
         (
             magic,            # +00  8 bytes
@@ -88,36 +172,79 @@ class Datafile:
 
         self.tadhdrlen = self.tad.tell()
         self.tadentrysize = 16 if self.use64bit else 12
-        if self.compact:
+        if self.tadmap is not None:
+            # the mapped .tad is used as the index cache, regardless of `compact`
+            self.tadindex = TadIndex(self.tadmap[self.tadhdrlen:], self.use64bit, self.isv4())
+            self.tad.seek(0, io.SEEK_END)
+        elif self.budget is not None:
+            # decode the entire .tad when it fits the budget, otherwise read it through the paged cache.
+            self.tad.seek(0, io.SEEK_END)
+            self.tadindex = None
+            if self.budget.reservetad(self.tad.tell() - self.tadhdrlen):
+                self.tad.seek(self.tadhdrlen)
+                self.tadindex = TadIndex(self.tad.read(), self.use64bit, self.isv4())
+        elif self.compact:
+            self.tadindex = None
             self.tad.seek(0, io.SEEK_END)
         else:
-            self.idxdata = self.tad.read()
+            self.tadindex = TadIndex(self.tad.read(), self.use64bit, self.isv4())
         self.tadsize = self.tad.tell() - self.tadhdrlen
         self.nrofrecords = self.tadsize // self.tadentrysize
         if self.tadsize % self.tadentrysize:
             print("WARN: leftover data in .tad")
 
+    def tadparts(self):
+        """
+        Yields (first, TadIndex) for consecutive parts of the .tad, `first` is the index of the first entry
+        of the part. When the .tad is decoded entirely, that is the only part. Otherwise, in compact mode,
+        or when the .tad did not fit the memory budget, the parts are decoded from the .tad one at a time,
+        with at most MAXREADSIZE bytes of entries, or what is left of the .tad budget.
+        """
+        if self.tadindex is not None:
+            yield 0, self.tadindex
+            return
+        partsize = MAXREADSIZE
+        if self.budget is not None:
+            partsize = max(partsize, self.budget.tadpartsize())
+        step = max(1, partsize // self.tadentrysize)
+        for first in range(0, self.nrofrecords, step):
+            n = min(step, self.nrofrecords - first)
+            data = readat(self.tad, self.tadhdrlen + first * self.tadentrysize, n * self.tadentrysize)
+            yield first, TadIndex(data, self.use64bit, self.isv4())
+
+    def nrdeletedrecords(self):
+        """
+        Return the nr of deleted records, in compact mode the .tad is decoded in parts.
+        """
+        return sum(len(tadindex.deletedrecords()) for first, tadindex in self.tadparts())
+
+    def tadoffset(self, idx):
+        """
+        Return the .dat offset for .tad entry `idx`.
+        """
+        if self.tadindex is not None:
+            return int(self.tadindex.offsets[idx])
+        return self.tadentry(idx)[0]
+
     def tadidx(self, idx):
         """
         If we're not supposed to be more compact but slower, lookup from a cached .tad
         """
-        if self.compact:
+        if self.tadindex is None:
             return self.tadidx_seek(idx)
 
-        if self.use64bit:
-            # 01.03 and 01.11 have 64 bit file offsets
-            return struct.unpack_from("<QLL", self.idxdata, idx * self.tadentrysize)
-        else:
-            # 01.02  and 01.04  have 32 bit offsets.
-           return struct.unpack_from("<LLL", self.idxdata, idx * self.tadentrysize)
-
+        return self.tadindex.rawentry(idx)
 
     def tadidx_seek(self, idx):
         """
             Memory saving version without caching the .tad
         """
-        self.tad.seek(self.tadhdrlen + idx * self.tadentrysize)
-        idxdata = self.tad.read(self.tadentrysize)
+        if not 0 <= idx < self.nrofrecords:
+            raise IndexError("tad entry %d out of range" % idx)
+        if self.budget is not None:
+            idxdata = self.budget.tadcache.read(self.tad, self.tadhdrlen + idx * self.tadentrysize, self.tadentrysize)
+        else:
+            idxdata = readat(self.tad, self.tadhdrlen + idx * self.tadentrysize, self.tadentrysize)
 
         if self.use64bit:
             # 01.03 and 01.11 have 64 bit file offsets
@@ -126,72 +253,264 @@ class Datafile:
             # 01.02  and 01.04  have 32 bit offsets.
            return struct.unpack("<LLL", idxdata)
 
+    def tadentry(self, idx):
+        """
+        Return offset, length, flags and checksum for .tad entry `idx`,
+        with the flags already separated from the offset or length.
+        """
+        if self.tadindex is not None:
+            return self.tadindex.entry(idx)
+
+        ofs, ln, chk = self.tadidx_seek(idx)
+        return splitentry(ofs, ln, self.isv4()) + (chk,)
+
     def readdata(self, ofs, size):
         """
-        Read raw data from the .dat file
+        Read raw data from the .dat file.
+        When the .dat is mapped, a memoryview slice is returned instead of a copy.
         """
-        self.dat.seek(ofs)
-        return self.dat.read(size)
+        if self.datmap is not None:
+            return self.datmap[ofs:ofs+size]
+        if self.budget is not None:
+            return self.budget.datcache.read(self.dat, ofs, size)
+        return readat(self.dat, ofs, size)
 
     def readrec(self, idx):
         """
         Extract and decode a single record.
         """
+        encdat = self.readencodedrec(idx)
+        if encdat is None:
+            # deleted record
+            return
+
+        return self.decodedata(idx, encdat)
+
+    def readencodedrec(self, idx):
+        """
+        Extract a single record, without KOD decoding or decompressing it.
+        """
         if idx == 0:
             raise Exception("recnum must be a positive number")
-        ofs, ln, chk = self.tadidx(idx - 1)
-        if ln == 0xFFFFFFFF:
+        ofs, ln, flags, chk = self.tadentry(idx - 1)
+        if ln == DELETED:
             # deleted record
             return
 
-        if self.isv3():
-            flags = ln >> 24
-            ln &= 0xFFFFFFF
-        elif self.isv4():
-            flags = ofs >> 56
-            ofs &= (1<<56)-1
-
-        dat = self.readdata(ofs, ln)
+        return self.readencoded(flags, self.readdata(ofs, ln))
 
+    def readencoded(self, flags, dat):
+        """
+        Return the still encoded data for a record, from the data `dat` referenced by its .tad entry.
+        """
         if not dat:
             # empty record
-            encdat = dat
+            return dat
         elif not flags:
-            if self.use64bit:
-                extofs, extlen = struct.unpack("<QL", dat[:12])
-                o = 12
-            else:
-                extofs, extlen = struct.unpack("<LL", dat[:8])
-                o = 8
-
-            encdat = dat[o:]
-            while len(encdat) < extlen:
-                dat = self.readdata(extofs, self.blocksize)
-                if self.use64bit:
-                    (extofs,) = struct.unpack("<Q", dat[:8])
-                    o = 8
-                else:
-                    (extofs,) = struct.unpack("<L", dat[:4])
-                    o = 4
-                encdat += dat[o:]
-
-            encdat = encdat[:extlen]
+            encdat, tail, chain = self.readchain(dat)
+            return encdat
         else:
-            encdat = dat
+            return dat
+
+    def decodedata(self, idx, encdat):
+        """
+        KOD decode and decompress the data for record `idx`.
+        """
+        return decodedata(idx, encdat, self.encoding, self.kod, self.verifycrc)
+
+    def readchain(self, dat):
+        """
+        Reassemble a record which continues in extension blocks.
 
-        if self.encoding & 1:
-            if self.kod:
-                encdat = self.kod.decode(idx, encdat)
+        `dat` is the data referenced by the .tad entry: the offset of the first extension block,
+        the total record size, followed by the first part of the record.
+        Each extension block starts with the offset of the next block.
 
-        if self.iscompressed(encdat):
-            encdat = self.decompress(encdat)
+        Returns the record data, the unused bytes in the last block, and the list of
+        extension offsets which were read, including the next pointer of the last block.
+        """
+        chain = []
+        parts = []
+        for part, tail in self.iterchain(dat, chain):
+            parts.append(part)
+        encdat = parts[0] if len(parts) == 1 else b"".join(parts)
+        return encdat, bytes(tail), chain
+
+    def chainheader(self, dat):
+        """
+        Returns the offset of the first extension block, the total record size,
+        and the size of the header, for the data `dat` referenced by the .tad entry.
+        """
+        size = 12 if self.use64bit else 8
+        if len(dat) < size:
+            raise CorruptChainError("extension header too short: %d bytes" % len(dat))
+        if self.use64bit:
+            extofs, extlen = struct.unpack("<QL", dat[:12])
+            return extofs, extlen, 12
+        extofs, extlen = struct.unpack("<LL", dat[:8])
+        return extofs, extlen, 8
 
-        return encdat
+    def iterchain(self, dat, chain=None):
+        """
+        Yields (part, tail) for the consecutive parts of a record which continues in extension blocks,
+        see `readchain`. `tail` are the unused bytes following `part` in the last block,
+        and empty for the other parts.
+
+        Contiguous extension blocks are read together, but at most MAXREADSIZE bytes at a time,
+        so the record does not have to be read in memory at once.
+        When `chain` is passed, the extension offsets which were read are appended to it.
+        """
+        if chain is None:
+            chain = []
+        extofs, extlen, o = self.chainheader(dat)
+        ptrfmt, ptrsize = ("<Q", 8) if self.use64bit else ("<L", 4)
+
+        chain.append(extofs)
+        first = dat[o:]
+        if len(first) >= extlen:
+            yield first[:extlen], first[extlen:]
+            return
+        yield first, b""
+
+        if self.blocksize <= ptrsize:
+            raise CorruptChainError("invalid blocksize %d for extension blocks" % self.blocksize)
+
+        # the chain can not be longer than this, which bounds the walk.
+        nrblocks = -(-(extlen - len(first)) // (self.blocksize - ptrsize))
+
+        pos = len(first)
+
+        readofs, readbuf = 0, memoryview(b"")
+        visited = set()
+        for blocknr in range(nrblocks):
+            if extofs in visited:
+                raise CorruptChainError("extension chain loops back to %08x" % extofs)
+            visited.add(extofs)
+            rel = extofs - readofs
+            if not (0 <= rel and rel + self.blocksize <= len(readbuf)):
+                count = max(1, min(nrblocks - blocknr, MAXREADSIZE // self.blocksize))
+                readofs, readbuf = extofs, memoryview(self.readdata(extofs, count * self.blocksize))
+                rel = 0
+            block = readbuf[rel:rel + self.blocksize]
+            if len(block) <= ptrsize:
+                raise CorruptChainError("extension block %08x beyond the end of the file" % extofs)
+
+            (extofs,) = struct.unpack_from(ptrfmt, block)
+            chain.append(extofs)
+
+            n = min(len(block) - ptrsize, extlen - pos)
+            pos += n
+            yield block[ptrsize:ptrsize + n], block[ptrsize + n:] if pos == extlen else b""
+
+        if pos < extlen:
+            raise CorruptChainError("extension chain too short: %d of %d bytes" % (pos, extlen))
+
+    def streamrec(self, idx):
+        """
+        Extract and decode a single record in parts, without reading the entire record in memory.
+
+        Returns None for deleted records, otherwise an iterator over the parts of the decoded record,
+        see `decodeparts`.
+        """
+        if idx == 0:
+            raise Exception("recnum must be a positive number")
+        ofs, ln, flags, chk = self.tadentry(idx - 1)
+        if ln == DELETED:
+            # deleted record
+            return
+
+        dat = self.readdata(ofs, ln)
+        if dat and not flags:
+            size = self.chainheader(dat)[1]
+
+            def parts():
+                for part, tail in self.iterchain(dat):
+                    yield part
+        else:
+            size = len(dat)
+
+            def parts():
+                view = memoryview(dat)
+                for o in range(0, size, MAXREADSIZE):
+                    yield view[o:o + MAXREADSIZE]
+
+        return decodeparts(idx, parts, size, self.encoding, self.kod, self.verifycrc)
 
     def enumrecords(self):
         for i in range(self.nrofrecords):
             yield self.readrec(i+1)
 
+    def scanrecords(self, window=None, onerror=None, encoded=False):
+        """
+        Yields (recnum, data) for all records which are not deleted, reading the .dat
+        sequentially in file offset order instead of in record number order.
+
+        When `window` is specified, the records are processed in batches of `window`
+        record numbers, each batch is read in file order, but yielded in record number order.
+        So at most `window` records are buffered.
+        When the .tad is not decoded entirely, see `tadparts`, the records are read in file order
+        within each part of the .tad, so the memory used for the .tad stays bounded.
+
+        When `onerror` is specified, corrupt records, with a broken extension chain or
+        compressed data, are skipped after calling `onerror(recnum, exception)`,
+        otherwise the CorruptRecordError is raised.
+
+        With `encoded` the data is yielded before KOD decoding and decompression.
+        """
+        for first, tadindex in self.tadparts():
+            step = window or len(tadindex) or 1
+            for start in range(0, len(tadindex), step):
+                end = min(start + step, len(tadindex))
+                records = self.readphysical(tadindex, start, end, onerror, first)
+                if window:
+                    records = sorted(records, key=lambda rec: rec[0])
+                for recnum, encdat in records:
+                    if encoded:
+                        yield recnum, encdat
+                        continue
+                    try:
+                        yield recnum, self.decodedata(recnum, encdat)
+                    except CorruptRecordError as e:
+                        if not onerror:
+                            raise
+                        onerror(recnum, e)
+
+    def readphysical(self, tadindex, start, end, onerror=None, first=0):
+        """
+        Yields (recnum, encoded data) for the live records in the .tad range `start` .. `end`,
+        in .dat order, combining records which are close together into a single read.
+        `first` is the index of the first entry in `tadindex`, see `tadparts`.
+        Records with a corrupt extension chain are passed to `onerror`, see `scanrecords`.
+        """
+        group = []
+        groupstart = groupend = 0
+        for i in tadindex.physicalorder(start, end):
+            ofs, ln, flags, chk = tadindex.entry(i)
+            if group and (ofs - groupend > MAXREADGAP or ofs + ln - groupstart > MAXREADSIZE):
+                yield from self.readgroup(groupstart, groupend, group, onerror)
+                group = []
+            if not group:
+                groupstart = ofs
+            group.append((first + i, ofs, ln, flags))
+            groupend = max(groupend, ofs + ln) if len(group) > 1 else ofs + ln
+        if group:
+            yield from self.readgroup(groupstart, groupend, group, onerror)
+
+    def readgroup(self, groupstart, groupend, group, onerror=None):
+        """
+        Read the .dat range `groupstart` .. `groupend` and yield the encoded records in `group`.
+        """
+        data = memoryview(self.readdata(groupstart, groupend - groupstart))
+        for i, ofs, ln, flags in group:
+            try:
+                encdat = self.readencoded(flags, data[ofs - groupstart:ofs - groupstart + ln])
+            except CorruptChainError as e:
+                if not onerror:
+                    raise
+                onerror(i + 1, e)
+                continue
+            yield i + 1, encdat
+
     def enumunreferenced(self, ranges, filesize):
         """
         From a list of used byte ranges and the filesize, enumerate the list of unused byte ranges
@@ -221,23 +540,18 @@ class Datafile:
         ranges = []  # keep track of used bytes in the .dat file.
 
         for i in range(self.nrofrecords):
-            (ofs, ln, chk) = self.tadidx(i)
+            (ofs, ln, flags, chk) = self.tadentry(i)
             idx = i + 1
             if args.maxrecs and i==args.maxrecs:
                 break
-            if ln == 0xFFFFFFFF:
+            if ln == DELETED:
                 print("%5d: %08x %08x %08x" % (idx, ofs, ln, chk))
                 continue
 
-            if self.isv3():
-                flags = ln >> 24
-                ln &= 0xFFFFFFF
-            elif self.isv4():
-                flags = ofs >> 56
-                # 04 --> data, v3compdata
-                # 02,03 --> deleted
-                # 00 --> extrec
-                ofs &= (1<<56)-1
+            # v4 flags:
+            #   04 --> data, v3compdata
+            #   02,03 --> deleted
+            #   00 --> extrec
 
             dat = self.readdata(ofs, ln)
             ranges.append((ofs, ofs + ln, "item #%d" % i))
@@ -249,27 +563,16 @@ class Datafile:
                 # empty record
                 encdat = dat
             elif not flags:
-                if self.use64bit:
-                    extofs, extlen = struct.unpack("<QL", dat[:12])
-                    o = 12
-                else:
-                    extofs, extlen = struct.unpack("<LL", dat[:8])
-                    o = 8
-                infostr = "%08x;%08x" % (extofs, extlen)
-                encdat = dat[o:]
-                while len(encdat) < extlen:
-                    dat = self.readdata(extofs, self.blocksize)
-                    ranges.append((extofs, extofs + self.blocksize, "item #%d ext" % i))
-                    if self.use64bit:
-                        (extofs,) = struct.unpack("<Q", dat[:8])
-                        o = 8
-                    else:
-                        (extofs,) = struct.unpack("<L", dat[:4])
-                        o = 4
-                    infostr += ";%08x" % (extofs)
-                    encdat += dat[o:]
-                tail = encdat[extlen:]
-                encdat = encdat[:extlen]
+                try:
+                    encdat, tail, chain = self.readchain(dat)
+                    infostr = "%08x;%08x" % (chain[0], len(encdat))
+                    for extofs in chain[1:]:
+                        infostr += ";%08x" % (extofs)
+                    for extofs in chain[:-1]:
+                        ranges.append((extofs, extofs + self.blocksize, "item #%d ext" % i))
+                except CorruptChainError as e:
+                    encdat = dat
+                    infostr = "<%s>" % e
                 decflags[0] = "+"
             else:
                 encdat = dat
@@ -282,9 +585,14 @@ class Datafile:
                 decflags[0] = " "
 
             if args.decompress:
-                if self.iscompressed(encdat):
-                    encdat = self.decompress(encdat)
-                    decflags[1] = "@"
+                chunks = self.compressedchunks(encdat)
+                if chunks:
+                    try:
+                        encdat = self.decompress(encdat, chunks)
+                        decflags[1] = "@"
+                    except CompressionError as e:
+                        infostr += "<%s>" % e
+                        decflags[1] = "!"
 
             # TODO: separate handling for v4
             print("%5d: %08x-%08x: (%02x:%08x) %s %s%s %s" % (
@@ -297,48 +605,258 @@ class Datafile:
                 dat = self.readdata(o, l)
                 print("%08x-%08x: %s" % (o, o + l, toout(args, dat)))
 
+    def compressedchunks(self, data):
+        """
+        Check if this record looks like a compressed record.
+        Returns the list of (offset, size) of the chunks, or None for uncompressed records.
+        """
+        return compressedchunks(data)
+
     def iscompressed(self, data):
         """
         Check if this record looks like a compressed record.
         """
-        if len(data) < 11:
+        if compressedchunks(data) is not None:
+            return True
+
+    def decompress(self, data, chunks=None):
+        """
+        Decompress a record, see the `decompress` function.
+        """
+        return decompress(data, chunks, self.verifycrc)
+
+
+def decodedata(idx, encdat, encoding, kod, verifycrc=False):
+    """
+    KOD decode and decompress the data for record `idx`.
+
+    This is a function, so records can also be decoded in a worker process,
+    without access to the Datafile.
+    """
+    if encoding & 1:
+        if kod:
+            encdat = kod.decode(idx, encdat)
+
+    chunks = compressedchunks(encdat)
+    if chunks:
+        encdat = decompress(encdat, chunks, verifycrc)
+
+    if not isinstance(encdat, bytes):
+        # neither KOD decoding nor decompression made a copy yet.
+        encdat = bytes(encdat)
+
+    return encdat
+
+
+class PartReader:
+    """
+    Reads consecutive byte strings from an iterator over the parts of a record.
+    """
+    def __init__(self, parts):
+        self.parts = iter(parts)
+        self.buf = bytearray()
+
+    def read(self, n):
+        """
+        Return the next `n` bytes, or less at the end of the record.
+        """
+        while len(self.buf) < n:
+            part = next(self.parts, None)
+            if part is None:
+                break
+            self.buf += part
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+        return data
+
+    def rest(self):
+        """
+        Yields the remaining parts.
+        """
+        if self.buf:
+            yield bytes(self.buf)
+            self.buf = bytearray()
+        yield from self.parts
+
+
+def decodeparts(idx, parts, size, encoding, kod, verifycrc=False):
+    """
+    KOD decode and decompress record `idx` in parts, the streaming version of `decodedata`.
+
+    `parts` is a function returning an iterator over the still encoded parts of the record,
+    `size` the total size of the encoded record.
+
+    Yields the decoded parts. Compressed records are decompressed one chunk at a time.
+    Whether a record is really compressed is only known after reading it entirely,
+    when a record turns out not to be compressed, or to be corrupt, a None part is yielded,
+    meaning that the parts yielded so far must be discarded, followed by the parts of
+    the correctly decoded record. For corrupt records CompressionError is raised after the None.
+    """
+    def decoded():
+        o = 0
+        for part in parts():
+            if encoding & 1 and kod:
+                part = kod.decode(idx + o, part)
+            o += len(part)
+            yield part
+
+    if size < 11:
+        yield from decoded()
+        return
+
+    reader = PartReader(decoded())
+    hdr = reader.read(4)
+    o = 0
+    while o < size - 3:
+        chunksize, flag = struct.unpack(">HH", hdr)
+        if flag != 0x800 and flag != 0x008:
+            if o:
+                # not compressed after all.
+                yield None
+                yield from decoded()
+            else:
+                yield hdr
+                yield from reader.rest()
             return
-        if data[-3:] != b"\x00\x00\x02":
+        if chunksize < 6 or o + 2 + chunksize > size - 3:
+            break
+
+        chunk = reader.read(chunksize - 2)
+        storedcrc, = struct.unpack_from("<L", chunk)
+        crc = 0
+        try:
+            C = zlib.decompressobj(-15)
+            data = chunk[4:]
+            while True:
+                out = C.decompress(data, MAXREADSIZE)
+                if out:
+                    crc = zlib.crc32(out, crc)
+                    yield out
+                data = C.unconsumed_tail
+                if C.eof or not data and len(out) < MAXREADSIZE:
+                    break
+        except zlib.error:
+            break
+        if verifycrc and crc != storedcrc:
+            break
+
+        o += 2 + chunksize
+        hdr = reader.read(4)
+    else:
+        if hdr[:3] == b"\x00\x00\x02":
             return
-        o = 0
-        while o < len(data) - 3:
-            size, flag = struct.unpack_from(">HH", data, o)
+        # not compressed after all.
+        yield None
+        yield from decoded()
+        return
+
+    # a corrupt chunk, or one which is not what it seems, decode the entire record
+    # to find out which one.
+    yield None
+    yield decodedata(idx, b"".join(parts()), encoding, kod, verifycrc)
+
+
+def peektableid(idx, encdat, encoding, kod):
+    """
+    Return the table id of record `idx`, decoding only a few bytes of the record.
+
+    For compressed records only the chunk headers are KOD decoded,
+    and only the start of the first chunk is decompressed.
+    Returns None for empty records, or when the record can not be decoded.
+    """
+    def dec(o, n):
+        if encoding & 1 and kod:
+            return kod.decode(idx + o, encdat[o:o + n])
+        return bytes(encdat[o:o + n])
+
+    if not encdat:
+        return
+    if len(encdat) >= 11 and dec(len(encdat) - 3, 3) == b"\x00\x00\x02":
+        o, first = 0, None
+        while o < len(encdat) - 3:
+            size, flag = struct.unpack(">HH", dec(o, 4))
             if flag != 0x800 and flag != 0x008:
-                return
+                break
+            if first is None:
+                first = size
             o += size + 2
-        return True
+        else:
+            # a compressed record, inflate the first chunk until the first byte appears.
+            if first < 6 or 2 + first > len(encdat) - 3:
+                return
+            C = zlib.decompressobj(-15)
+            for o in range(8, 2 + first, 64):
+                try:
+                    data = C.decompress(dec(o, min(64, 2 + first - o)), 1)
+                except zlib.error:
+                    return
+                if data:
+                    return data[0]
+            return
+    return dec(0, 1)[0]
+
+
+def compressedchunks(data):
+    """
+    Check if this record looks like a compressed record.
+    Returns the list of (offset, size) of the chunks, or None for uncompressed records.
+    """
+    if len(data) < 11:
+        return
+    if data[-3:] != b"\x00\x00\x02":
+        return
+    chunks = []
+    o = 0
+    while o < len(data) - 3:
+        size, flag = struct.unpack_from(">HH", data, o)
+        if flag != 0x800 and flag != 0x008:
+            return
+        chunks.append((o, size))
+        o += size + 2
+    return chunks
 
-    def decompress(self, data):
-        """
-        Decompress a record.
 
-        Compressed records can have several chunks of compressed data.
-        Note that the compression header uses a mix of big-endian and little numbers.
+def decompress(data, chunks=None, verifycrc=False):
+    """
+    Decompress a record.
 
-        each chunk has the following format:
-            size  - big endian uint16, size of flag + crc + compdata
-            flag  - big endian uint16 - always 0x800
-            crc   - little endian uint32, crc32 of the decompressed data
-        the final chunk has only 3 bytes: a zero size followed by a 2.
+    Compressed records can have several chunks of compressed data.
+    Note that the compression header uses a mix of big-endian and little numbers.
 
-        the crc algorithm is the one labeled 'crc-32' on this page:
-            http://crcmod.sourceforge.net/crcmod.predefined.html
-        """
-        result = b""
-        o = 0
-        while o < len(data) - 3:
-            # note the mix of bigendian and little endian numbers here.
-            size, flag = struct.unpack_from(">HH", data, o)
-            storedcrc, = struct.unpack_from("<L", data, o+4)
+    each chunk has the following format:
+        size  - big endian uint16, size of flag + crc + compdata
+        flag  - big endian uint16 - always 0x800
+        crc   - little endian uint32, crc32 of the decompressed data
+    the final chunk has only 3 bytes: a zero size followed by a 2.
+
+    the crc algorithm is the one labeled 'crc-32' on this page:
+        http://crcmod.sourceforge.net/crcmod.predefined.html
+    The crc is only verified when `verifycrc` is set.
+
+    `chunks` is the result of `compressedchunks`, when already known.
+    Raises CompressionError for corrupt chunks.
+    """
+    if chunks is None:
+        chunks = compressedchunks(data)
+        if chunks is None:
+            raise CompressionError("not a compressed record", 0, 0)
+
+    result = []
+    for i, (o, size) in enumerate(chunks):
+        if size < 6 or o + 2 + size > len(data) - 3:
+            raise CompressionError("chunk size %d exceeds the record" % size, i, o)
 
+        # note the mix of bigendian and little endian numbers here.
+        storedcrc, = struct.unpack_from("<L", data, o+4)
+
+        try:
             C = zlib.decompressobj(-15)
-            result += C.decompress(data[o+8:o+8+size-6])
-            # note that we are not verifying the crc!
+            chunk = C.decompress(data[o+8:o+2+size])
+        except zlib.error as e:
+            raise CompressionError(str(e), i, o)
 
-            o += size + 2
-        return result
+        if verifycrc and zlib.crc32(chunk) != storedcrc:
+            raise CompressionError("crc mismatch, stored %08x, calculated %08x" % (storedcrc, zlib.crc32(chunk)), i, o)
+
+        result.append(chunk)
+    return b"".join(result)
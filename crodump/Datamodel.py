@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+import struct
+from collections.abc import Sequence
+from sys import stderr
 from .hexdump import tohex, ashex
 from .readers import ByteReader
 
@@ -120,7 +123,7 @@ class TableDefinition:
             # Then there's another unknow dword and then (probably section indicator) 02 byte
             self.unk8_ = rd.readdword()
             if rd.readbyte() != 2:
-                print("Warning: FieldDefinition Section 2 not marked with a 2")
+                print("Warning: FieldDefinition Section 2 not marked with a 2", file=stderr)
             self.unk9 = rd.readdword()
 
             # Then there's the amount of extra fields in the second section
@@ -131,14 +134,14 @@ class TableDefinition:
                 fielddef = rd.readbytes(deflen)
                 self.fields.append(FieldDefinition(fielddef))
         except Exception as e:
-            print("Warning: Error '%s' parsing FieldDefinitions" % e)
+            print("Warning: Error '%s' parsing FieldDefinitions" % e, file=stderr)
 
         try:
             self.terminator = rd.readdword()
         except EOFError:
-            print("Warning: FieldDefinition section not terminated")
+            print("Warning: FieldDefinition section not terminated", file=stderr)
         except Exception as e:
-            print("Warning: Error '%s' parsing Tabledefinition" % e)
+            print("Warning: Error '%s' parsing Tabledefinition" % e, file=stderr)
 
         self.fields.sort(key=lambda field: field.idx2)
 
@@ -169,42 +172,61 @@ class TableDefinition:
 
 class Field:
     """
-    Contains a single fully decoded value.
+    Contains a single value, which is decoded when its content is first accessed.
     """
-    def __init__(self, fielddef, data):
-        self.decode(fielddef, data)
+    __slots__ = ("typ", "data", "_content", "flag", "remlen", "filename", "extname", "filedatarecord")
+
+    # the file reference attributes set by `decode`
+    FILEREFERENCE = ("flag", "remlen", "filename", "extname", "filedatarecord")
 
-    def decode(self, fielddef, data):
+    def __init__(self, fielddef, data):
         self.typ = fielddef.typ
         self.data = data
+        self._content = None
+
+    @property
+    def content(self):
+        if self._content is None:
+            self.decode()
+        return self._content
+
+    def __getattr__(self, name):
+        # only called for attributes which were not set yet.
+        if name not in Field.FILEREFERENCE or self._content is not None:
+            raise AttributeError(name)
+        self.decode()
+        return object.__getattribute__(self, name)
+
+    def decode(self):
+        typ, data = self.typ, self.data
 
         if not data:
-            self.content = ""
+            self._content = ""
             return
-        elif self.typ == 0:
+        elif typ == 0:
             # typ 0 is the recno, or as cronos calls this: Системный номер, systemnumber.
             # just convert this to string for presentation
-            self.content = str(data)
+            self._content = str(data)
 
-        elif self.typ == 4:
+        elif typ == 4:
             # typ 4 is DATE, formatted like: <year-1900:signedNumber><month:2digits><day:2digits>
             try:
                 data = data.rstrip(b"\x00")
                 y, m, d = 1900+int(data[:-4]), int(data[-4:-2]), int(data[-2:])
-                self.content = "%04d-%02d-%02d" % (y, m, d)
+                self._content = "%04d-%02d-%02d" % (y, m, d)
             except ValueError:
-                self.content = str(data)
+                self._content = str(data)
 
-        elif self.typ == 5:
+        elif typ == 5:
             # typ 5 is TIME, formatted like: <hour:2digits><minute:2digits>
             try:
                 data = data.rstrip(b"\x00")
                 h, m = int(data[-4:-2]), int(data[-2:])
-                self.content = "%02d:%02d" % (h, m)
+                self._content = "%02d:%02d" % (h, m)
             except ValueError:
-                self.content = str(data)
+                self._content = str(data)
 
-        elif self.typ == 6:
+        elif typ == 6:
             # decode internal file reference
             rd = ByteReader(data)
             self.flag = rd.readdword()
@@ -212,44 +234,174 @@ class Field:
             self.filename = rd.readtoseperator(b"\x1e").decode("cp1251", 'ignore')
             self.extname = rd.readtoseperator(b"\x1e").decode("cp1251", 'ignore')
             self.filedatarecord = rd.readtoseperator(b"\x1e").decode("cp1251", 'ignore')
-            self.content = " ".join([self.filename, self.extname, self.filedatarecord])
+            self._content = " ".join([self.filename, self.extname, self.filedatarecord])
 
-        elif self.typ == 7 or self.typ == 8 or self.typ == 9:
+        elif typ == 7 or typ == 8 or typ == 9:
             # just hexdump foreign keys
-            self.content = ashex(data)
+            self._content = ashex(data)
 
         else:
             # currently assuming everything else to be strings, which is wrong
-            self.content = data.rstrip(b"\x00").decode("cp1251", 'ignore')
+            self._content = data.rstrip(b"\x00").decode("cp1251", 'ignore')
+
+
+def tokenize(data, nrfields):
+    """
+    Split the record `data` in the raw values for `nrfields` fields.
+
+    Fields are separated by 0x1e, a field starting with 0x1b is followed by a dword size
+    and contains that many bytes, this is used for values which may contain 0x1e bytes.
+    Missing fields at the end of the record are returned as empty values.
+    raises EOFError when a 0x1b field extends beyond the end of the record.
+    """
+    if nrfields <= 0:
+        return []
+    values = data.split(b"\x1e", nrfields)
+    if b"\x1b" in data:
+        o = 0
+        for k, value in enumerate(values[:nrfields]):
+            if value[:1] == b"\x1b":
+                return values[:k] + scanfields(data, o, nrfields - k)
+            o += len(value) + 1
+
+    del values[nrfields:]
+    if len(values) < nrfields:
+        values.extend([b""] * (nrfields - len(values)))
+    return values
+
+
+def scanfields(data, o, nrfields):
+    """
+    Returns the raw values for `nrfields` fields, starting at offset `o`, see `tokenize`.
+    """
+    values = []
+    n = len(data)
+    for _ in range(nrfields):
+        if o < n and data[o] == 0x1b:
+            # read complex record indicated by b"\x1b", followed by a dword size
+            if o + 5 > n:
+                raise EOFError()
+            size, = struct.unpack_from("<L", data, o + 1)
+            o += 5
+            if o + size > n:
+                raise EOFError()
+            values.append(data[o:o + size])
+            o += size
+        else:
+            end = data.find(b"\x1e", o)
+            if end < 0:
+                end = n
+            values.append(data[o:end])
+            o = end + 1
+    return values
+
+
+def fileindices(tabledef):
+    """
+    Return the indices of the file reference fields in the tokenized values for `tabledef`.
+    """
+    return [i for i, fielddef in enumerate(tabledef[1:]) if fielddef.typ == 6]
+
+
+def checkvalues(values, fileidx):
+    """
+    File references start with two dwords, report short ones when tokenizing,
+    instead of when they are accessed.
+    """
+    for i in fileidx:
+        if 0 < len(values[i]) < 8:
+            raise EOFError()
+
+
+def tokenizebatch(tabledef, datas):
+    """
+    Tokenize the data of many records for the same `tabledef`.
+    Returns a list with the raw values for each record, or None for records which are too short.
+    The results can be passed as the `values` argument of `Record`.
+    """
+    nrfields = len(tabledef) - 1
+    fileidx = fileindices(tabledef)
+    results = []
+    for data in datas:
+        try:
+            values = tokenize(data, nrfields)
+            checkvalues(values, fileidx)
+        except EOFError:
+            values = None
+        results.append(values)
+    return results
+
+
+class FieldList(Sequence):
+    """
+    The fields of a Record, Field objects are created when first accessed.
+    """
+    __slots__ = ("record", "cache")
+
+    def __init__(self, record):
+        self.record = record
+        self.cache = [None] * len(record.table)
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __iter__(self):
+        cache, getfield = self.cache, self.record.getfield
+        for i, field in enumerate(cache):
+            if field is None:
+                field = cache[i] = getfield(i)
+            yield field
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        field = self.cache[i]
+        if field is None:
+            field = self.cache[i] = self.record.getfield(i)
+        return field
 
 
 class Record:
     """
-    Contains a single fully decoded record.
+    Contains a single record, the raw field values are split up front,
+    the fields are decoded when accessed.
     """
-    def __init__(self, recno, tabledef, data):
-        self.decode(recno, tabledef, data)
+    __slots__ = ("recno", "table", "data", "values", "_fields")
+
+    def __init__(self, recno, tabledef, data, values=None):
+        """
+        `values` optionally the raw field values for `data`, as returned by `tokenizebatch`.
+        """
+        self.decode(recno, tabledef, data, values)
 
-    def decode(self, recno, tabledef, data):
+    def decode(self, recno, tabledef, data, values=None):
         """
-        decode the fields in a record
+        split the record in raw field values
         """
         self.data = data
         self.recno = recno
         self.table = tabledef
+        self._fields = None
 
-        # start with the record number, or as Cronos calls this:
-        # the system number, in russian: Системный номер.
-        self.fields = [ Field(tabledef[0], str(recno)) ]
+        if values is None:
+            values = tokenize(data, len(tabledef) - 1)
+            checkvalues(values, fileindices(tabledef))
 
-        rd = ByteReader(data)
-        for fielddef in tabledef[1:]:
-            if not rd.eof() and rd.testbyte(0x1b):
-                # read complex record indicated by b"\x1b"
-                rd.readbyte()
-                size = rd.readdword()
-                fielddata = rd.readbytes(size)
-            else:
-                fielddata = rd.readtoseperator(b"\x1e")
-
-            self.fields.append(Field(fielddef, fielddata))
+        # the raw values of the fields following the record number.
+        self.values = values
+
+    def getfield(self, i):
+        """
+        Return a new Field object for field `i`.
+        """
+        if i == 0:
+            # start with the record number, or as Cronos calls this:
+            # the system number, in russian: Системный номер.
+            return Field(self.table[0], str(self.recno))
+        return Field(self.table[i], self.values[i - 1])
+
+    @property
+    def fields(self):
+        if self._fields is None:
+            self._fields = FieldList(self)
+        return self._fields
@@ -0,0 +1,84 @@
+"""
+Asynchronous iteration over the blocking generators of a Database.
+
+The generator runs on a worker thread, and its items are passed to the event loop in batches.
+The worker thread is at most `maxbatches` batches ahead of the consumer, so a slow consumer
+also slows down the reading. When the consumer stops iterating, or is cancelled,
+the worker thread stops after the current item, and the generator is closed.
+"""
+import asyncio
+import threading
+
+# marks the end of the items.
+DONE = object()
+
+
+class WorkerError:
+    """
+    Wraps an exception raised by the generator, to be raised again by the consumer.
+    """
+    def __init__(self, exception):
+        self.exception = exception
+
+
+async def abatches(generate, batch_size, maxbatches=2, prepare=None):
+    """
+    Yields lists of at most `batch_size` items from the generator returned by `generate()`,
+    which is called on a worker thread.
+    `prepare` is optionally called for each item on the worker thread.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    # the nr of batches the worker thread may produce before the consumer takes one.
+    credits = threading.Semaphore(maxbatches)
+    stop = threading.Event()
+
+    def deliver(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # the event loop was closed.
+            stop.set()
+
+    def produce():
+        items = None
+        try:
+            credits.acquire()
+            if stop.is_set():
+                return
+            items = generate()
+            batch = []
+            for item in items:
+                if prepare:
+                    prepare(item)
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    deliver(batch)
+                    batch = []
+                    credits.acquire()
+                if stop.is_set():
+                    return
+            if batch:
+                deliver(batch)
+            deliver(DONE)
+        except BaseException as e:
+            deliver(WorkerError(e))
+        finally:
+            if items is not None:
+                items.close()
+
+    thread = threading.Thread(target=produce, name="cronodump-aio", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = await queue.get()
+            if item is DONE:
+                break
+            if isinstance(item, WorkerError):
+                raise item.exception
+            credits.release()
+            yield item
+    finally:
+        stop.set()
+        # wake up the worker thread, when it is waiting for the consumer.
+        credits.release()
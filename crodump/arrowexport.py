@@ -0,0 +1,117 @@
+"""
+Export a cronos database to Parquet files, one file per table, using pyarrow.
+
+Records are collected in column lists, which are written as a row group
+each time `rowgroupsize` records were collected, so memory use is bounded
+by the row group size, not by the table size.
+"""
+import os
+import pyarrow
+import pyarrow.parquet
+from .fieldtypes import converter, valuekind, uniquenames, INTEGER, DATE, TIME
+
+ARROWTYPES = {
+    INTEGER: pyarrow.int64(),
+    DATE: pyarrow.date32(),
+    TIME: pyarrow.time32("ms"),
+}
+
+# file tables are also flushed when this many bytes of file data are collected.
+MAXFILEBYTES = 0x4000000
+
+
+class TableWriter:
+    """
+    Writes the records of a single table to a Parquet file.
+    """
+    def __init__(self, filename, names, types, converters, rowgroupsize, dictionary, compression):
+        self.schema = pyarrow.schema([(name, typ) for name, typ in zip(names, types)])
+        self.converters = converters
+        self.rowgroupsize = rowgroupsize
+        # dictionary encode the string columns, these are often repetitive.
+        usedictionary = [name for name, typ in zip(names, types) if typ == pyarrow.string()] if dictionary else False
+        self.writer = pyarrow.parquet.ParquetWriter(filename, self.schema, use_dictionary=usedictionary, compression=compression)
+        self.columns = [[] for _ in names]
+        self.nrrows = 0
+        self.nrbytes = 0
+
+    def addrecord(self, record):
+        for column, convert, field in zip(self.columns, self.converters, record.fields):
+            column.append(convert(field))
+        self.nrrows += 1
+        if self.nrrows >= self.rowgroupsize:
+            self.flush()
+
+    def addfile(self, recno, data):
+        self.columns[0].append(recno)
+        self.columns[1].append(data)
+        self.nrrows += 1
+        self.nrbytes += len(data)
+        if self.nrrows >= self.rowgroupsize or self.nrbytes >= MAXFILEBYTES:
+            self.flush()
+
+    def flush(self):
+        if self.nrrows:
+            self.writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(self.columns, self.schema)],
+                schema=self.schema))
+        self.columns = [[] for _ in self.columns]
+        self.nrrows = self.nrbytes = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def tablewriter(filename, table, rowgroupsize, dictionary=True, compression="snappy"):
+    """
+    Create a TableWriter for `table`, with column types derived from the field definitions.
+    """
+    names = uniquenames([field.name for field in table.fields])
+    types = [ARROWTYPES.get(valuekind(field), pyarrow.string()) for field in table.fields]
+    converters = [converter(field) for field in table.fields]
+    return TableWriter(filename, names, types, converters, rowgroupsize, dictionary, compression)
+
+
+def filewriter(filename, rowgroupsize, compression="snappy"):
+    """
+    Create a TableWriter for the file table, with a recno and a data column.
+    """
+    return TableWriter(filename, ["recno", "data"], [pyarrow.int64(), pyarrow.binary()], None, rowgroupsize, False, compression)
+
+
+def write_parquet(db, outputdir, rowgroupsize, dictionary=True, compression="snappy", physical=False, window=None, stats=None):
+    """
+    Write all tables of `db` to `outputdir`, reading CroBank once.
+    The file tables are written with their record number and contents.
+    """
+    tables = list(db.enumerate_tables(files=False))
+    filetables = list(db.enumerate_tables(files=True))
+
+    writers = {}
+    filenames = set()
+
+    def parquetname(name, tableid):
+        # use unique filenames, also when several tables have the same name.
+        name = name.replace(':', '_').replace('/', '_').replace('\\', '_')
+        if name in filenames:
+            name += "-%d" % tableid
+        filenames.add(name)
+        return os.path.join(outputdir, name + ".parquet")
+
+    try:
+        for table in tables:
+            writers[table.tableid] = tablewriter(parquetname(table.tablename, table.tableid), table, rowgroupsize, dictionary, compression)
+        for table in filetables:
+            writers[table.tableid] = filewriter(parquetname("Files-" + table.abbrev, table.tableid), rowgroupsize, compression)
+
+        for table, item in db.enumerate_all(tables, filetables, physical, window, stats=stats):
+            if stats is not None:
+                stats[table.tableid] += 1
+            if isinstance(item, tuple):
+                writers[table.tableid].addfile(*item)
+            else:
+                writers[table.tableid].addrecord(item)
+    finally:
+        for writer in writers.values():
+            writer.close()
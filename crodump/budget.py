@@ -0,0 +1,140 @@
+"""
+Bounding the memory used while reading a database.
+
+A MemoryBudget divides a single number of bytes over:
+  * the .tad indexes: a .tad is decoded entirely when it fits the remaining .tad budget,
+    otherwise its entries are read through a paged cache.
+  * a cache of .dat blocks, so records near each other are read with a single read.
+  * the encoded records waiting to be decoded by the worker processes.
+The rest of the budget is left for the decoded records and the output.
+
+The caches are shared by all files of the database, and evict the least recently used blocks.
+They can be used by several threads at once.
+"""
+import re
+import threading
+from collections import OrderedDict
+from .Datafile import readat
+
+# the size of the blocks read into the caches.
+BLOCKSIZE = 0x10000
+
+# the estimated memory used by a decoded TadIndex, per byte of .tad.
+TADINDEXFACTOR = 2
+
+
+def parsesize(text):
+    """
+    Parse a nr of bytes with an optional K, M or G suffix, like "512M".
+    """
+    m = re.match(r"^\s*(\d+)\s*([kmg]?)i?b?\s*$", text, re.I)
+    if not m:
+        raise ValueError("invalid size: %s" % text)
+    return int(m.group(1)) << {"": 0, "k": 10, "m": 20, "g": 30}[m.group(2).lower()]
+
+
+class BlockCache:
+    """
+    A least recently used cache of fixed size blocks read from files.
+    Reads larger than a quarter of the cache are not cached, since they would
+    evict most of the cache.
+    """
+    def __init__(self, name, maxbytes, blocksize=BLOCKSIZE):
+        self.name = name
+        # use smaller blocks for small caches, so they still hold a reasonable nr of blocks.
+        while blocksize > 0x1000 and maxbytes < 16 * blocksize:
+            blocksize //= 2
+        self.blocksize = blocksize
+        self.maxblocks = max(1, maxbytes // blocksize)
+        self.maxread = self.maxblocks * blocksize // 4
+        self.blocks = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.uncached = 0
+
+    def read(self, fh, ofs, size):
+        """
+        Read `size` bytes at `ofs` from `fh`, the result is shorter at the end of the file.
+        """
+        if size <= 0:
+            return b""
+        if size > self.maxread:
+            with self.lock:
+                self.uncached += 1
+            return readat(fh, ofs, size)
+
+        first = ofs // self.blocksize
+        last = (ofs + size - 1) // self.blocksize
+        o = ofs - first * self.blocksize
+        if first >= last:
+            return self.getblock(fh, first)[o:o + size]
+        data = b"".join(self.getblock(fh, blocknr) for blocknr in range(first, last + 1))
+        return data[o:o + size]
+
+    def getblock(self, fh, blocknr):
+        # the key holds a reference to the file, so its id is not reused while cached.
+        key = (fh, blocknr)
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is not None:
+                self.hits += 1
+                self.blocks.move_to_end(key)
+                return block
+            self.misses += 1
+
+        # read without holding the lock, another thread may read the same block meanwhile.
+        block = readat(fh, blocknr * self.blocksize, self.blocksize)
+        with self.lock:
+            self.blocks[key] = block
+            self.blocks.move_to_end(key)
+            if len(self.blocks) > self.maxblocks:
+                self.blocks.popitem(last=False)
+                self.evictions += 1
+        return block
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return "%s cache: %d hits, %d misses (%.1f%% hits), %d evictions, %d uncached reads" % (
+            self.name, self.hits, self.misses, 100.0 * self.hits / lookups if lookups else 0,
+            self.evictions, self.uncached)
+
+
+class MemoryBudget:
+    """
+    Divides `total` bytes over the .tad indexes and caches, the .dat cache,
+    and the records in flight.
+    """
+    def __init__(self, total):
+        self.total = total
+        self.tadbytes = total // 4
+        self.tadcache = BlockCache("tad", total // 16)
+        self.datcache = BlockCache("dat", total // 4)
+        self.inflight = total // 4
+        self.tadindexes = 0
+
+    def reservetad(self, tadsize):
+        """
+        Returns True when a .tad of `tadsize` bytes can be decoded entirely,
+        and reserves the memory for it.
+        """
+        need = TADINDEXFACTOR * tadsize
+        if need > self.tadbytes:
+            return False
+        self.tadbytes -= need
+        self.tadindexes += 1
+        return True
+
+    def tadpartsize(self):
+        """
+        Returns the nr of .tad bytes which can be decoded at once, for a .tad which did not fit.
+        """
+        return self.tadbytes // TADINDEXFACTOR
+
+    def stats(self):
+        """
+        Returns a report of the cache statistics.
+        """
+        return "\n".join([
+            "memory budget: %d bytes, %d .tad files decoded entirely" % (self.total, self.tadindexes),
+            self.tadcache.stats(),
+            self.datcache.stats(),
+        ])
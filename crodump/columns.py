@@ -0,0 +1,177 @@
+"""
+Column oriented batches of records, for analytics.
+
+A batch is a dict mapping the (unique) field names of a table to a column, with one value
+per record. The columns are built from the raw field values of the records, without
+creating Field objects. Values are converted like in the `fieldtypes` module:
+    integer fields  -> int, or a numpy masked int64 array
+    date fields     -> datetime.date, or a numpy datetime64[D] array
+    time fields     -> datetime.time, or a numpy timedelta64[m] array, minutes since midnight
+    other fields    -> str
+Empty fields, and contents which can not be converted, become None, or are masked, NaT.
+Text columns are always lists, numpy arrays of python strings would not save anything.
+"""
+import datetime
+from .Datamodel import Field
+from .fieldtypes import INTEGER, DATE, TIME, TEXT, valuekind, converter, uniquenames
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+INT64MIN, INT64MAX = -(1 << 63), (1 << 63) - 1
+
+
+def rawinteger(value):
+    try:
+        return int(value.rstrip(b"\x00"))
+    except ValueError:
+        return
+
+
+def rawdate(value):
+    # see Field.decode, <year-1900:signedNumber><month:2digits><day:2digits>
+    value = value.rstrip(b"\x00")
+    try:
+        return datetime.date(1900 + int(value[:-4]), int(value[-4:-2]), int(value[-2:]))
+    except ValueError:
+        return
+
+
+def rawtime(value):
+    # see Field.decode, <hour:2digits><minute:2digits>
+    value = value.rstrip(b"\x00")
+    try:
+        return datetime.time(int(value[-4:-2]), int(value[-2:]))
+    except ValueError:
+        return
+
+
+def rawtext(value):
+    return value.rstrip(b"\x00").decode("cp1251", "ignore") or None
+
+
+# decoders for the raw values of the common field types,
+# the other types are decoded through a Field object.
+RAWDECODERS = {
+    1: rawinteger,
+    4: rawdate,
+    5: rawtime,
+}
+
+
+def columndecoder(fielddef, kind):
+    """
+    Return a function converting a list of raw values for `fielddef` to a list of typed values.
+    """
+    decode = RAWDECODERS.get(fielddef.typ)
+    if decode is None and kind == TEXT and fielddef.typ not in (0, 6, 7, 8, 9):
+        decode = rawtext
+    if decode is not None:
+        return lambda values: [decode(value) if value else None for value in values]
+
+    convert = converter(fielddef)
+    return lambda values: [convert(Field(fielddef, value)) for value in values]
+
+
+def toarray(kind, values):
+    """
+    Convert a list of typed values of `kind` to a numpy array.
+    """
+    if kind == INTEGER:
+        mask = [value is None or not INT64MIN <= value <= INT64MAX for value in values]
+        data = [0 if missing else value for value, missing in zip(values, mask)]
+        return numpy.ma.masked_array(numpy.array(data, dtype=numpy.int64), mask=numpy.array(mask, dtype=bool))
+    if kind == DATE:
+        return numpy.array(values, dtype="datetime64[D]")
+    if kind == TIME:
+        return numpy.array([None if value is None else value.hour * 60 + value.minute for value in values],
+                           dtype="timedelta64[m]")
+    return values
+
+
+class ColumnBuilder:
+    """
+    Builds column batches for the records of `table`.
+    `arrays` selects numpy arrays or lists, by default arrays are used when numpy is installed.
+    """
+    def __init__(self, table, arrays=None):
+        if arrays is None:
+            arrays = numpy is not None
+        elif arrays and numpy is None:
+            raise ImportError("numpy arrays need numpy, install using pip install numpy")
+        self.arrays = arrays
+        self.fields = list(table.fields)
+        self.names = uniquenames([field.name for field in self.fields])
+        self.kinds = [valuekind(field) for field in self.fields]
+        self.decoders = [columndecoder(field, kind) for field, kind in zip(self.fields, self.kinds)]
+
+    def build(self, records):
+        """
+        Return the batch for a list of Record objects.
+        """
+        batch = {}
+        if not self.fields:
+            return batch
+        recnos = [record.recno for record in records]
+        columns = list(zip(*[record.values for record in records])) if records else []
+        for i, (name, kind) in enumerate(zip(self.names, self.kinds)):
+            if i == 0:
+                # the first field is the record number, see Record.getfield.
+                if self.fields[0].typ == 0:
+                    values = recnos
+                else:
+                    values = self.decoders[0]([str(recno).encode() for recno in recnos])
+            else:
+                values = self.decoders[i](columns[i - 1] if records else [])
+            batch[name] = toarray(kind, values) if self.arrays else list(values)
+        return batch
+
+    def batches(self, records, batch_size):
+        """
+        Yields batches of at most `batch_size` records from the iterable `records`.
+        """
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= batch_size:
+                yield self.build(chunk)
+                chunk = []
+        if chunk:
+            yield self.build(chunk)
+
+
+def todataframe(batch):
+    """
+    Convert a batch to a pandas DataFrame, integer columns get the nullable Int64 dtype.
+    """
+    if pandas is None:
+        raise ImportError("DataFrames need pandas, install using pip install pandas")
+    frame = {}
+    for name, column in batch.items():
+        if numpy is not None and isinstance(column, numpy.ma.MaskedArray):
+            column = pandas.arrays.IntegerArray(column.data, numpy.ma.getmaskarray(column))
+        frame[name] = column
+    return pandas.DataFrame(frame)
+
+
+def dataframe(table, records, batch_size=100000):
+    """
+    Build a single pandas DataFrame from the Record objects of `table`,
+    the records are converted in batches of `batch_size` records.
+    """
+    if pandas is None:
+        raise ImportError("DataFrames need pandas, install using pip install pandas")
+    builder = ColumnBuilder(table, True)
+    frames = [todataframe(batch) for batch in builder.batches(records, batch_size)]
+    if not frames:
+        return todataframe(builder.build([]))
+    if len(frames) == 1:
+        return frames[0]
+    return pandas.concat(frames, ignore_index=True)
@@ -4,14 +4,28 @@ Commandline tool which convert a cronos database to .csv, .sql or .html.
 python3 croconvert.py -t html chechnya_proverki_ul_2012/
 """
 from .Database import Database
+from .budget import MemoryBudget, parsesize
+from .filestore import FileStore
+from .query import Query, QueryError
 from .crodump import strucrack, dbcrack
 from .hexdump import unhex
-from sys import exit, stdout
-from os.path import dirname, abspath, join
+from . import kodcache, links
+from sys import exit, stdout, stderr
+from os.path import dirname, abspath, join, exists
 from os import mkdir, chdir
 from datetime import datetime
 import base64
 import csv
+import io
+from collections import Counter
+
+
+def recindexname(args):
+    """the `recindex` argument for Database: None, or the index filename, empty for the cache directory"""
+    if args.recindexfile:
+        return args.recindexfile
+    if args.recindex:
+        return ""
 
 
 def template_convert(kod, args):
@@ -23,7 +37,7 @@ def template_convert(kod, args):
             "Fatal: Jinja templating engine not found. Install using pip install jinja2"
         )
 
-    db = Database(args.dbdir, args.compact, kod)
+    db = Database(args.dbdir, args.compact, kod, args.mmap, args.verifycrc, args.jobs, recindexname(args), args.budget, args.vocabulary)
 
     template_dir = join(dirname(dirname(abspath(__file__))), "templates")
     j2_env = Environment(loader=FileSystemLoader(template_dir))
@@ -38,47 +52,214 @@ def safepathname(name):
 def csv_output(kod, args):
     """creates a directory with the current timestamp and in it a set of CSV or TSV
        files with all the tables found and an extra directory with all the files"""
-    db = Database(args.dbdir, args.compact, kod)
+    db = Database(args.dbdir, args.compact, kod, args.mmap, args.verifycrc, args.jobs, recindexname(args), args.budget, args.vocabulary)
 
     mkdir(args.outputdir)
     chdir(args.outputdir)
 
-    filereferences = []
-
-    # first dump all non-file tables
-    for table in db.enumerate_tables(files=False):
-        tablesafename = safepathname(table.tablename) + ".csv"
+    stats = Counter()
 
-        with open(tablesafename, 'w', encoding='utf-8') as csvfile:
-            writer = csv.writer(csvfile, delimiter=args.delimiter, escapechar='\\')
-            writer.writerow([field.name for field in table.fields])
+    # open a csv writer for all non-file tables, and a directory for the file tables,
+    # so all records can be written while reading CroBank only once.
+    tables = list(db.enumerate_tables(files=False))
+    filetables = list(db.enumerate_tables(files=True))
 
-            # Record should be iterable over its fields, so we could use writerows
-            for record in db.enumerate_records(table):
-                writer.writerow([field.content for field in record.fields])
+    # link fields are written as the referenced record numbers, or the named fields of those records.
+    resolver = linknames = None
+    if args.links:
+        resolver = db.linkresolver(tables)
+        resolver.buildindex()
+        linknames = None if args.links == "keys" else args.links.split(",")
 
-                filereferences.extend([field for field in record.fields if field.typ == 6])
+    csvfiles, writers, fileindices, linkindices = [], {}, {}, {}
+    for table in tables:
+        tablesafename = safepathname(table.tablename)
+        if any(f.name == tablesafename + ".csv" for f in csvfiles):
+            tablesafename += "-%d" % table.tableid
+        csvfile = open(tablesafename + ".csv", 'w', encoding='utf-8')
+        csvfiles.append(csvfile)
+        writer = csv.writer(csvfile, delimiter=args.delimiter, escapechar='\\')
+        writer.writerow([field.name for field in table.fields])
+        writers[table.tableid] = writer
+        fileindices[table.tableid] = [i for i, field in enumerate(table.fields) if field.typ == 6]
+        linkindices[table.tableid] = links.linkindices(table)
 
-    # Write all files from the file table. This is useful for unreferenced files
-    for table in db.enumerate_tables(files=True):
+    filedirs = {}
+    for table in filetables:
         filedir = "Files-" + table.abbrev
         mkdir(filedir)
+        filedirs[table.tableid] = filedir
 
-        for system_number, content in db.enumerate_files(table):
-            with open(join(filedir, str(system_number)), "wb") as binfile:
-                binfile.write(content)
+    # the path of each file written from a file table, by record number.
+    filepaths = {}
+    # the record number of each referenced file, by path.
+    filereferences = {}
 
-    if len(filereferences):
-        filedir = "Files-Referenced"
-        mkdir(filedir)
+    # files are written by a pool of threads, identical files are hardlinked.
+    store = FileStore(".", "Files-manifest.csv")
+    try:
+        try:
+            for table, item in db.enumerate_all(tables, filetables, args.physical, args.window, stats=stats):
+                stats[table.tableid] += 1
+                if table.tableid in filedirs:
+                    # Write all files from the file table. This is useful for unreferenced files
+                    system_number, content = item
+                    path = join(filedirs[table.tableid], str(system_number))
+                    store.write(path, content)
+                    filepaths[system_number] = path
+                    continue
+
+                # Record should be iterable over its fields, so we could use writerows
+                row = [field.content for field in item.fields]
+                if resolver:
+                    for i in linkindices[table.tableid]:
+                        content = resolver.content(item.fields[i].data, linknames)
+                        if content is not None:
+                            row[i] = content
+                writers[table.tableid].writerow(row)
+
+                for i in fileindices[table.tableid]:
+                    field = item.fields[i]
+                    if field.content:             # only when file is not NULL
+                        filesafename = safepathname(field.filename) + "." + safepathname(field.extname)
+                        filereferences[join("Files-Referenced", filesafename)] = int(field.filedatarecord)
+        finally:
+            for csvfile in csvfiles:
+                csvfile.close()
+
+        print("%d records exported, %d deleted, %d empty, %d for unknown tables" % (
+            sum(stats[table.tableid] for table in tables + filetables),
+            stats["deleted"], stats["empty"], stats["unknown"]), file=stderr)
+        if resolver:
+            print(resolver.stats(), file=stderr)
+
+        if len(filereferences):
+            mkdir("Files-Referenced")
+
+        # Write all referenced files with their filename and extension intact,
+        # each file record is read only once, and only when it was not in a file table.
+        for path, recno in filereferences.items():
+            source = filepaths.get(recno)
+            if source:
+                store.link(path, source)
+                continue
+            try:
+                parts = db.stream_record(recno)
+                if parts is None:
+                    print("Referenced file record %d is deleted" % recno, file=stderr)
+                    continue
+                store.stream(path, parts)
+            except Exception as e:
+                print("Referenced file record %d broken: ERROR '%s'" % (recno, e), file=stderr)
+                continue
+            filepaths[recno] = path
+    finally:
+        # always write the files already queued, and the manifest.
+        store.close()
+
+
+def parquet_output(kod, args):
+    """creates a directory with one Parquet file per table, including the file tables"""
+    try:
+        from .arrowexport import write_parquet
+    except ImportError:
+        exit(
+            "Fatal: pyarrow not found. Install using pip install pyarrow"
+        )
+
+    db = Database(args.dbdir, args.compact, kod, args.mmap, args.verifycrc, args.jobs, recindexname(args), args.budget, args.vocabulary)
+
+    mkdir(args.outputdir)
+    stats = Counter()
+    write_parquet(db, args.outputdir, args.rowgroupsize, not args.nodictionary, args.compression,
+                  args.physical, args.window, stats)
+
+    print("%d records exported, %d deleted, %d empty, %d for unknown tables" % (
+        sum(n for k, n in stats.items() if isinstance(k, int)),
+        stats["deleted"], stats["empty"], stats["unknown"]), file=stderr)
+
+
+def sqlite_output(kod, args):
+    """creates an SQLite database with all tables, the file tables and the file references"""
+    from .sqliteexport import write_sqlite
+
+    if exists(args.sqlite):
+        exit("Fatal: %s already exists" % args.sqlite)
+
+    db = Database(args.dbdir, args.compact, kod, args.mmap, args.verifycrc, args.jobs, recindexname(args), args.budget, args.vocabulary)
 
-    # Write all referenced files with their filename and extension intact
-    for reffile in filereferences:
-        if reffile.content:             # only print when file is not NULL
-            filesafename = safepathname(reffile.filename) + "." + safepathname(reffile.extname)
-            content = db.get_record(reffile.filedatarecord)
-            with open(join("Files-Referenced", filesafename), "wb") as binfile:
-                binfile.write(content)
+    stats = Counter()
+    write_sqlite(db, args.sqlite, physical=args.physical, window=args.window, stats=stats)
+
+    print("%d records exported, %d deleted, %d empty, %d for unknown tables" % (
+        sum(n for k, n in stats.items() if isinstance(k, int)),
+        stats["deleted"], stats["empty"], stats["unknown"]), file=stderr)
+
+
+def pgcopy_output(kod, args):
+    """writes a PostgreSQL dump using COPY blocks to stdout"""
+    from .pgcopy import write_pgcopy
+
+    db = Database(args.dbdir, args.compact, kod, args.mmap, args.verifycrc, args.jobs, recindexname(args), args.budget, args.vocabulary)
+
+    out = io.TextIOWrapper(stdout.buffer, encoding="utf-8", newline="\n")
+    stats = Counter()
+    try:
+        write_pgcopy(db, out, args.physical, args.window, stats)
+    finally:
+        out.flush()
+        out.detach()
+
+    print("%d records exported, %d deleted, %d empty, %d for unknown tables" % (
+        sum(n for k, n in stats.items() if isinstance(k, int)),
+        stats["deleted"], stats["empty"], stats["unknown"]), file=stderr)
+
+
+def html_output(kod, args):
+    """creates a directory with paginated html pages for all tables, and the files they reference"""
+    from .htmlexport import write_html
+
+    db = Database(args.dbdir, args.compact, kod, args.mmap, args.verifycrc, args.jobs, recindexname(args), args.budget, args.vocabulary)
+
+    mkdir(args.outputdir)
+    stats = Counter()
+    write_html(db, args.outputdir, args.pagesize, args.physical, args.window, stats)
+
+    print("%d records exported, %d deleted, %d empty, %d for unknown tables" % (
+        sum(n for k, n in stats.items() if isinstance(k, int)),
+        stats["deleted"], stats["empty"], stats["unknown"]), file=stderr)
+
+
+def parserecnos(text):
+    """parses a FIRST-LAST record number range, either may be omitted"""
+    first, _, last = text.partition("-")
+    return int(first) if first else None, int(last) if last else None
+
+
+def query_output(kod, args):
+    """writes the selected columns of the matching records of a single table as csv to stdout"""
+    db = Database(args.dbdir, args.compact, kod, args.mmap, args.verifycrc, args.jobs, recindexname(args), args.budget, args.vocabulary)
+
+    for table in db.enumerate_tables(files=False):
+        if table.tablename == args.table or table.abbrev == args.table:
+            break
+    else:
+        exit("Fatal: no table '%s' found" % args.table)
+
+    columns = args.columns.split(",") if args.columns else None
+    try:
+        recnos = parserecnos(args.recnos) if args.recnos else None
+    except ValueError:
+        exit("Fatal: invalid record number range '%s', expected FIRST-LAST" % args.recnos)
+    try:
+        q = Query(table, columns, args.where or ())
+    except QueryError as e:
+        exit("Fatal: %s" % e)
+
+    writer = csv.writer(stdout, delimiter=args.delimiter, escapechar='\\')
+    writer.writerow(q.names)
+    for fields in db.query(table, columns, q.conditions, recnos, args.physical, args.window):
+        writer.writerow([field.content for field in fields])
 
 
 def main():
@@ -89,14 +270,40 @@ def main():
                         help="output template to use for conversion")
     parser.add_argument("--csv", "-c", action='store_true', help="create output in .csv format")
     parser.add_argument("--delimiter", "-d", default=",", help="delimiter used in csv output")
+    parser.add_argument("--html", action="store_true", help="create a directory with html pages, with the files stored separately")
+    parser.add_argument("--pagesize", type=int, default=1000, help="nr of records per page for --html")
+    parser.add_argument("--pgcopy", action="store_true", help="write a PostgreSQL dump using COPY instead of INSERT to stdout")
+    parser.add_argument("--sqlite", type=str, help="create an SQLite database with the given filename")
+    parser.add_argument("--parquet", action="store_true", help="create output in Parquet format, one file per table, needs pyarrow")
+    parser.add_argument("--rowgroupsize", type=int, default=100000, help="nr of records per Parquet row group")
+    parser.add_argument("--compression", type=str, default="snappy", help="Parquet compression codec")
+    parser.add_argument("--nodictionary", action="store_true", help="don't dictionary encode Parquet string columns")
     parser.add_argument("--outputdir", "-o", type=str, help="directory to create the dump in")
     parser.add_argument("--kod", type=str, help="specify custom KOD table")
     parser.add_argument("--compact", action="store_true", help="save memory by not caching the index, note: increases convert time by factor 1.15")
+    parser.add_argument("--mmap", action="store_true", help="memory map the .dat and .tad files instead of reading each record")
+    parser.add_argument("--memory-budget", type=parsesize, help="bound the memory used for caching and decoding to about this size, like 512M, instead of --compact")
+    parser.add_argument("--verifycrc", action="store_true", help="verify the crc32 of compressed records")
+    parser.add_argument("--physical", action="store_true", help="read records in the order they are stored in CroBank.dat, reduces seeking")
+    parser.add_argument("--window", type=int, help="with --physical, output records in record number order, buffering at most WINDOW records")
+    parser.add_argument("--jobs", "-j", type=int, help="decode records using JOBS worker processes")
+    parser.add_argument("--recindex", action="store_true", help="use, or build, a sidecar index of the CroBank records in the cache directory")
+    parser.add_argument("--recindexfile", type=str, help="use, or build, a sidecar index of the CroBank records in RECINDEXFILE")
+    parser.add_argument("--vocabulary", action="store_true", help="resolve dictionary fields using the vocabulary database in the Voc subdirectory")
+    parser.add_argument("--links", type=str, help="with --csv, write link fields as the referenced record numbers with 'keys', or as the comma separated fields of the referenced records")
+    parser.add_argument("--table", type=str, help="only export the table with this name or abbreviation, as csv to stdout")
+    parser.add_argument("--columns", type=str, help="with --table, a comma separated list of the fields to export")
+    parser.add_argument("--where", type=str, action="append", help="with --table, only export records matching: name=value, name~substring, or name=low..high")
+    parser.add_argument("--recnos", type=str, help="with --table, only export records in the range FIRST-LAST")
     parser.add_argument("--strucrack", action="store_true", help="infer the KOD sbox from CroStru.dat")
     parser.add_argument("--dbcrack", action="store_true", help="infer the KOD sbox from CroIndex.dat+CroBank.dat")
     parser.add_argument("--nokod", "-n", action="store_true", help="don't KOD decode")
+    parser.add_argument("--nokodcache", action="store_true", help="don't use the KOD cache for --strucrack and --dbcrack")
     parser.add_argument("dbdir", type=str)
     args = parser.parse_args()
+    if args.links and (not args.csv or args.table or args.sqlite or args.pgcopy or args.parquet or args.html):
+        parser.error("--links can only be used with --csv")
+    args.budget = MemoryBudget(args.memory_budget) if args.memory_budget else None
 
     import crodump.koddecoder
     if args.kod:
@@ -109,9 +316,10 @@ def main():
         class Cls: pass
         cargs = Cls()
         cargs.dbdir = args.dbdir
+        cargs.compact = args.compact
         cargs.sys = False
         cargs.silent = True
-        cracked = strucrack(None, cargs)
+        cracked = kodcache.cachedcrack(args.dbdir, "strucrack", lambda: strucrack(None, cargs), not args.nokodcache)
         if not cracked:
             return
         kod = crodump.koddecoder.new(cracked)
@@ -119,22 +327,37 @@ def main():
         class Cls: pass
         cargs = Cls()
         cargs.dbdir = args.dbdir
+        cargs.compact = args.compact
         cargs.sys = False
         cargs.silent = True
-        cracked = dbcrack(None, cargs)
+        cracked = kodcache.cachedcrack(args.dbdir, "dbcrack", lambda: dbcrack(None, cargs), not args.nokodcache)
         if not cracked:
             return
         kod = crodump.koddecoder.new(cracked)
     else:
         kod = crodump.koddecoder.new()
 
-    if args.csv:
+    if args.table:
+        query_output(kod, args)
+    elif args.sqlite:
+        sqlite_output(kod, args)
+    elif args.pgcopy:
+        pgcopy_output(kod, args)
+    elif args.csv or args.parquet or args.html:
         if not args.outputdir:
             args.outputdir = "cronodump"+datetime.now().strftime("-%Y-%m-%d-%H-%M-%S-%f")
-        csv_output(kod, args)
+        if args.parquet:
+            parquet_output(kod, args)
+        elif args.html:
+            html_output(kod, args)
+        else:
+            csv_output(kod, args)
     else:
         template_convert(kod, args)
 
+    if args.budget:
+        print(args.budget.stats(), file=stderr)
+
 
 if __name__ == "__main__":
     main()
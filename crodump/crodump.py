@@ -1,8 +1,12 @@
+from sys import stderr
 from .kodump import kod_hexdump
 from .hexdump import unhex, tohex
 from .readers import ByteReader
 from .Database import Database
 from .Datamodel import TableDefinition
+from .budget import MemoryBudget, parsesize
+from . import kodcache
+from .kodcrack import KODHistogram, batches
 
 
 def destruct_sys3_def(rd):
@@ -51,13 +55,13 @@ def cro_dump(kod, args):
         # an arbitrarily large number.
         args.maxrecs = 0xFFFFFFFF
 
-    db = Database(args.dbdir, args.compact, kod)
+    db = Database(args.dbdir, args.compact, kod, args.mmap, args.verifycrc, budget=args.budget)
     db.dump(args)
 
 
 def stru_dump(kod, args):
     """handle 'strudump' subcommand"""
-    db = Database(args.dbdir, args.compact, kod)
+    db = Database(args.dbdir, args.compact, kod, args.mmap, args.verifycrc, budget=args.budget)
     db.strudump(args)
 
 
@@ -66,7 +70,7 @@ def sys_dump(kod, args):
     # an arbitrarily large number.
     args.maxrecs = 0xFFFFFFFF
 
-    db = Database(args.dbdir, args.compact, kod)
+    db = Database(args.dbdir, args.compact, kod, args.mmap, args.verifycrc, budget=args.budget)
     if db.sys:
         db.sys.dump(args)
 
@@ -79,7 +83,7 @@ def rec_dump(kod, args):
         # an arbitrarily large number.
         args.maxrecs = 0xFFFFFFFF
 
-    db = Database(args.dbdir, args.compact, kod)
+    db = Database(args.dbdir, args.compact, kod, args.mmap, args.verifycrc, budget=args.budget)
     db.recdump(args)
 
 
@@ -124,21 +128,33 @@ def strucrack(kod, args):
             print("no CroStru.dat file found in %s" % args.dbdir)
             return
 
-    xref = [ [0]*256 for _ in range(256) ]
-    for i, data in enumerate(table.enumrecords()):
-        if not data: continue
-        for ofs, byte in enumerate(data):
-            xref[(ofs+i+1)%256][byte] += 1
+    hist = KODHistogram()
+    records = ((i + 1, data) for i, data in enumerate(table.enumrecords()))
+    for batch in batches(records, getattr(args, "batchsize", 1000)):
+        hist.add(batch)
+        if hist.converged(getattr(args, "stable", 3)):
+            break
 
-    KOD = [0] * 256
-    for i, xx in enumerate(xref):
-        k, v = max(enumerate(xx), key=lambda kv: kv[1])
-        KOD[k] = i
+    return crackresult(hist, args)
+
+
+def crackresult(hist, args):
+    """
+    Print the KOD table inferred by `strucrack` or `dbcrack`,
+    returns the table, and whether it is unambiguous.
+    """
+    KOD, margins = hist.table()
 
     if not args.silent:
+        # only the table goes to stdout, so it can be passed to --kod.
         print(tohex(bytes(KOD)))
+        if not hist.unambiguous:
+            print("WARN: the KOD table is ambiguous, lowest confidence margin: %.2f" % min(margins), file=stderr)
+        if getattr(args, "verbose", False):
+            for i, margin in enumerate(margins):
+                print("%02x: %.2f" % (i, margin), file=stderr)
 
-    return KOD
+    return KOD, hist.unambiguous
 
 def dbcrack(kod, args):
     """
@@ -154,26 +170,42 @@ def dbcrack(kod, args):
     """
     # start without 'KOD' table, so we will get the encrypted records
     db = Database(args.dbdir, args.compact, None)
-    xref = [ [0]*256 for _ in range(256) ]
-
     for dbfile in db.bank, db.index:
         if not dbfile:
             print("no data file found in %s" % args.dbdir)
             return
-        for i in range(1, min(10000, dbfile.nrofrecords)):
-            rec = dbfile.readrec(i)
-            if rec and len(rec)>11:
-                xref[(i+3)%256][rec[3]] += 1
 
-    KOD = [0] * 256
-    for i, xx in enumerate(xref):
-        k, v = max(enumerate(xx), key=lambda kv: kv[1])
-        KOD[k] = i
+    def samples():
+        for dbfile in db.bank, db.index:
+            for i in range(1, min(10000, dbfile.nrofrecords)):
+                rec = dbfile.readrec(i)
+                if rec and len(rec)>11:
+                    yield i + 3, rec[3:4]
 
-    if not args.silent:
-        print(tohex(bytes(KOD)))
+    hist = KODHistogram()
+    for batch in batches(samples(), getattr(args, "batchsize", 1000)):
+        hist.add(batch)
+        if hist.converged(getattr(args, "stable", 3)):
+            break
 
-    return KOD
+    return crackresult(hist, args)
+
+
+def kod_cache(kod, args):
+    """
+    handle the 'kodcache' subcommand, show, export or invalidate the cached KOD tables.
+    """
+    if args.invalidate:
+        kodcache.invalidate(args.dbdir)
+        return
+
+    for method, cached in kodcache.entries(args.dbdir):
+        if args.method and method != args.method:
+            continue
+        if args.export:
+            print(tohex(bytes(cached)))
+        else:
+            print("%-10s %s" % (method, tohex(bytes(cached))))
 
 
 def main():
@@ -188,7 +220,11 @@ def main():
     parser.add_argument("--strucrack", action="store_true", help="infer the KOD sbox from CroStru.dat")
     parser.add_argument("--dbcrack", action="store_true", help="infer the KOD sbox from CroBank.dat + CroIndex.dat")
     parser.add_argument("--nokod", "-n", action="store_true", help="don't KOD decode")
+    parser.add_argument("--nokodcache", action="store_true", help="don't use the KOD cache for --strucrack and --dbcrack")
     parser.add_argument("--compact", action="store_true", help="save memory by not caching the index, note: increases convert time by factor 1.15")
+    parser.add_argument("--mmap", action="store_true", help="memory map the .dat and .tad files instead of reading each record")
+    parser.add_argument("--memory-budget", type=parsesize, help="bound the memory used for caching to about this size, like 512M, instead of --compact")
+    parser.add_argument("--verifycrc", action="store_true", help="verify the crc32 of compressed records")
 
     p = subparsers.add_parser("kodump", help="KOD/hex dumper")
     p.add_argument("--offset", "-o", type=str, default="0")
@@ -248,15 +284,29 @@ def main():
     p = subparsers.add_parser("strucrack", help="Crack v4 KOD encrypion, bypassing the need for the database password.")
     p.add_argument("--sys", action="store_true", help="Use CroSys for cracking")
     p.add_argument("--silent", action="store_true", help="no output")
+    p.add_argument("--verbose", "-v", action="store_true", help="print the confidence margin for each row")
+    p.add_argument("--batchsize", type=int, default=1000, help="nr of records per convergence check")
+    p.add_argument("--stable", type=int, default=3, help="stop after the KOD table was unchanged for this many batches, 0: read all records")
     p.add_argument("dbdir", type=str)
     p.set_defaults(handler=strucrack)
 
     p = subparsers.add_parser("dbcrack", help="Crack v4 KOD encrypion, bypassing the need for the database password.")
     p.add_argument("--silent", action="store_true", help="no output")
+    p.add_argument("--verbose", "-v", action="store_true", help="print the confidence margin for each row")
+    p.add_argument("--batchsize", type=int, default=1000, help="nr of records per convergence check")
+    p.add_argument("--stable", type=int, default=3, help="stop after the KOD table was unchanged for this many batches, 0: read all records")
     p.add_argument("dbdir", type=str)
     p.set_defaults(handler=dbcrack)
 
+    p = subparsers.add_parser("kodcache", help="Show, export or invalidate the KOD tables cached by --strucrack and --dbcrack.")
+    p.add_argument("--method", choices=kodcache.METHODS, help="only the KOD table found with this method")
+    p.add_argument("--export", action="store_true", help="output only the KOD table, for use with --kod")
+    p.add_argument("--invalidate", action="store_true", help="remove the cached KOD tables")
+    p.add_argument("dbdir", type=str)
+    p.set_defaults(handler=kod_cache)
+
     args = parser.parse_args()
+    args.budget = MemoryBudget(args.memory_budget) if args.memory_budget else None
 
     import crodump.koddecoder
     if args.kod:
@@ -269,9 +319,10 @@ def main():
         class Cls: pass
         cargs = Cls()
         cargs.dbdir = args.dbdir
+        cargs.compact = args.compact
         cargs.sys = False
         cargs.silent = True
-        cracked = strucrack(None, cargs)
+        cracked = kodcache.cachedcrack(args.dbdir, "strucrack", lambda: strucrack(None, cargs), not args.nokodcache)
         if not cracked:
             return
         kod = crodump.koddecoder.new(cracked)
@@ -279,9 +330,10 @@ def main():
         class Cls: pass
         cargs = Cls()
         cargs.dbdir = args.dbdir
+        cargs.compact = args.compact
         cargs.sys = False
         cargs.silent = True
-        cracked = dbcrack(None, cargs)
+        cracked = kodcache.cachedcrack(args.dbdir, "dbcrack", lambda: dbcrack(None, cargs), not args.nokodcache)
         if not cracked:
             return
         kod = crodump.koddecoder.new(cracked)
@@ -291,6 +343,10 @@ def main():
     if args.handler:
         args.handler(kod, args)
 
+    if args.budget:
+        import sys
+        print(args.budget.stats(), file=sys.stderr)
+
 
 if __name__ == "__main__":
     main()
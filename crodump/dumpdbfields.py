@@ -6,6 +6,7 @@ import os.path
 from .Database import Database
 from .crodump import strucrack, dbcrack
 from .hexdump import unhex
+from . import kodcache
 
 
 def processargs(args):
@@ -27,6 +28,7 @@ def main():
     parser.add_argument("--strucrack", action="store_true", help="infer the KOD sbox from CroStru.dat")
     parser.add_argument("--dbcrack", action="store_true", help="infer the KOD sbox from CroIndex.dat+CroBank.dat")
     parser.add_argument("--nokod", "-n", action="store_true", help="don't KOD decode")
+    parser.add_argument("--nokodcache", action="store_true", help="don't use the KOD cache for --strucrack and --dbcrack")
     parser.add_argument("--maxrecs", "-m", type=int, default=100)
     parser.add_argument("--recurse", "-r", action="store_true")
     parser.add_argument("--verbose", "-v", action="store_true")
@@ -46,9 +48,10 @@ def main():
                 class Cls: pass
                 cargs = Cls()
                 cargs.dbdir = path
+                cargs.compact = False
                 cargs.sys = False
                 cargs.silent = True
-                cracked = strucrack(None, cargs)
+                cracked = kodcache.cachedcrack(path, "strucrack", lambda: strucrack(None, cargs), not args.nokodcache)
                 if not cracked:
                     return
                 kod = crodump.koddecoder.new(cracked)
@@ -56,16 +59,17 @@ def main():
                 class Cls: pass
                 cargs = Cls()
                 cargs.dbdir = path
+                cargs.compact = False
                 cargs.sys = False
                 cargs.silent = True
-                cracked = dbcrack(None, cargs)
+                cracked = kodcache.cachedcrack(path, "dbcrack", lambda: dbcrack(None, cargs), not args.nokodcache)
                 if not cracked:
                     return
                 kod = crodump.koddecoder.new(cracked)
             else:
                 kod = crodump.koddecoder.new()
 
-            db = Database(path, kod)
+            db = Database(path, False, kod)
             for tab in db.enumerate_tables():
                 tab.dump(args)
                 print("nr of records: %d" % db.bank.nrofrecords)
@@ -0,0 +1,94 @@
+"""
+Conversion of field contents to typed values, for the typed output formats.
+
+The kind of value is derived from `FieldDefinition.sqltype()`:
+    INTEGER, INTEGER PRIMARY KEY  -> int
+    DATE                          -> datetime.date
+    TIMESTAMP                     -> datetime.time, cronos only stores the hour and minute
+    anything else                 -> str
+Empty fields, and contents which can not be converted, become None.
+"""
+import datetime
+
+INTEGER = "integer"
+DATE = "date"
+TIME = "time"
+TEXT = "text"
+
+
+def valuekind(fielddef):
+    """
+    Return the kind of value stored in fields for `fielddef`.
+    """
+    sqltype = fielddef.sqltype()
+    if sqltype.startswith("INTEGER"):
+        return INTEGER
+    if sqltype == "DATE":
+        return DATE
+    if sqltype == "TIMESTAMP":
+        return TIME
+    return TEXT
+
+
+def tointeger(content):
+    try:
+        return int(content)
+    except ValueError:
+        return
+
+
+def todate(content):
+    try:
+        y, m, d = content.rsplit("-", 2)
+        return datetime.date(int(y), int(m), int(d))
+    except ValueError:
+        return
+
+
+def totime(content):
+    try:
+        h, m = content.split(":")
+        return datetime.time(int(h), int(m))
+    except ValueError:
+        return
+
+
+CONVERTERS = {
+    INTEGER: tointeger,
+    DATE: todate,
+    TIME: totime,
+    TEXT: str,
+}
+
+
+def converter(fielddef):
+    """
+    Return a function converting a Field for `fielddef` to its typed value.
+    """
+    convert = CONVERTERS[valuekind(fielddef)]
+
+    def fieldvalue(field):
+        content = field.content
+        if not content:
+            return
+        return convert(content)
+
+    return fieldvalue
+
+
+def uniquenames(names, ignorecase=False):
+    """
+    Make the column names unique, by appending the column number to duplicates.
+    With `ignorecase` names differing only in case are duplicates too, like in SQLite.
+    """
+    def key(name):
+        return name.lower() if ignorecase else name
+
+    seen = set()
+    result = []
+    for i, name in enumerate(names):
+        while key(name) in seen:
+            name = "%s_%d" % (name, i)
+        seen.add(key(name))
+        result.append(name)
+    return result
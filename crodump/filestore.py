@@ -0,0 +1,161 @@
+"""
+Writing extracted files to disk, deduplicated by content.
+
+Each distinct content is written once, identical files are hardlinked to the first copy,
+or copied when the filesystem does not support hardlinks. A manifest csv file lists the
+path, size and sha256 of all files written, so duplicates can also be found from the manifest.
+
+Data which is already in memory is hashed and written by a pool of threads,
+records which are read in parts are streamed to disk by the calling thread.
+"""
+import csv
+import hashlib
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# nr of threads writing files.
+WRITERS = 4
+
+# streamed data is written by the pool when it turns out to be smaller than this.
+STREAMBUFFER = 0x100000
+
+
+class FileStore:
+    """
+    Writes files below `outputdir`, paths passed to the methods are relative to `outputdir`.
+    The manifest is written to `manifest` when the store is closed.
+    """
+    def __init__(self, outputdir, manifest="manifest.csv", writers=WRITERS):
+        self.outputdir = outputdir
+        self.manifest = manifest
+        self.pool = ThreadPoolExecutor(writers)
+        # bounds the nr of files waiting for the pool, and so the memory used by their data.
+        self.pending = threading.BoundedSemaphore(4 * writers)
+        self.lock = threading.Lock()
+        # maps the sha256 of each distinct content to the path of its first copy.
+        self.bydigest = {}
+        # maps each path to the future writing it, the result is its (size, digest).
+        self.files = {}
+
+    def submit(self, path, func, *args):
+        self.pending.acquire()
+        try:
+            # the lock makes sure the future is known before the pool looks for it.
+            with self.lock:
+                future = self.pool.submit(func, *args)
+                self.files[path] = future
+        except BaseException:
+            self.pending.release()
+            raise
+        future.add_done_callback(lambda f: self.pending.release())
+        return future
+
+    def write(self, path, data):
+        """
+        Write `data` to `path`.
+        """
+        return self.submit(path, self.writedata, path, data)
+
+    def link(self, path, source):
+        """
+        Make `path` a copy of `source`, which was written before.
+        """
+        return self.submit(path, self.linkfile, path, source)
+
+    def stream(self, path, parts):
+        """
+        Write `path` from an iterator over parts, see `Datafile.decodeparts`:
+        a None part discards the data written before.
+        Small files are handed to the pool, the rest is written by the calling thread.
+        """
+        parts = iter(parts)
+        buf = []
+        size = 0
+        for part in parts:
+            if part is None:
+                buf, size = [], 0
+                continue
+            buf.append(part)
+            size += len(part)
+            if size >= STREAMBUFFER:
+                break
+        else:
+            return self.write(path, b"".join(buf))
+
+        digest = hashlib.sha256()
+        try:
+            with open(self.fullpath(path), "wb") as fh:
+                for part in buf:
+                    fh.write(part)
+                    digest.update(part)
+                for part in parts:
+                    if part is None:
+                        fh.seek(0)
+                        fh.truncate()
+                        digest, size = hashlib.sha256(), 0
+                        continue
+                    fh.write(part)
+                    digest.update(part)
+                    size += len(part)
+        except BaseException:
+            # do not leave a partial file behind.
+            os.unlink(self.fullpath(path))
+            raise
+        # the file was written already, only deduplicate it in the pool.
+        return self.submit(path, self.dedup, path, size, digest.hexdigest(), None)
+
+    def fullpath(self, path):
+        return os.path.join(self.outputdir, path)
+
+    def writedata(self, path, data):
+        digest = hashlib.sha256(data).hexdigest()
+        return self.dedup(path, len(data), digest, data)
+
+    def dedup(self, path, size, digest, data):
+        """
+        Link `path` to an earlier file with the same `digest`, otherwise write `data` to it,
+        when `data` is None `path` was already written.
+        """
+        with self.lock:
+            first = self.bydigest.get(digest)
+            if first is None:
+                self.bydigest[digest] = path
+        if first is None:
+            if data is not None:
+                with open(self.fullpath(path), "wb") as fh:
+                    fh.write(data)
+        else:
+            self.linkfile(path, first)
+        return size, digest
+
+    def linkfile(self, path, source):
+        """
+        Make `path` a hardlink to `source`, or a copy of it, once `source` is written.
+        """
+        with self.lock:
+            future = self.files[source]
+        size, digest = future.result()
+        sourcepath = self.fullpath(source)
+        fullpath = self.fullpath(path)
+        if os.path.lexists(fullpath):
+            os.unlink(fullpath)
+        try:
+            os.link(sourcepath, fullpath)
+        except OSError:
+            shutil.copyfile(sourcepath, fullpath)
+        return size, digest
+
+    def close(self):
+        """
+        Wait for all writes to finish, and write the manifest.
+        Raises the first error of the writes.
+        """
+        self.pool.shutdown()
+        with open(self.fullpath(self.manifest), "w", encoding="utf-8", newline="") as fh:
+            writer = csv.writer(fh)
+            writer.writerow(["path", "size", "sha256"])
+            for path in sorted(self.files):
+                size, digest = self.files[path].result()
+                writer.writerow([path.replace(os.sep, "/"), size, digest])
@@ -0,0 +1,182 @@
+"""
+Export a cronos database as a directory of static HTML pages.
+
+Each table is split in pages of `pagesize` records, linked to the previous and next page.
+File contents and table images are written to the `files` subdirectory, and linked from
+the pages, instead of being inlined as base64 data URIs, identical files are hardlinked.
+The pages are written while reading CroBank once, so memory use does not depend on
+the size of the database. `index.html` lists all tables, and is written last.
+"""
+import os
+from html import escape
+from sys import stderr
+from .fieldtypes import tointeger
+from .filestore import FileStore
+
+HEADER = """<!DOCTYPE html>
+<html lang="en">
+  <head>
+    <meta charset="utf-8">
+    <title>%s</title>
+  </head>
+  <body>
+"""
+
+FOOTER = """  </body>
+</html>
+"""
+
+
+def pagename(tableid, pagenr):
+    return "table-%d-%d.html" % (tableid, pagenr)
+
+
+def filelink(recno, filename=None):
+    """
+    Return a link to the contents of file record `recno`.
+    """
+    if filename:
+        return '<a download="%s" href="files/%d">%s</a>' % (escape(filename), recno, escape(filename))
+    return '<a href="files/%d">File content</a>' % recno
+
+
+class PageWriter:
+    """
+    Writes the records of a single table to a sequence of pages.
+    """
+    def __init__(self, outputdir, table, pagesize, isfiletable):
+        self.outputdir = outputdir
+        self.table = table
+        self.pagesize = pagesize
+        self.isfiletable = isfiletable
+        self.pagenr = 0
+        self.nrrows = 0
+        self.nrrecords = 0
+        self.fh = None
+        self.fileindices = [i for i, field in enumerate(table.fields) if field.typ == 6]
+
+    def startpage(self):
+        self.pagenr += 1
+        self.nrrows = 0
+        self.fh = open(os.path.join(self.outputdir, pagename(self.table.tableid, self.pagenr)), "w", encoding="utf-8")
+        self.fh.write(HEADER % escape("%s - page %d" % (self.table.tablename, self.pagenr)))
+        self.fh.write('    <p><a href="index.html">index</a>')
+        if self.pagenr > 1:
+            self.fh.write(' <a href="%s">previous</a>' % pagename(self.table.tableid, self.pagenr - 1))
+        self.fh.write("</p>\n    <table>\n      <caption>%s</caption>\n      <thead>\n        <tr>" % escape(self.table.tablename))
+        if self.isfiletable:
+            # file tables are written as the record number, with a link to the file.
+            self.fh.write("<th>%s</th><th>Data</th>" % escape(self.table.fields[0].name if self.table.fields else ""))
+        else:
+            for field in self.table.fields:
+                self.fh.write("<th>%s</th>" % escape(field.name))
+        self.fh.write("</tr>\n      </thead>\n      <tbody>\n")
+
+    def endpage(self, hasnext):
+        self.fh.write("      </tbody>\n    </table>\n")
+        if hasnext:
+            self.fh.write('    <p><a href="%s">next</a></p>\n' % pagename(self.table.tableid, self.pagenr + 1))
+        self.fh.write(FOOTER)
+        self.fh.close()
+        self.fh = None
+
+    def startrow(self):
+        if self.fh and self.nrrows == self.pagesize:
+            self.endpage(True)
+        if not self.fh:
+            self.startpage()
+        self.nrrows += 1
+        self.nrrecords += 1
+
+    def addfile(self, recno):
+        self.startrow()
+        self.fh.write("        <tr><td>%d</td><td>%s</td></tr>\n" % (recno, filelink(recno)))
+
+    def addrecord(self, record, references):
+        """
+        Write a row for `record`, the record numbers of referenced files are added to `references`.
+        """
+        self.startrow()
+        cells = [escape(field.content) for field in record.fields]
+        for i in self.fileindices:
+            field = record.fields[i]
+            recno = field.content and tointeger(field.filedatarecord)
+            if recno:
+                references.add(recno)
+                cells[i] = filelink(recno, "%s.%s" % (field.filename, field.extname))
+        self.fh.write("        <tr>%s</tr>\n" % "".join("<td>%s</td>" % cell for cell in cells))
+
+    def close(self):
+        if not self.fh and not self.pagenr:
+            # always create the first page, also for empty tables.
+            self.startpage()
+        if self.fh:
+            self.endpage(False)
+
+
+def write_html(db, outputdir, pagesize=1000, physical=False, window=None, stats=None):
+    """
+    Write all tables of `db` as pages of `pagesize` records to `outputdir`.
+    """
+    filedir = os.path.join(outputdir, "files")
+    os.makedirs(filedir, exist_ok=True)
+
+    tables = list(db.enumerate_tables(files=False))
+    filetables = list(db.enumerate_tables(files=True))
+
+    writers = {}
+    for table in filetables:
+        writers[table.tableid] = PageWriter(outputdir, table, pagesize, True)
+    for table in tables:
+        writers[table.tableid] = PageWriter(outputdir, table, pagesize, False)
+
+    written = set()
+    references = set()
+    store = FileStore(filedir)
+    try:
+        try:
+            for table, item in db.enumerate_all(tables, filetables, physical, window, stats=stats):
+                if stats is not None:
+                    stats[table.tableid] += 1
+                if isinstance(item, tuple):
+                    recno, data = item
+                    store.write(str(recno), data)
+                    written.add(recno)
+                    writers[table.tableid].addfile(recno)
+                else:
+                    writers[table.tableid].addrecord(item, references)
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        # files referenced from records, but not found in a file table.
+        for recno in sorted(references - written):
+            try:
+                parts = db.stream_record(recno)
+                if parts is None:
+                    print("Referenced file record %d is deleted" % recno, file=stderr)
+                    continue
+                store.stream(str(recno), parts)
+            except Exception as e:
+                print("Referenced file record %d broken: ERROR '%s'" % (recno, e), file=stderr)
+    finally:
+        # always write the files already queued, and the manifest.
+        store.close()
+
+    with open(os.path.join(outputdir, "index.html"), "w", encoding="utf-8") as fh:
+        fh.write(HEADER % "Cronos Database Dump")
+        fh.write("    <table>\n      <thead>\n        <tr><th>Table</th><th>Records</th><th>Pages</th></tr>\n      </thead>\n      <tbody>\n")
+        for table in filetables + tables:
+            writer = writers[table.tableid]
+            fh.write('        <tr><td><a href="%s">%s</a></td><td>%d</td><td>%d</td></tr>\n' % (
+                pagename(table.tableid, 1), escape(table.tablename), writer.nrrecords, writer.pagenr))
+        fh.write("      </tbody>\n    </table>\n")
+        for table in tables:
+            image = table.tableimage
+            if image.data:
+                ext = "".join(c for c in os.path.splitext(image.filename)[1] if c.isalnum())
+                name = "tableimage-%d.%s" % (table.tableid, ext or "bin")
+                with open(os.path.join(filedir, name), "wb") as imgfh:
+                    imgfh.write(image.data)
+                fh.write('    <p>%s</p>\n    <img src="files/%s"/>\n' % (escape(table.tablename), escape(name)))
+        fh.write(FOOTER)
@@ -0,0 +1,119 @@
+"""
+On disk cache for KOD tables inferred with `--strucrack` or `--dbcrack`.
+
+The cache is keyed by a fingerprint of the database files, so a modified
+database will not use a stale KOD table.
+"""
+import hashlib
+import os
+from .hexdump import tohex, unhex
+
+METHODS = ("strucrack", "dbcrack")
+
+
+def cachedir(kind="kod"):
+    """
+    Return the directory containing the cached KOD tables, or other cached `kind` of data.
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "cronodump", kind)
+
+
+def findfile(dbdir, basename):
+    """
+    Case insensitive lookup of `basename` in `dbdir`.
+    """
+    for fn in os.listdir(dbdir):
+        if basename.lower() == fn.lower():
+            return os.path.join(dbdir, fn)
+
+
+def fingerprint(dbdir, names=("Stru", "Index", "Bank")):
+    """
+    Calculate a fingerprint from the Stru, Index and Bank files in `dbdir`,
+    or from the Cro`name` files for the `names` passed.
+
+    This uses the file sizes, the .dat headers, which contain 0xE9 random bytes,
+    and the .tad contents, which include the checksums of all records.
+    """
+    h = hashlib.sha256()
+    for name in names:
+        for ext in ("dat", "tad"):
+            fn = findfile(dbdir, "Cro%s.%s" % (name, ext))
+            if not fn:
+                h.update(b"-")
+                continue
+            h.update(b"%s:%d:" % (ext.encode(), os.path.getsize(fn)))
+            with open(fn, "rb") as fh:
+                if ext == "dat":
+                    h.update(fh.read(0x100))
+                else:
+                    for chunk in iter(lambda: fh.read(0x100000), b""):
+                        h.update(chunk)
+    return h.hexdigest()
+
+
+def cachename(dbdir, method):
+    return os.path.join(cachedir(), "%s.%s" % (fingerprint(dbdir), method))
+
+
+def load(dbdir, method):
+    """
+    Return the cached KOD table for `dbdir`, or None when nothing was cached.
+    """
+    try:
+        with open(cachename(dbdir, method), "r") as fh:
+            data = unhex(fh.read())
+    except (IOError, ValueError):
+        return
+    if len(data) == 256:
+        return list(data)
+
+
+def save(dbdir, method, kod):
+    """
+    Store the KOD table for `dbdir`.
+    """
+    os.makedirs(cachedir(), exist_ok=True)
+    with open(cachename(dbdir, method), "w") as fh:
+        fh.write(tohex(bytes(kod)))
+
+
+def invalidate(dbdir):
+    """
+    Remove all cached KOD tables for `dbdir`.
+    """
+    for method in METHODS:
+        try:
+            os.remove(cachename(dbdir, method))
+        except FileNotFoundError:
+            pass
+
+
+def entries(dbdir):
+    """
+    Yields (method, KOD table) for all cached KOD tables for `dbdir`.
+    """
+    for method in METHODS:
+        kod = load(dbdir, method)
+        if kod:
+            yield method, kod
+
+
+def cachedcrack(dbdir, method, crack, usecache=True):
+    """
+    Return the cached KOD table, or call `crack` and store its result.
+    `crack` returns the KOD table and whether it is unambiguous, or None.
+    Ambiguous tables are not stored, so the next run cracks them again.
+    """
+    if usecache:
+        kod = load(dbdir, method)
+        if kod:
+            return kod
+    result = crack()
+    if not result:
+        return
+    kod, unambiguous = result
+    if kod and unambiguous and usecache:
+        save(dbdir, method, kod)
+    return kod
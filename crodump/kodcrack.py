@@ -0,0 +1,116 @@
+"""
+Statistics used for inferring the KOD table from encoded records.
+
+Both `strucrack` and `dbcrack` count, for each (offset + shift) % 256,
+how often each encoded byte value occurs, and pick the most common value
+for each row as the encoding of a known plaintext byte.
+"""
+import sys
+from array import array
+from collections import Counter
+from .koddecoder import RAMP, ramp
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class KODHistogram:
+    """
+    A 256 x 256 histogram of (row, byte) pairs,
+    where row is the shift + offset of the byte in the record, modulo 256.
+    """
+    def __init__(self):
+        if numpy is not None:
+            self.counts = numpy.zeros(256 * 256, dtype=numpy.int64)
+        else:
+            self.counts = [0] * (256 * 256)
+        self.previous = None
+        self.nrstable = 0
+        self.unambiguous = False
+
+    def add(self, items):
+        """
+        Add the bytes of a batch of (shift, data) items,
+        the first byte of `data` is counted in row `shift`.
+        """
+        items = [(shift, bytes(data)) for shift, data in items if data]
+        if not items:
+            return
+        data = b"".join(data for shift, data in items)
+        rows = b"".join(ramp(RAMP, shift, len(data)) for shift, data in items)
+
+        if numpy is not None:
+            keys = numpy.frombuffer(rows, numpy.uint8).astype(numpy.int64) * 256
+            keys += numpy.frombuffer(data, numpy.uint8)
+            self.counts += numpy.bincount(keys, minlength=256 * 256)
+            return
+
+        # combine row and byte in 16 bit keys, and let Counter do the counting.
+        pairs = bytearray(2 * len(data))
+        pairs[0::2] = data
+        pairs[1::2] = rows
+        keys = array("H")
+        keys.frombytes(pairs)
+        if sys.byteorder != "little":
+            keys.byteswap()
+        for k, n in Counter(keys).items():
+            self.counts[k] += n
+
+    def table(self):
+        """
+        Returns the inferred KOD table, and for each row the confidence margin:
+        the difference between the most and second most common byte,
+        relative to the most common byte.
+        """
+        if numpy is not None:
+            rows = self.counts.reshape(256, 256)
+            best = rows.argmax(axis=1).tolist()
+            top = numpy.sort(rows, axis=1)
+            first = top[:, -1].tolist()
+            second = top[:, -2].tolist()
+        else:
+            best, first, second = [], [], []
+            for i in range(256):
+                row = self.counts[i * 256:(i + 1) * 256]
+                k = max(range(256), key=lambda k: row[k])
+                best.append(k)
+                first.append(row[k])
+                second.append(max(row[:k] + row[k + 1:]))
+
+        KOD = [0] * 256
+        for i, k in enumerate(best):
+            KOD[k] = i
+
+        margins = [(a - b) / a if a else 0.0 for a, b in zip(first, second)]
+        self.unambiguous = min(margins) > 0 and len(set(best)) == 256
+
+        return KOD, margins
+
+    def converged(self, nrbatches):
+        """
+        Returns True when the inferred table was unambiguous and unchanged
+        for the last `nrbatches` calls to `converged`.
+        """
+        KOD, margins = self.table()
+        if self.unambiguous and KOD == self.previous:
+            self.nrstable += 1
+        else:
+            self.nrstable = 0
+        self.previous = KOD
+        return nrbatches and self.nrstable >= nrbatches
+
+
+def batches(items, batchsize):
+    """
+    Group an iterator of items in lists of `batchsize` items.
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batchsize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -1,6 +1,11 @@
 """
 Decode CroStru KOD encoding.
 """
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 INITIAL_KOD = [
     0x08, 0x63, 0x81, 0x38, 0xA3, 0x6B, 0x82, 0xA6, 0x18, 0x0D, 0xAC, 0xD5, 0xFE, 0xBE, 0x15, 0xF6,
     0xA5, 0x36, 0x76, 0xE2, 0x2D, 0x41, 0xB5, 0x12, 0x4B, 0xD8, 0x3C, 0x56, 0x34, 0x46, 0x4F, 0xA4,
@@ -21,6 +26,38 @@ INITIAL_KOD = [
 ]
 
 
+# two periods of the (i+shift) ramp, and of its negation, so any shift can be sliced from these.
+RAMP = bytes(range(256)) * 2
+NEGRAMP = bytes((-i) & 0xFF for i in range(256)) * 2
+
+
+def ramp(table, shift, n):
+    """
+    Return `n` bytes of `table`, starting at `shift`.
+    """
+    start = shift % 256
+    period = table[start:start + 256]
+    return (period * (n // 256 + 1))[:n]
+
+
+def addbytes(data, values):
+    """
+    Add `values` bytewise to `data`, modulo 256.
+    """
+    if numpy is not None:
+        return (numpy.frombuffer(data, numpy.uint8) + numpy.frombuffer(values, numpy.uint8)).tobytes()
+
+    # without numpy, spread the bytes over 16 bit lanes, so one big integer
+    # addition adds all bytes at once without carries between the lanes.
+    n = len(data)
+    a = bytearray(2 * n)
+    a[0::2] = data
+    b = bytearray(2 * n)
+    b[0::2] = values
+    total = int.from_bytes(a, "little") + int.from_bytes(b, "little")
+    return total.to_bytes(2 * n, "little")[0::2]
+
+
 class KODcoding:
     """
     class handing KOD encoding and decoding, optionally
@@ -34,19 +71,42 @@ class KODcoding:
         for i, x in enumerate(self.kod):
             self.inv[x] = i
 
+        # the same tables in `bytes.translate` form.
+        self.kodtable = bytes(self.kod)
+        self.invtable = bytes(self.inv)
+
     def decode(self, o, data):
         """
         decode : shift, a[0]..a[n-1] -> b[0]..b[n-1]
             b[i] = KOD[a[i]]- (i+shift)
         """
-        return bytes((self.kod[b] - i - o) % 256 for i, b in enumerate(data))
+        data = bytes(data).translate(self.kodtable)
+        return addbytes(data, ramp(NEGRAMP, o, len(data)))
 
     def encode(self, o, data):
         """
         encode : shift, b[0]..b[n-1] -> a[0]..a[n-1]
             a[i] = INV[b[i]+ (i+shift)]
         """
-        return bytes(self.inv[(b + i + o) % 256] for i, b in enumerate(data))
+        data = bytes(data)
+        return addbytes(data, ramp(RAMP, o, len(data))).translate(self.invtable)
+
+    def decodebatch(self, items):
+        """
+        decode a list of (shift, data) pairs in one operation,
+        returns a list with the decoded data.
+        """
+        items = [(o, bytes(data)) for o, data in items]
+        data = b"".join(data for o, data in items).translate(self.kodtable)
+        values = b"".join(ramp(NEGRAMP, o, len(data)) for o, data in items)
+        data = addbytes(data, values)
+
+        result = []
+        pos = 0
+        for o, item in items:
+            result.append(data[pos:pos + len(item)])
+            pos += len(item)
+        return result
 
 
 def new(*args):
@@ -0,0 +1,187 @@
+"""
+Resolving link fields, the foreign keys with typ 7, 8 and 9.
+
+Link fields reference other records by their record number in CroBank, the system number.
+The exact payload format is not known yet, `linktargets` accepts record numbers written as
+decimal text, separated by 0x1e, 0x1d, spaces or commas, optionally preceded by the two dword
+header also used by file references. Payloads which do not parse like that, or which reference
+records that do not exist, are left as hex dumps.
+
+A LinkResolver first builds an index of the table id of every record, in a single pass over
+CroBank, or from a complete sidecar record index. The offset of each record is already in the
+.tad index, so referenced records are read directly, and kept in a least recently used cache.
+"""
+import re
+import struct
+from array import array
+from collections import OrderedDict
+from .Datamodel import Record
+from .query import findfield, QueryError
+from .vocabulary import dictionaryfields
+from .recindex import MISSING, EMPTY
+
+# the field types of link fields: direct, back and direct-reverse links.
+LINKTYPES = (7, 8, 9)
+
+# the default nr of referenced records kept in the cache.
+CACHESIZE = 10000
+
+
+def linkindices(table):
+    """
+    Return the indices of the link fields of `table`.
+    """
+    return [i for i, fielddef in enumerate(table.fields) if fielddef.typ in LINKTYPES]
+
+
+def linktargets(data):
+    """
+    Return the list of record numbers in a link field payload,
+    or None when `data` does not look like a list of record numbers.
+    """
+    data = data.rstrip(b"\x00")
+    if len(data) >= 8:
+        _, size = struct.unpack_from("<LL", data, 0)
+        if size == len(data) - 8:
+            data = data[8:]
+    tokens = [token for token in re.split(rb"[\x1e\x1d ,]+", data) if token]
+    if not tokens or not all(token.isdigit() for token in tokens):
+        return
+    return [int(token) for token in tokens]
+
+
+class LinkResolver:
+    """
+    Resolves the link fields of records in `db`, `tables` are the tables
+    which may be referenced, by default all tables of the database.
+    Up to `cachesize` referenced records are kept decoded.
+    """
+    def __init__(self, db, tables=None, cachesize=CACHESIZE):
+        self.db = db
+        if tables is None:
+            tables = db.enumerate_tables()
+        self.tables = {table.tableid: table for table in tables}
+        self.cachesize = cachesize
+        self.cache = OrderedDict()
+        self.hits = self.misses = 0
+        self.tableids = None
+        # the indices of the fields selected by `columns`, by table id and names.
+        self.fieldindices = {}
+        self.vocab = db.getvocabulary() if db.usevocabulary else None
+
+    def buildindex(self):
+        """
+        Fill the table id of every record, from the sidecar index when complete,
+        otherwise in one pass over CroBank, which only decodes the table ids.
+        """
+        index = self.db.getrecindex()
+        if index and index.iscomplete():
+            self.tableids = array("H", index.tableids)
+            return
+        self.tableids = array("H", [MISSING]) * self.db.bank.nrofrecords
+        for recno, tableid, item in self.db.enumerate_decoded({}):
+            self.tableids[recno - 1] = EMPTY if tableid is None else tableid
+
+    def tableof(self, recno):
+        """
+        Return the table id of record `recno`, or None when there is no such record.
+        """
+        if self.tableids is None:
+            self.buildindex()
+        if not 1 <= recno <= len(self.tableids):
+            return
+        tableid = self.tableids[recno - 1]
+        if tableid < 0x100:
+            return tableid
+
+    def keys(self, data):
+        """
+        Return the record numbers referenced by the link payload `data`,
+        or None when it is not a list of existing records.
+        """
+        targets = linktargets(data)
+        if targets is None or any(self.tableof(recno) is None for recno in targets):
+            return
+        return targets
+
+    def record(self, recno):
+        """
+        Return the Record for `recno`, or None when it is not a record of one of the tables.
+        """
+        if recno in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(recno)
+            return self.cache[recno]
+        self.misses += 1
+
+        record = None
+        table = self.tables.get(self.tableof(recno))
+        if table is not None:
+            try:
+                data = self.db.bank.readrec(recno)
+                if data:
+                    record = Record(recno, table.fields, data[1:])
+            except Exception:
+                record = None
+        if record is not None and self.vocab:
+            indices = dictionaryfields({table.tableid: table.fields}).get(table.tableid)
+            if indices:
+                self.vocab.resolverecord(record, indices)
+
+        self.cache[recno] = record
+        if len(self.cache) > self.cachesize:
+            self.cache.popitem(last=False)
+        return record
+
+    def columns(self, data, names):
+        """
+        Return, for each record referenced by `data`, the contents of the fields called `names`,
+        fields missing in the referenced table are skipped.
+        Returns None when `data` is not a list of existing records.
+        """
+        targets = self.keys(data)
+        if targets is None:
+            return
+        result = []
+        for recno in targets:
+            record = self.record(recno)
+            if record is None:
+                result.append([])
+                continue
+            indices = self.selectfields(self.tableof(recno), names)
+            result.append([record.fields[i].content for i in indices])
+        return result
+
+    def selectfields(self, tableid, names):
+        key = (tableid, tuple(names))
+        indices = self.fieldindices.get(key)
+        if indices is None:
+            indices = self.fieldindices[key] = []
+            for name in names:
+                try:
+                    indices.append(findfield(self.tables[tableid], name))
+                except QueryError:
+                    pass
+        return indices
+
+    def content(self, data, names=None):
+        """
+        Return the text for a link field with payload `data`: the referenced record numbers,
+        or with `names` the named fields of the referenced records. The records are separated
+        by "; ", their fields by spaces.
+        Returns None when `data` can not be resolved.
+        """
+        if not names:
+            targets = self.keys(data)
+            if targets is None:
+                return
+            return " ".join(str(recno) for recno in targets)
+        resolved = self.columns(data, names)
+        if resolved is None:
+            return
+        return "; ".join(" ".join(contents) for contents in resolved)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return "link cache: %d hits, %d misses (%.1f%% hits)" % (
+            self.hits, self.misses, 100.0 * self.hits / lookups if lookups else 0)
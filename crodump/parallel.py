@@ -0,0 +1,170 @@
+"""
+Decode CroBank records in a pool of worker processes.
+
+The records are read in the current process, the KOD decoding, decompression
+and Record construction are done in batches by the worker processes.
+Results are yielded in the order the records were read, with a bounded
+number of batches in flight, so memory use does not grow with the database size.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from .Datafile import decodedata, peektableid, CompressionError
+from .Datamodel import Record, tokenizebatch
+from .hexdump import ashex
+
+# nr of records passed to a worker at a time.
+BATCHSIZE = 256
+
+# the per worker process decoding parameters, set by `initworker`.
+worker = {}
+
+
+def initworker(encoding, kod, verifycrc):
+    worker["encoding"] = encoding
+    worker["kod"] = kod
+    worker["verifycrc"] = verifycrc
+
+
+def decoderecord(recnum, encdat, tables, encoding, kod, verifycrc, query=None, peek=False):
+    """
+    Decode one record, and classify it by its table id.
+
+    `tables` maps table ids to the list of field definitions, or to None for file tables.
+    `query` optionally a Query, records of its table not matching the query are not returned.
+    `peek` if set, records for other tables are skipped after decoding only their table id.
+
+    Returns (tableid, decodedsize, result, error).
+    For empty records `tableid` is None, for tables not in `tables` `result` is None.
+    When peeking, the decodedsize of skipped records is 0.
+    `result` is a Record object, or for file tables the record data without the table id.
+    `error` is a message for broken records.
+    """
+    tableid, decodedsize, data, error = decodetableid(recnum, encdat, tables, encoding, kod, verifycrc, peek)
+    if data is None:
+        return tableid, decodedsize, None, error
+    return makerecord(recnum, data, tables, query)
+
+
+def decodetableid(recnum, encdat, tables, encoding, kod, verifycrc, peek=False):
+    """
+    KOD decode and decompress one record, see `decoderecord`.
+
+    Returns (tableid, decodedsize, data, error), `data` is the decoded record
+    for records of the tables in `tables`, and None otherwise.
+    """
+    if peek:
+        tableid = peektableid(recnum, encdat, encoding, kod)
+        if tableid is not None and tableid not in tables:
+            return tableid, 0, None, None
+    try:
+        data = decodedata(recnum, encdat, encoding, kod, verifycrc)
+    except CompressionError as e:
+        return None, 0, None, "Record %d broken: ERROR '%s'" % (recnum, e)
+    if not data:
+        return None, 0, None, None
+    tableid = data[0]
+    if tableid not in tables:
+        return tableid, len(data), None, None
+    return tableid, len(data), data, None
+
+
+def makerecord(recnum, data, tables, query=None, values=None):
+    """
+    Return the `decoderecord` result for the decoded record `data`,
+    `values` optionally the raw field values, as returned by `tokenizebatch`.
+    """
+    tableid = data[0]
+    fields = tables[tableid]
+    if fields is None:
+        return tableid, len(data), data[1:], None
+    try:
+        record = Record(recnum, fields, data[1:], values)
+        if query and query.tableid == tableid and not query.match(record):
+            record = None
+        return tableid, len(data), record, None
+    except EOFError:
+        return tableid, len(data), None, "Record %d too short: -- %s" % (recnum, ashex(data))
+    except Exception as e:
+        return tableid, len(data), None, "Record %d broken: ERROR '%s' -- %s" % (recnum, e, ashex(data))
+
+
+def decodebatch(tables, batch, query=None, peek=False):
+    """
+    Decode a batch of (recnum, encoded data) items in a worker process.
+
+    Returns a list of (recnum, rawsize) + the `decoderecord` result for all records.
+    The records of each table are tokenized together, see `tokenizebatch`.
+    """
+    decoded = [decodetableid(recnum, encdat, tables, worker["encoding"], worker["kod"], worker["verifycrc"], peek)
+               for recnum, encdat in batch]
+
+    # the positions in the batch of the records for each table.
+    bytable = {}
+    for i, (tableid, decodedsize, data, error) in enumerate(decoded):
+        if data is not None and tables[tableid] is not None:
+            bytable.setdefault(tableid, []).append(i)
+    values = [None] * len(batch)
+    for tableid, positions in bytable.items():
+        try:
+            tokenized = tokenizebatch(tables[tableid], [decoded[i][2][1:] for i in positions])
+        except Exception:
+            # tokenize each record again in `makerecord`, which reports the broken ones.
+            continue
+        for i, recvalues in zip(positions, tokenized):
+            values[i] = recvalues
+
+    results = []
+    for (recnum, encdat), (tableid, decodedsize, data, error), recvalues in zip(batch, decoded, values):
+        if data is None:
+            result = tableid, decodedsize, None, error
+        else:
+            # records which tokenizebatch found too short are tokenized again, and reported.
+            result = makerecord(recnum, data, tables, query, recvalues)
+        results.append((recnum, len(encdat)) + result)
+    return results
+
+
+def encodedbatches(records, maxbytes=None):
+    """
+    Yields the (recnum, encoded data) items from `records` in batches,
+    together with the size of the batch. With `maxbytes` a batch is also ended when
+    its records contain at least `maxbytes` bytes.
+    """
+    batch = []
+    size = 0
+    for recnum, encdat in records:
+        batch.append((recnum, bytes(encdat)))
+        size += len(encdat)
+        if len(batch) == BATCHSIZE or maxbytes and size >= maxbytes:
+            yield batch, size
+            batch = []
+            size = 0
+    if batch:
+        yield batch, size
+
+
+def enumerate_parallel(bank, records, tables, jobs, query=None, peek=False, maxbytes=None):
+    """
+    Yields (recnum, rawsize, tableid, decodedsize, result, error) for the encoded `records`
+    from `bank`, decoded by `jobs` worker processes, see `decoderecord` for the arguments and results.
+
+    `maxbytes` optionally limits the size of the encoded records in flight,
+    by default at most 2 * `jobs` + 1 batches are in flight.
+    """
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initworker,
+                             initargs=(bank.encoding, bank.kod, bank.verifycrc)) as executor:
+        pending = deque()
+        inflight = 0
+        try:
+            for batch, size in encodedbatches(records, maxbytes and maxbytes // (2 * jobs + 1)):
+                pending.append((executor.submit(decodebatch, tables, batch, query, peek), size))
+                inflight += size
+                while len(pending) > 2 * jobs or maxbytes and inflight > maxbytes and len(pending) > 1:
+                    future, size = pending.popleft()
+                    inflight -= size
+                    yield from future.result()
+            while pending:
+                yield from pending.popleft()[0].result()
+        finally:
+            for future, size in pending:
+                future.cancel()
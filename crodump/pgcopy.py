@@ -0,0 +1,130 @@
+"""
+Output a cronos database as a PostgreSQL dump, using `COPY ... FROM stdin` blocks.
+
+The rows are written in the COPY text format: columns separated by tabs,
+backslash, tab, newline and carriage return escaped with a backslash, and \\N for NULL.
+This loads much faster than INSERT statements, and does not depend on the
+`standard_conforming_strings` setting.
+
+All tables are written while reading CroBank once, the rows of the first table are
+written directly, those of the other tables are buffered in temporary files.
+"""
+import shutil
+import tempfile
+from .fieldtypes import valuekind, tointeger, todate, totime, uniquenames, INTEGER, DATE, TIME
+
+ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\x00": None})
+
+
+def quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def pgtype(fielddef):
+    """
+    The column type, cronos TIMESTAMP fields only contain hours and minutes.
+    """
+    if valuekind(fielddef) == TIME:
+        return "TIME"
+    return fielddef.sqltype()
+
+
+def escape(text):
+    return text.translate(ESCAPES)
+
+
+def integervalue(content):
+    value = tointeger(content)
+    return "\\N" if value is None else str(value)
+
+
+def datevalue(content):
+    value = todate(content)
+    return "\\N" if value is None else value.isoformat()
+
+
+def timevalue(content):
+    value = totime(content)
+    return "\\N" if value is None else value.strftime("%H:%M")
+
+
+FORMATTERS = {
+    INTEGER: integervalue,
+    DATE: datevalue,
+    TIME: timevalue,
+}
+
+
+def formatter(fielddef):
+    """
+    Return a function formatting a Field for `fielddef` as a COPY text value.
+    Contents which the column type can not represent are written as NULL.
+    """
+    format = FORMATTERS.get(valuekind(fielddef), escape)
+
+    def copyvalue(field):
+        content = field.content
+        if not content:
+            return "\\N"
+        return format(content)
+
+    return copyvalue
+
+
+def tabledefinition(table, name=None):
+    """
+    Return the CREATE TABLE statement for `table`, and the start of its COPY block.
+    """
+    name = quote(name or table.tablename)
+    columns = [quote(column) for column in uniquenames([field.name for field in table.fields])]
+    types = [pgtype(field) for field in table.fields]
+    # only the first recno field can be the primary key.
+    types = [typ if typ != "INTEGER PRIMARY KEY" or i == types.index(typ) else "INTEGER" for i, typ in enumerate(types)]
+
+    return "\nCREATE TABLE %s (\n    %s\n);\n\nCOPY %s (%s) FROM stdin;\n" % (name, ",\n    ".join(
+        "%s %s" % (column, typ) for column, typ in zip(columns, types)), name, ", ".join(columns))
+
+
+def write_pgcopy(db, out, physical=False, window=None, stats=None):
+    """
+    Write all tables of `db` to `out` as a PostgreSQL dump, reading CroBank only once.
+    When a `stats` Counter is passed, it is updated with the nr of records per table id,
+    and the counts from `Database.enumerate_all`.
+    """
+    out.write("SET client_encoding = 'UTF8';\n")
+    tables = list(db.enumerate_tables(files=False))
+    names, seen = [], set()
+    for table in tables:
+        name = table.tablename
+        if name.lower() in seen:
+            name += "-%d" % table.tableid
+        seen.add(name.lower())
+        names.append(name)
+    formatters = {table.tableid: [formatter(field) for field in table.fields] for table in tables}
+
+    # the rows of all but the first table are buffered until all records were read.
+    buffers = {}
+    try:
+        for table in tables[1:]:
+            buffers[table.tableid] = tempfile.TemporaryFile("w+", encoding="utf-8", newline="\n")
+
+        if tables:
+            out.write(tabledefinition(tables[0], names[0]))
+        for table, record in db.enumerate_all(tables, (), physical, window, stats=stats):
+            if stats is not None:
+                stats[table.tableid] += 1
+            fh = buffers.get(table.tableid, out)
+            fh.write("\t".join([format(field) for format, field in zip(formatters[table.tableid], record.fields)]))
+            fh.write("\n")
+        if tables:
+            out.write("\\.\n")
+
+        for table, name in zip(tables[1:], names[1:]):
+            out.write(tabledefinition(table, name))
+            fh = buffers[table.tableid]
+            fh.seek(0)
+            shutil.copyfileobj(fh, out)
+            out.write("\\.\n")
+    finally:
+        for fh in buffers.values():
+            fh.close()
@@ -0,0 +1,144 @@
+"""
+Column projection and record filtering for a single table.
+
+Conditions are written as:
+    name=value       the field content equals value
+    name~value       the field content contains value
+    name=low..high   the field content is in the range low .. high, either bound may be omitted.
+                     dates are compared as YYYY-MM-DD strings, integer fields numerically.
+
+Where possible, conditions are checked against the raw field bytes,
+so only fields needed by a condition are decoded.
+"""
+import copy
+
+# field types for which the content is the cp1251 decoded raw value.
+NONTEXT = (0, 4, 5, 6, 7, 8, 9)
+
+
+class QueryError(Exception):
+    pass
+
+
+def findfield(table, name):
+    """
+    Return the index of the field called `name` in `table`.
+    """
+    for i, fielddef in enumerate(table.fields):
+        if fielddef.name == name:
+            return i
+    raise QueryError("no field '%s' in table '%s'" % (name, table.tablename))
+
+
+class Condition:
+    """
+    A single condition on field `index` of a record.
+    `op` is one of '=', '~' or '..'
+    """
+    def __init__(self, index, fielddef, op, value):
+        self.index = index
+        self.typ = fielddef.typ
+        self.op = op
+        self.value = value
+
+        # the cp1251 encoded value, used for matching raw text fields.
+        self.raw = None
+        if self.typ not in NONTEXT and op != "..":
+            try:
+                self.raw = value.encode("cp1251")
+            except UnicodeEncodeError:
+                pass
+
+        if op == "..":
+            self.low, self.high = (self.convert(v) if v else None for v in value)
+
+    @staticmethod
+    def parse(table, text):
+        """
+        Parse a condition as written on the commandline.
+        """
+        ops = [i for i in (text.find("="), text.find("~")) if i > 0]
+        if not ops:
+            raise QueryError("invalid condition '%s', expected name=value or name~value" % text)
+        o = min(ops)
+        name, op, value = text[:o], text[o], text[o+1:]
+
+        index = findfield(table, name)
+        if op == "=" and ".." in value:
+            op, value = "..", value.split("..", 1)
+        return Condition(index, table.fields[index], op, value)
+
+    def convert(self, value):
+        """
+        Convert a field content, or a range bound, to a comparable value.
+        """
+        if self.typ in (0, 1):
+            try:
+                return int(value)
+            except ValueError:
+                pass
+        return value
+
+    def match(self, record):
+        if self.index == 0:
+            data = str(record.recno)
+        else:
+            data = record.values[self.index - 1]
+
+        # 0x98 is not a cp1251 character, and is dropped when decoding the field.
+        if self.raw is not None and b"\x98" not in data:
+            if self.op == "=":
+                return data.rstrip(b"\x00") == self.raw
+            return self.raw in data
+
+        content = record.fields[self.index].content
+        if self.op == "=":
+            return content == self.value
+        if self.op == "~":
+            return self.value in content
+
+        if not content:
+            return False
+        content = self.convert(content)
+        # contents which do not convert like the bounds, like text in an integer field, do not match.
+        if any(bound is not None and type(content) != type(bound) for bound in (self.low, self.high)):
+            return False
+        if self.low is not None and content < self.low:
+            return False
+        if self.high is not None and content > self.high:
+            return False
+        return True
+
+
+class Query:
+    """
+    Selects the records of `table` matching all `conditions`, and
+    the fields named in `columns`, or all fields when no columns are specified.
+    """
+    def __init__(self, table, columns=None, conditions=()):
+        self.tableid = table.tableid
+        if columns:
+            self.columns = [findfield(table, name) for name in columns]
+        else:
+            self.columns = list(range(len(table.fields)))
+        self.names = [table.fields[i].name for i in self.columns]
+        self.conditions = [c if isinstance(c, Condition) else Condition.parse(table, c) for c in conditions]
+
+    def match(self, record):
+        return all(c.match(record) for c in self.conditions)
+
+    def split(self, indices):
+        """
+        Return a copy of this query without the conditions on the fields at `indices`,
+        and the list of those conditions.
+        """
+        query = copy.copy(self)
+        query.conditions = [c for c in self.conditions if c.index not in indices]
+        return query, [c for c in self.conditions if c.index in indices]
+
+    def project(self, record):
+        """
+        Return the selected fields of `record`.
+        """
+        fields = record.fields
+        return [fields[i] for i in self.columns]
@@ -0,0 +1,160 @@
+"""
+Persistent sidecar index of the records in CroBank.
+
+The index stores for each record the table id, the .tad flags and checksum,
+the size of the stored record, and its size after KOD decoding and decompression.
+It is built while reading the whole bank, and used on later runs to read only the
+records of the tables requested.
+
+The index file starts with a fingerprint of the CroBank files and the KOD table,
+an index for a modified database, or one decoded with a different KOD table,
+is ignored and rebuilt.
+"""
+import hashlib
+import os
+import struct
+import sys
+from array import array
+from . import kodcache
+from .tadindex import DELETED as DELETEDLENGTH
+
+MAGIC = b"CroIdx01"
+
+# special values in the tableid column, real table ids are 0..255
+EMPTY = 0x100
+BROKEN = 0x101
+DELETED = 0x102
+MISSING = 0x103
+
+
+def uint32array(values=()):
+    a = array("I", values)
+    if a.itemsize != 4:
+        a = array("L", values)
+    return a
+
+
+def indexfingerprint(bankfingerprint, kod):
+    """
+    Combine the fingerprint of the CroBank files with the `kod` table used to decode them.
+    """
+    h = hashlib.sha256(bankfingerprint.encode())
+    if kod:
+        h.update(bytes(kod.kodtable))
+    return h.digest()
+
+
+def indexname(bankfingerprint):
+    """
+    Return the name of the index in the cache directory for a CroBank with `bankfingerprint`.
+    """
+    return os.path.join(kodcache.cachedir("index"), "%s.idx" % bankfingerprint)
+
+
+class RecordIndex:
+    """
+    Contains the tableid, flags, rawsize, decodedsize and checksum columns for all records,
+    indexed by recno - 1.
+    """
+    COLUMNS = ("tableids", "flags", "rawsizes", "decodedsizes", "checksums")
+
+    def __init__(self, fingerprint, nrofrecords):
+        self.fingerprint = fingerprint
+        self.nrofrecords = nrofrecords
+        self.tableids = array("H", [MISSING]) * nrofrecords
+        self.flags = array("B", bytes(nrofrecords))
+        self.rawsizes = uint32array([0]) * nrofrecords
+        self.decodedsizes = uint32array([0]) * nrofrecords
+        self.checksums = uint32array([0]) * nrofrecords
+
+    @classmethod
+    def fromtad(cls, fingerprint, nrofrecords, tadparts):
+        """
+        Create an index with the flags and checksums from the bank's .tad,
+        `tadparts` yields (first, TadIndex) as `Datafile.tadparts` does.
+        The table ids and sizes are filled in by `add`.
+        """
+        index = cls(fingerprint, nrofrecords)
+        for first, tadindex in tadparts:
+            for i in range(len(tadindex)):
+                ofs, ln, flags, chk = tadindex.entry(i)
+                index.flags[first + i] = flags
+                index.checksums[first + i] = chk
+                if ln == DELETEDLENGTH:
+                    index.tableids[first + i] = DELETED
+        return index
+
+    def add(self, recno, tableid, rawsize, decodedsize):
+        """
+        Store the table id and sizes for `recno`, tableid is None for empty records.
+        """
+        self.tableids[recno - 1] = EMPTY if tableid is None else tableid
+        self.rawsizes[recno - 1] = rawsize
+        self.decodedsizes[recno - 1] = decodedsize
+
+    def broken(self, recno):
+        self.tableids[recno - 1] = BROKEN
+
+    def iscomplete(self):
+        """
+        True when all records in the bank were added.
+        """
+        return MISSING not in self.tableids
+
+    def entry(self, recno):
+        """
+        Return tableid, flags, rawsize, decodedsize and checksum for `recno`.
+        """
+        return tuple(getattr(self, name)[recno - 1] for name in self.COLUMNS)
+
+    def records(self, tableids):
+        """
+        Return the record numbers of all records with a table id in `tableids`,
+        including the broken records, since these have an unknown table id.
+        """
+        wanted = set(tableids) | {BROKEN}
+        return [i + 1 for i, tableid in enumerate(self.tableids) if tableid in wanted]
+
+    def save(self, filename):
+        """
+        Write the index to `filename`, through a temporary file, so a concurrent
+        reader never sees a partial index.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        tmpname = "%s.%d.tmp" % (filename, os.getpid())
+        with open(tmpname, "wb") as fh:
+            fh.write(MAGIC + self.fingerprint + struct.pack("<Q", self.nrofrecords))
+            for name in self.COLUMNS:
+                column = getattr(self, name)
+                if sys.byteorder != "little":
+                    column = array(column.typecode, column)
+                    column.byteswap()
+                fh.write(column.tobytes())
+        os.replace(tmpname, filename)
+
+    @classmethod
+    def load(cls, filename, fingerprint):
+        """
+        Read the index from `filename`, returns None when the file is missing,
+        invalid, or was created for a different database.
+        """
+        try:
+            with open(filename, "rb") as fh:
+                hdr = fh.read(len(MAGIC) + len(fingerprint) + 8)
+                if hdr[:len(MAGIC)] != MAGIC or hdr[len(MAGIC):-8] != fingerprint:
+                    return
+                (nrofrecords,) = struct.unpack("<Q", hdr[-8:])
+                index = cls(fingerprint, nrofrecords)
+                for name in cls.COLUMNS:
+                    column = getattr(index, name)
+                    data = fh.read(nrofrecords * column.itemsize)
+                    if len(data) != nrofrecords * column.itemsize:
+                        return
+                    column = array(column.typecode)
+                    column.frombytes(data)
+                    if sys.byteorder != "little":
+                        column.byteswap()
+                    setattr(index, name, column)
+        except (IOError, struct.error):
+            return
+        return index
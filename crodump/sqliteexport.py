@@ -0,0 +1,140 @@
+"""
+Export a cronos database directly to an SQLite database, using the stdlib sqlite3 module.
+
+Each table is created from its field definitions, the records are inserted with
+`executemany` in large transactions, with journaling and syncing disabled during the load.
+
+The contents of the file tables are stored in the `_files` table, and
+all type 6 file references in the `_filereferences` table, which can be joined with
+`_files` on `filedatarecord = recno`.
+"""
+import sqlite3
+from .fieldtypes import valuekind, tointeger, uniquenames, INTEGER
+
+# nr of rows passed to a single executemany call.
+BATCHSIZE = 10000
+
+# the file contents are inserted when this many bytes are collected, or BATCHSIZE files.
+FILESBATCHBYTES = 0x400000
+
+FILESCOLUMNS = [("recno", "INTEGER PRIMARY KEY"), ("tableid", "INTEGER"), ("data", "BLOB")]
+REFERENCESCOLUMNS = [("tablename", "TEXT"), ("recno", "INTEGER"), ("field", "TEXT"),
+                     ("filename", "TEXT"), ("extname", "TEXT"), ("filedatarecord", "INTEGER")]
+
+
+def quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def integervalue(field):
+    """
+    integers are stored as integer when possible, otherwise the content is kept as text.
+    """
+    content = field.content
+    if not content:
+        return
+    value = tointeger(content)
+    return content if value is None else value
+
+
+def textvalue(field):
+    return field.content or None
+
+
+class TableLoader:
+    """
+    Collects the rows for a single table, and inserts them in batches,
+    of BATCHSIZE rows, or of rows with a total size of `maxbytes` when passed.
+    """
+    def __init__(self, conn, name, columns, types, converters=None, maxbytes=None):
+        self.conn = conn
+        self.converters = converters
+        self.maxbytes = maxbytes
+        self.nrbytes = 0
+        conn.execute("CREATE TABLE %s (%s)" % (quote(name), ", ".join(
+            "%s %s" % (quote(column), typ) for column, typ in zip(columns, types))))
+        self.insert = "INSERT INTO %s VALUES (%s)" % (quote(name), ", ".join("?" * len(columns)))
+        self.rows = []
+
+    def addrecord(self, record):
+        self.add([convert(field) for convert, field in zip(self.converters, record.fields)])
+
+    def add(self, row, size=0):
+        self.rows.append(row)
+        self.nrbytes += size
+        if len(self.rows) >= BATCHSIZE or self.maxbytes and self.nrbytes >= self.maxbytes:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.conn.executemany(self.insert, self.rows)
+            self.rows = []
+            self.nrbytes = 0
+
+
+def write_sqlite(db, filename, transactionsize=500000, physical=False, window=None, stats=None):
+    """
+    Create the SQLite database `filename` containing all tables of `db`, reading CroBank once.
+    A commit is done every `transactionsize` records.
+    """
+    tables = list(db.enumerate_tables(files=False))
+    filetables = list(db.enumerate_tables(files=True))
+
+    conn = sqlite3.connect(filename, isolation_level=None)
+    try:
+        for pragma in ("journal_mode = OFF", "synchronous = OFF", "locking_mode = EXCLUSIVE",
+                       "temp_store = MEMORY", "cache_size = -65536"):
+            conn.execute("PRAGMA " + pragma)
+
+        conn.execute("BEGIN")
+
+        loaders = {}
+        filefields = {}
+        names = set()
+        for table in tables:
+            name = table.tablename
+            if name.lower() in names or name.lower() in ("_files", "_filereferences"):
+                name += "-%d" % table.tableid
+            names.add(name.lower())
+            # sqlite column names are case insensitive.
+            columns = uniquenames([field.name for field in table.fields], ignorecase=True)
+            types = [field.sqltype() for field in table.fields]
+            # only the first recno field can be the primary key.
+            types = [typ if typ != "INTEGER PRIMARY KEY" or i == types.index(typ) else "INTEGER" for i, typ in enumerate(types)]
+            converters = [integervalue if valuekind(field) == INTEGER else textvalue for field in table.fields]
+            loaders[table.tableid] = TableLoader(conn, name, columns, types, converters)
+            filefields[table.tableid] = [(name, i, field.name) for i, field in enumerate(table.fields) if field.typ == 6]
+
+        filesloader = TableLoader(conn, "_files", *zip(*FILESCOLUMNS), maxbytes=FILESBATCHBYTES)
+        referencesloader = TableLoader(conn, "_filereferences", *zip(*REFERENCESCOLUMNS))
+
+        nrrecords = 0
+        for table, item in db.enumerate_all(tables, filetables, physical, window, stats=stats):
+            if stats is not None:
+                stats[table.tableid] += 1
+            if isinstance(item, tuple):
+                recno, data = item
+                filesloader.add((recno, table.tableid, data), len(data))
+            else:
+                loaders[table.tableid].addrecord(item)
+                for name, i, fieldname in filefields[table.tableid]:
+                    field = item.fields[i]
+                    if field.content:
+                        referencesloader.add((name, item.recno, fieldname,
+                                              field.filename, field.extname, tointeger(field.filedatarecord)))
+
+            nrrecords += 1
+            if nrrecords % transactionsize == 0:
+                for loader in list(loaders.values()) + [filesloader, referencesloader]:
+                    loader.flush()
+                conn.execute("COMMIT")
+                conn.execute("BEGIN")
+
+        for loader in list(loaders.values()) + [filesloader, referencesloader]:
+            loader.flush()
+        conn.execute("COMMIT")
+
+        conn.execute("PRAGMA synchronous = FULL")
+        conn.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        conn.close()
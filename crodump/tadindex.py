@@ -0,0 +1,174 @@
+"""
+Bulk decoding of the .tad index into packed columns.
+
+The .tad file is a small header followed by fixed size entries:
+    v3, 32 bit:  uint32 offset, uint32 length, uint32 checksum
+    v3, 64 bit:  uint64 offset, uint32 length, uint32 checksum
+    v4:          the same, but the flags are in the top byte of the offset
+In v3 the flags are in the top byte of the length.
+A length of 0xFFFFFFFF marks a deleted record.
+
+When NumPy is installed the columns are NumPy arrays, otherwise they are
+`array.array` objects.
+"""
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DELETED = 0xFFFFFFFF
+
+
+def splitentry(ofs, ln, isv4):
+    """
+    Split the flags from a raw .tad entry, returns offset, length and flags.
+    deleted entries are returned unmodified, with zero flags.
+    """
+    if ln == DELETED:
+        return ofs, ln, 0
+    if isv4:
+        return ofs & ((1 << 56) - 1), ln, ofs >> 56
+    return ofs, ln & 0xFFFFFFF, ln >> 24
+
+
+def joinentry(ofs, ln, flags, isv4):
+    """
+    The inverse of `splitentry`, returns the raw offset and length.
+    """
+    if ln == DELETED:
+        return ofs, ln
+    if isv4:
+        return ofs | (flags << 56), ln
+    return ofs, ln | (flags << 24)
+
+
+class TadIndex:
+    """
+    Contains the offset, length, flags and checksum columns for all entries of a .tad file.
+    """
+    def __init__(self, data, use64bit, isv4):
+        """
+        `data` is the .tad contents following the header.
+        """
+        self.use64bit = use64bit
+        self.isv4 = isv4
+        self.entrysize = 16 if use64bit else 12
+        self.nrofrecords = len(data) // self.entrysize
+
+        data = data[: self.nrofrecords * self.entrysize]
+        if numpy is not None:
+            self.decode_numpy(data)
+        else:
+            self.decode_array(data)
+
+    def decode_numpy(self, data):
+        dtype = numpy.dtype([
+            ("ofs", "<u8" if self.use64bit else "<u4"),
+            ("ln", "<u4"),
+            ("chk", "<u4"),
+        ])
+        entries = numpy.frombuffer(data, dtype=dtype)
+        ofs = entries["ofs"].astype(numpy.uint64)
+        ln = entries["ln"].astype(numpy.uint32)
+
+        live = ln != DELETED
+        if self.isv4:
+            flags = numpy.where(live, ofs >> numpy.uint64(56), 0)
+            ofs = numpy.where(live, ofs & numpy.uint64((1 << 56) - 1), ofs)
+        else:
+            flags = numpy.where(live, ln >> 24, 0)
+            ln = numpy.where(live, ln & 0xFFFFFFF, ln)
+
+        self.offsets = ofs.astype(numpy.uint64)
+        self.lengths = ln.astype(numpy.uint32)
+        self.flags = flags.astype(numpy.uint8)
+        self.checksums = entries["chk"].astype(numpy.uint32)
+
+    def decode_array(self, data):
+        words = array("I")
+        if words.itemsize != 4:
+            words = array("L")
+        words.frombytes(data)
+        if sys.byteorder != "little":
+            words.byteswap()
+
+        if self.use64bit:
+            quads = array("Q")
+            quads.frombytes(data)
+            if sys.byteorder != "little":
+                quads.byteswap()
+            ofs = quads[0::2]
+            ln = words[2::4]
+            chk = words[3::4]
+        else:
+            ofs = array("Q", words[0::3])
+            ln = words[1::3]
+            chk = words[2::3]
+
+        flags = array("B", bytes(len(ln)))
+        for i, (o, l) in enumerate(zip(ofs, ln)):
+            ofs[i], ln[i], flags[i] = splitentry(o, l, self.isv4)
+
+        self.offsets = ofs
+        self.lengths = ln
+        self.flags = flags
+        self.checksums = chk
+
+    def __len__(self):
+        return self.nrofrecords
+
+    def entry(self, idx):
+        """
+        Return offset, length, flags and checksum for the zero based entry `idx`.
+        """
+        return (int(self.offsets[idx]), int(self.lengths[idx]),
+                int(self.flags[idx]), int(self.checksums[idx]))
+
+    def rawentry(self, idx):
+        """
+        Return the entry `idx` as stored in the .tad file: offset, length, checksum.
+        """
+        ofs, ln, flags, chk = self.entry(idx)
+        return joinentry(ofs, ln, flags, self.isv4) + (chk,)
+
+    def physicalorder(self, start=0, end=None):
+        """
+        Return the zero based indices of the live entries in the range `start` .. `end`,
+        sorted by their .dat offset.
+        """
+        if end is None:
+            end = self.nrofrecords
+        if numpy is not None:
+            live = numpy.flatnonzero(self.lengths[start:end] != DELETED)
+            order = numpy.argsort(self.offsets[start:end][live], kind="stable")
+            return (live[order] + start).tolist()
+        live = [i for i in range(start, end) if self.lengths[i] != DELETED]
+        return sorted(live, key=lambda i: self.offsets[i])
+
+    def liverecords(self):
+        """
+        Return the record numbers of all records which are not deleted.
+        """
+        if numpy is not None:
+            return numpy.flatnonzero(self.lengths != DELETED) + 1
+        return array("L", (i + 1 for i, ln in enumerate(self.lengths) if ln != DELETED))
+
+    def deletedrecords(self):
+        """
+        Return the record numbers of all deleted records.
+        """
+        if numpy is not None:
+            return numpy.flatnonzero(self.lengths == DELETED) + 1
+        return array("L", (i + 1 for i, ln in enumerate(self.lengths) if ln == DELETED))
+
+    def payloadsize(self):
+        """
+        Return the total nr of .dat bytes directly referenced by live records.
+        Note that for records with extension blocks, only the first block is counted.
+        """
+        if numpy is not None:
+            return int(self.lengths[self.lengths != DELETED].sum(dtype=numpy.uint64))
+        return sum(ln for ln in self.lengths if ln != DELETED)
@@ -0,0 +1,164 @@
+"""
+The vocabulary database, stored with its own Cro* files in the Voc/ subdirectory of a database.
+
+Dictionary fields, with typ 3, may store the record number of their entry in the vocabulary
+database instead of the text itself. The vocabulary is read once into a dict mapping the record
+numbers of its entries to their text, so values are resolved with a single lookup.
+Values which are not the number of a vocabulary entry are left as they are.
+
+The dict is cached in the cache directory, keyed by a fingerprint of the Voc files and
+the KOD table, so later runs do not need to read the vocabulary database again.
+"""
+import os
+import struct
+from . import kodcache
+from .recindex import indexfingerprint
+
+MAGIC = b"CroVoc01"
+
+# the field type of dictionary fields.
+DICTIONARY = 3
+
+
+def findvocdir(dbdir):
+    """
+    Return the Voc subdirectory of `dbdir`, matched case insensitively, or None.
+    """
+    path = kodcache.findfile(dbdir, "Voc")
+    if path and os.path.isdir(path):
+        return path
+
+
+def cachename(fingerprint):
+    return os.path.join(kodcache.cachedir("voc"), "%s.voc" % fingerprint.hex())
+
+
+def dictionaryfields(tables):
+    """
+    Return a dict mapping table ids to the indices in `Record.values` of their dictionary fields,
+    for the `tables` as passed to `Database.enumerate_decoded`.
+    """
+    result = {}
+    for tableid, fields in tables.items():
+        indices = [i - 1 for i, fielddef in enumerate(fields or ()) if i and fielddef.typ == DICTIONARY]
+        if indices:
+            result[tableid] = indices
+    return result
+
+
+def entrytext(record):
+    """
+    Return the text of a vocabulary entry: the first non empty field after the record number.
+    """
+    for value in record.values:
+        value = value.rstrip(b"\x00")
+        if value:
+            return value
+    return b""
+
+
+class Vocabulary:
+    """
+    Maps the record numbers of the vocabulary entries to their raw text, as stored in the records.
+    """
+    def __init__(self, fingerprint, entries=None):
+        self.fingerprint = fingerprint
+        self.entries = entries if entries is not None else {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    @classmethod
+    def build(cls, vocdb, fingerprint):
+        """
+        Read all entries from the vocabulary Database `vocdb`, in a single pass.
+        """
+        vocab = cls(fingerprint)
+        tables = {table.tableid: table.fields for table in vocdb.enumerate_tables()}
+        for recno, tableid, record in vocdb.enumerate_decoded(tables):
+            if record is not None:
+                text = entrytext(record)
+                if text:
+                    vocab.entries[recno] = text
+        return vocab
+
+    def resolve(self, value):
+        """
+        Return the text of the entry referenced by the raw field `value`, or `value` itself.
+        """
+        code = value.rstrip(b"\x00")
+        if code.isdigit():
+            return self.entries.get(int(code), value)
+        return value
+
+    def resolverecord(self, record, indices):
+        """
+        Resolve the dictionary fields at `indices` of `record.values`.
+        """
+        values = record.values
+        for i in indices:
+            if values[i]:
+                values[i] = self.resolve(values[i])
+        # drop fields decoded before resolving, like those used by a query.
+        record._fields = None
+
+    @classmethod
+    def load(cls, filename, fingerprint):
+        """
+        Load a vocabulary saved by `save`, returns None when the file is missing,
+        invalid, or was saved for another fingerprint.
+        """
+        try:
+            with open(filename, "rb") as fh:
+                data = fh.read()
+        except IOError:
+            return
+        if data[:8] != MAGIC or data[8:40] != fingerprint:
+            return
+        vocab = cls(fingerprint)
+        o = 40
+        try:
+            while o < len(data):
+                recno, size = struct.unpack_from("<LL", data, o)
+                o += 8
+                if o + size > len(data):
+                    return
+                vocab.entries[recno] = data[o:o + size]
+                o += size
+        except struct.error:
+            return
+        return vocab
+
+    def save(self, filename):
+        """
+        Write the vocabulary to `filename`, through a temporary file, so a concurrent
+        reader never sees a partial file.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        tmpname = "%s.%d.tmp" % (filename, os.getpid())
+        with open(tmpname, "wb") as fh:
+            fh.write(MAGIC + self.fingerprint)
+            for recno, text in self.entries.items():
+                fh.write(struct.pack("<LL", recno, len(text)))
+                fh.write(text)
+        os.replace(tmpname, filename)
+
+
+def loadvocabulary(vocdir, opendb, kod, usecache=True):
+    """
+    Return the Vocabulary for the database in `vocdir`, from the cache when possible.
+    `opendb` is called to open the vocabulary Database when the entries need to be read.
+    """
+    fingerprint = indexfingerprint(kodcache.fingerprint(vocdir), kod)
+    filename = cachename(fingerprint)
+    if usecache:
+        vocab = Vocabulary.load(filename, fingerprint)
+        if vocab is not None:
+            return vocab
+    vocab = Vocabulary.build(opendb(), fingerprint)
+    if usecache:
+        try:
+            vocab.save(filename)
+        except OSError:
+            pass
+    return vocab
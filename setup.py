@@ -47,5 +47,5 @@ For more details see the [README.md](https://github.com/alephdata/cronodump/blob
         'Topic :: Database',
     ],
     python_requires = '>=3.7',
-    extras_require={ 'templates': ['Jinja2'] },
+    extras_require={ 'templates': ['Jinja2'], 'parquet': ['pyarrow'], 'dataframe': ['numpy', 'pandas'] },
 )
@@ -0,0 +1,186 @@
+"""
+Checks batching, error propagation, backpressure and cancellation of the asynchronous iteration.
+
+Run with: python -m unittest discover tests
+"""
+import asyncio
+import os
+import threading
+import time
+import unittest
+from crodump.Database import Database
+from crodump.aio import abatches
+
+DBDIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_data", "all_field_types")
+
+# seconds to wait for the worker thread.
+TIMEOUT = 5
+
+
+class Source:
+    """
+    A blocking generator of `count` numbers, or of numbers without end when `count` is None,
+    which raises ValueError at item `fail`, and waits for `ready` before each item.
+    """
+    def __init__(self, count=None, fail=None, ready=None):
+        self.count = count
+        self.fail = fail
+        self.ready = ready
+        self.produced = 0
+        self.closed = threading.Event()
+        self.threads = set()
+
+    def generate(self):
+        self.threads.add(threading.get_ident())
+        try:
+            i = 0
+            while self.count is None or i < self.count:
+                if self.ready:
+                    self.ready.wait()
+                if i == self.fail:
+                    raise ValueError("item %d" % i)
+                self.produced += 1
+                yield i
+                i += 1
+        finally:
+            self.closed.set()
+
+
+async def collect(batches):
+    return [batch async for batch in batches]
+
+
+async def waitfor(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition() and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+
+class ABatchesTest(unittest.TestCase):
+    def test_batches(self):
+        source = Source(10)
+        self.assertEqual(asyncio.run(collect(abatches(source.generate, 3))), [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]])
+        self.assertTrue(source.closed.is_set())
+        # the generator runs on the worker thread.
+        self.assertNotIn(threading.get_ident(), source.threads)
+
+        self.assertEqual(asyncio.run(collect(abatches(Source(6).generate, 3))), [[0, 1, 2], [3, 4, 5]])
+        self.assertEqual(asyncio.run(collect(abatches(Source(0).generate, 3))), [])
+
+    def test_prepare(self):
+        prepared = []
+
+        def prepare(item):
+            prepared.append((item, threading.get_ident()))
+
+        source = Source(5)
+        self.assertEqual(asyncio.run(collect(abatches(source.generate, 2, prepare=prepare))), [[0, 1], [2, 3], [4]])
+        self.assertEqual([item for item, thread in prepared], list(range(5)))
+        self.assertEqual({thread for item, thread in prepared}, source.threads)
+
+    def test_error(self):
+        source = Source(10, fail=4)
+        received = []
+
+        async def consume():
+            async for batch in abatches(source.generate, 3):
+                received.append(batch)
+
+        with self.assertRaisesRegex(ValueError, "item 4"):
+            asyncio.run(consume())
+        # the batches before the error are delivered.
+        self.assertEqual(received, [[0, 1, 2]])
+        self.assertTrue(source.closed.wait(TIMEOUT))
+
+    def test_error_in_prepare(self):
+        def prepare(item):
+            if item == 1:
+                raise KeyError(item)
+
+        source = Source(10)
+        with self.assertRaises(KeyError):
+            asyncio.run(collect(abatches(source.generate, 3, prepare=prepare)))
+        self.assertTrue(source.closed.wait(TIMEOUT))
+
+    def test_error_in_generate(self):
+        def generate():
+            raise OSError("no database")
+
+        with self.assertRaisesRegex(OSError, "no database"):
+            asyncio.run(collect(abatches(generate, 3)))
+
+    def test_backpressure(self):
+        source = Source()
+
+        async def consume(maxbatches):
+            batches = abatches(source.generate, 4, maxbatches)
+            try:
+                for consumed in range(1, 4):
+                    await batches.__anext__()
+                    # the worker stops after producing `maxbatches` more batches.
+                    bound = (consumed + maxbatches) * 4
+                    await waitfor(lambda: source.produced >= bound)
+                    await asyncio.sleep(0.05)
+                    self.assertEqual(source.produced, bound)
+            finally:
+                await batches.aclose()
+
+        asyncio.run(consume(2))
+        self.assertTrue(source.closed.wait(TIMEOUT))
+        source = Source()
+        asyncio.run(consume(1))
+        self.assertTrue(source.closed.wait(TIMEOUT))
+
+    def test_break(self):
+        source = Source()
+
+        async def consume():
+            batches = abatches(source.generate, 2)
+            try:
+                async for batch in batches:
+                    break
+            finally:
+                await batches.aclose()
+            return batch
+
+        self.assertEqual(asyncio.run(consume()), [0, 1])
+        # the worker thread, waiting for the consumer, stops and closes the generator.
+        self.assertTrue(source.closed.wait(TIMEOUT))
+        produced = source.produced
+        time.sleep(0.05)
+        self.assertEqual(source.produced, produced)
+
+    def test_cancel(self):
+        ready = threading.Event()
+        source = Source(ready=ready)
+
+        async def main():
+            task = asyncio.ensure_future(collect(abatches(source.generate, 2)))
+            # let the consumer wait for the first batch.
+            await waitfor(lambda: source.threads)
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        try:
+            asyncio.run(main())
+        finally:
+            ready.set()
+        # the worker thread stops after the current item.
+        self.assertTrue(source.closed.wait(TIMEOUT))
+        self.assertLessEqual(source.produced, 1)
+
+
+class DatabaseTest(unittest.TestCase):
+    def test_aenumerate_records(self):
+        db = Database(DBDIR, False)
+        for table in db.enumerate_tables():
+            expected = list(db.enumerate_records(table))
+            batches = asyncio.run(collect(db.aenumerate_records(table, batch_size=2)))
+            self.assertTrue(all(0 < len(batch) <= 2 for batch in batches))
+            self.assertEqual([rec.recno for batch in batches for rec in batch], [rec.recno for rec in expected])
+
+
+if __name__ == "__main__":
+    unittest.main()
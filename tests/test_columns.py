@@ -0,0 +1,171 @@
+"""
+Checks the column oriented batches: the numpy conversion and masking, and that the raw
+decoders give the same values as converting the Field objects.
+
+Run with: python -m unittest discover tests
+"""
+import datetime
+import os
+import unittest
+from crodump import columns
+from crodump.Database import Database
+from crodump.Datamodel import Record
+from crodump.columns import ColumnBuilder, toarray, INT64MIN, INT64MAX
+from crodump.fieldtypes import INTEGER, DATE, TIME, TEXT, converter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+DBDIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_data", "all_field_types")
+
+
+def recorddata(*values):
+    return b"\x1e".join(value.encode("cp1251") for value in values)
+
+
+# integer, text, dictionary, date, time, ...
+VALUES = [
+    ("42", "text", "Москва", "1200315", "1230", "", "x"),
+    ("-7\x00", "  padded\x00", "", "99", "0000", "", ""),
+    ("", "", "", "", "", "", ""),
+    ("abc", "\x00", "12", "bad", "xx", "", ""),
+    ("99999999999999999999", "", "", "1201340", "2561", "", ""),
+    ("0", "0", "0", "-10101", "959", "", ""),
+]
+
+
+@unittest.skipIf(numpy is None, "numpy not installed")
+class ToArrayTest(unittest.TestCase):
+    def test_integer(self):
+        values = [1, None, -5, INT64MAX, INT64MAX + 1, INT64MIN, INT64MIN - 1, 0]
+        array = toarray(INTEGER, values)
+        self.assertEqual(array.dtype, numpy.int64)
+        self.assertEqual(list(numpy.ma.getmaskarray(array)), [False, True, False, False, True, False, True, False])
+        self.assertEqual(array.tolist(), [1, None, -5, INT64MAX, None, INT64MIN, None, 0])
+
+    def test_integer_empty(self):
+        array = toarray(INTEGER, [])
+        self.assertEqual(array.dtype, numpy.int64)
+        self.assertEqual(len(array), 0)
+        self.assertEqual(list(numpy.ma.getmaskarray(toarray(INTEGER, [None]))), [True])
+
+    def test_date(self):
+        array = toarray(DATE, [datetime.date(2020, 3, 15), None, datetime.date(1, 1, 1)])
+        self.assertEqual(array.dtype, numpy.dtype("datetime64[D]"))
+        self.assertEqual(array[0], numpy.datetime64("2020-03-15"))
+        self.assertTrue(numpy.isnat(array[1]))
+        self.assertEqual(array[2], numpy.datetime64("0001-01-01"))
+
+    def test_time(self):
+        array = toarray(TIME, [datetime.time(12, 30), None, datetime.time(0, 0), datetime.time(23, 59)])
+        self.assertEqual(array.dtype, numpy.dtype("timedelta64[m]"))
+        self.assertEqual(array[0], numpy.timedelta64(750, "m"))
+        self.assertTrue(numpy.isnat(array[1]))
+        self.assertEqual(array[2], numpy.timedelta64(0, "m"))
+        self.assertEqual(array[3], numpy.timedelta64(1439, "m"))
+
+    def test_text(self):
+        values = ["a", None, ""]
+        self.assertIs(toarray(TEXT, values), values)
+
+
+class ColumnBuilderTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # the test database has a single table, with fields of all types.
+        cls.table = next(iter(Database(DBDIR, False).enumerate_tables()))
+
+    def setUp(self):
+        self.records = [Record(recno, self.table.fields, recorddata(*values)) for recno, values in enumerate(VALUES, 1)]
+
+    def expected(self):
+        """
+        The typed values by converting the Field objects of each record.
+        """
+        result = []
+        for i, fielddef in enumerate(self.table.fields):
+            convert = converter(fielddef)
+            result.append([convert(record.fields[i]) for record in self.records])
+        return result
+
+    def test_lists(self):
+        builder = ColumnBuilder(self.table, arrays=False)
+        batch = builder.build(self.records)
+        self.assertEqual(list(batch), builder.names)
+        self.assertEqual(len(set(batch)), len(self.table.fields))
+        for name, fielddef, expected in zip(batch, self.table.fields, self.expected()):
+            with self.subTest(name, typ=fielddef.typ):
+                self.assertEqual(batch[name], expected)
+
+    def test_values(self):
+        batch = ColumnBuilder(self.table, arrays=False).build(self.records)
+        names = list(batch)
+        self.assertEqual(batch[names[0]], list(range(1, len(VALUES) + 1)))
+        self.assertEqual(batch[names[1]], [42, -7, None, None, 99999999999999999999, 0])
+        self.assertEqual(batch[names[4]][:4], [datetime.date(2020, 3, 15), None, None, None])
+        self.assertEqual(batch[names[5]][:4], [datetime.time(12, 30), datetime.time(0, 0), None, None])
+
+    @unittest.skipIf(numpy is None, "numpy not installed")
+    def test_arrays(self):
+        builder = ColumnBuilder(self.table, arrays=True)
+        batch = builder.build(self.records)
+        for name, kind, expected in zip(batch, builder.kinds, self.expected()):
+            with self.subTest(name, kind=kind):
+                column = batch[name]
+                if kind == INTEGER:
+                    self.assertIsInstance(column, numpy.ma.MaskedArray)
+                    expected = [None if value is None or not INT64MIN <= value <= INT64MAX else value for value in expected]
+                    self.assertEqual(column.tolist(), expected)
+                elif kind == DATE:
+                    self.assertEqual(column.tolist(), expected)
+                elif kind == TIME:
+                    self.assertEqual(column.tolist(), [None if value is None else
+                                                       datetime.timedelta(hours=value.hour, minutes=value.minute)
+                                                       for value in expected])
+                else:
+                    self.assertEqual(column, expected)
+
+    def test_empty(self):
+        for arrays in (False, True) if numpy is not None else (False,):
+            with self.subTest(arrays=arrays):
+                batch = ColumnBuilder(self.table, arrays=arrays).build([])
+                self.assertEqual(len(batch), len(self.table.fields))
+                self.assertTrue(all(len(column) == 0 for column in batch.values()))
+
+    def test_batches(self):
+        builder = ColumnBuilder(self.table, arrays=False)
+        batches = list(builder.batches(iter(self.records), 4))
+        self.assertEqual([len(batch[builder.names[0]]) for batch in batches], [4, 2])
+        self.assertEqual(list(builder.batches([], 4)), [])
+
+    def test_without_numpy(self):
+        saved = columns.numpy
+        columns.numpy = None
+        try:
+            self.assertFalse(ColumnBuilder(self.table).arrays)
+            with self.assertRaises(ImportError):
+                ColumnBuilder(self.table, arrays=True)
+        finally:
+            columns.numpy = saved
+
+    @unittest.skipIf(pandas is None or numpy is None, "pandas not installed")
+    def test_dataframe(self):
+        frame = columns.dataframe(self.table, self.records, batch_size=4)
+        names = ColumnBuilder(self.table).names
+        self.assertEqual(list(frame.columns), names)
+        self.assertEqual(len(frame), len(VALUES))
+        integers = frame[names[1]]
+        self.assertEqual(str(integers.dtype), "Int64")
+        self.assertEqual([None if pandas.isna(value) else int(value) for value in integers], [42, -7, None, None, None, 0])
+        self.assertEqual(len(columns.dataframe(self.table, [])), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
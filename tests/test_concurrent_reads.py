@@ -0,0 +1,113 @@
+"""
+Checks that single records can be read by several threads at once, as documented for `Database`.
+
+Run with: python -m unittest discover tests
+Set CRONODUMP_TESTDB to the directory of a larger, unprotected, database to test with that instead.
+"""
+import os
+import random
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from crodump.Database import Database
+from crodump.budget import MemoryBudget
+
+DBDIR = os.environ.get("CRONODUMP_TESTDB") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_data", "all_field_types")
+
+THREADS = 16
+READS = 20000
+
+
+def readrec(datafile, recno):
+    try:
+        return datafile.readrec(recno)
+    except Exception as e:
+        return "%s: %s" % (type(e).__name__, e)
+
+
+def streamrec(db, recno):
+    try:
+        parts = db.stream_record(recno)
+        if parts is None:
+            return
+        data = []
+        for part in parts:
+            if part is None:
+                data = []
+            else:
+                data.append(bytes(part))
+        return b"".join(data)
+    except Exception as e:
+        return "%s: %s" % (type(e).__name__, e)
+
+
+class ConcurrentReadTest(unittest.TestCase):
+    MODES = {
+        "default": dict(compact=False),
+        "compact": dict(compact=True),
+        # a small budget, so the caches evict blocks while being read.
+        "budget": dict(compact=False, budget=MemoryBudget(0x10000)),
+        "mmap": dict(compact=False, usemmap=True),
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        db = Database(DBDIR, False)
+        cls.expected = {}
+        for name in ("stru", "index", "bank"):
+            datafile = getattr(db, name)
+            if not datafile or not datafile.nrofrecords:
+                continue
+            cls.expected[name] = {recno: readrec(datafile, recno) for recno in range(1, datafile.nrofrecords + 1)}
+
+    def opendb(self, mode):
+        options = dict(self.MODES[mode])
+        return Database(DBDIR, options.pop("compact"), **options)
+
+    def check_readrec(self, mode):
+        db = self.opendb(mode)
+        for name, expected in self.expected.items():
+            datafile = getattr(db, name)
+            recnos = [random.choice(list(expected)) for _ in range(READS)]
+            with ThreadPoolExecutor(THREADS) as executor:
+                results = list(executor.map(lambda recno: readrec(datafile, recno), recnos))
+            for recno, result in zip(recnos, results):
+                self.assertEqual(result, expected[recno], "%s record %d in %s mode" % (name, recno, mode))
+
+    def check_stream_record(self, mode):
+        db = self.opendb(mode)
+        expected = self.expected.get("bank")
+        if not expected:
+            self.skipTest("no bank records")
+        recnos = [random.choice(list(expected)) for _ in range(READS // 10)]
+        with ThreadPoolExecutor(THREADS) as executor:
+            results = list(executor.map(lambda recno: streamrec(db, recno), recnos))
+        for recno, result in zip(recnos, results):
+            data = expected[recno]
+            if isinstance(data, bytes):
+                data = data[1:]
+            elif data is not None:
+                # broken records raise while streaming, the message may differ.
+                self.assertIsInstance(result, str)
+                continue
+            self.assertEqual(result, data, "stream of bank record %d in %s mode" % (recno, mode))
+
+    def test_readrec_default(self):
+        self.check_readrec("default")
+
+    def test_readrec_compact(self):
+        self.check_readrec("compact")
+
+    def test_readrec_budget(self):
+        self.check_readrec("budget")
+
+    def test_readrec_mmap(self):
+        self.check_readrec("mmap")
+
+    def test_stream_record(self):
+        for mode in self.MODES:
+            self.check_stream_record(mode)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,252 @@
+"""
+Round trip checks for the SQLite, Parquet and PostgreSQL COPY exporters.
+
+The records in test_data/all_field_types are all deleted, so the tables of that database are
+exported with a few records built here, and with a second table with the same name,
+and field names differing only in case.
+
+Run with: python -m unittest discover tests
+"""
+import copy
+import io
+import os
+import sqlite3
+import struct
+import tempfile
+import unittest
+from collections import Counter
+from types import SimpleNamespace
+from crodump.Database import Database
+from crodump.Datamodel import Record
+from crodump.pgcopy import write_pgcopy
+from crodump.sqliteexport import write_sqlite
+
+try:
+    import pyarrow.parquet
+    from crodump.arrowexport import write_parquet
+except ImportError:
+    write_parquet = None
+
+DBDIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_data", "all_field_types")
+
+TEXT = "tab\there\nnew\\line\rend"
+
+
+def sized(value):
+    return b"\x1b" + struct.pack("<L", len(value)) + value
+
+
+def fileref(name, ext, recno):
+    payload = b"\x1e".join([name, ext, recno])
+    return struct.pack("<LL", 0, len(payload)) + payload
+
+
+def recorddata(*values):
+    return b"\x1e".join(value if isinstance(value, bytes) else value.encode("cp1251") for value in values)
+
+
+class ExportDatabase:
+    """
+    The tables of the test database, with records built by the test instead of those in CroBank.
+    """
+    def __init__(self):
+        self.db = Database(DBDIR, False)
+        self.tables = list(self.db.enumerate_tables(files=False))
+        self.filetables = list(self.db.enumerate_tables(files=True))
+        table = self.tables[0]
+
+        # a table with the same name in upper case, and fields named 'Name', 'NAME' and 'name'.
+        fields = [table.fields[0]]
+        for name, source in (("Name", table.fields[2]), ("NAME", table.fields[2]), ("name", table.fields[1])):
+            fielddef = copy.copy(source)
+            fielddef.name = name
+            fields.append(fielddef)
+        self.duptable = SimpleNamespace(tableid=2, tablename=table.tablename.upper(), abbrev="DU", fields=fields)
+        self.tables.append(self.duptable)
+
+        self.records = [
+            # integer, text, dictionary, date, time, file, typ 29, three links, typ 17
+            (table, Record(1, table.fields, recorddata(
+                "42", TEXT, "Москва", "1200315", "1230", sized(fileref(b"report", b"pdf", b"7")),
+                "x", "", "", "", "y"))),
+            (table, Record(2, table.fields, b"")),
+            # contents which the column type can not represent.
+            (table, Record(3, table.fields, recorddata("abc", "", "", "bad", "xx"))),
+            (self.duptable, Record(5, fields, recorddata("a", "b", "3"))),
+        ]
+        self.files = [(self.filetables[0], (7, b"%PDF\x00\x1e\x1b"))] if self.filetables else []
+
+    def enumerate_tables(self, files=False):
+        return self.filetables if files else self.tables
+
+    def enumerate_all(self, tables, filetables=(), physical=False, window=None, jobs=None, stats=None):
+        wanted = {table.tableid for table in list(tables) + list(filetables)}
+        for table, item in self.records + self.files:
+            if table.tableid in wanted:
+                yield table, item
+
+
+def parsecopy(text):
+    """
+    Returns a dict mapping table names to the column names and the rows of their COPY block.
+    """
+    unescape = {"\\t": "\t", "\\n": "\n", "\\r": "\r", "\\\\": "\\"}
+
+    def value(text):
+        if text == "\\N":
+            return None
+        result, i = [], 0
+        while i < len(text):
+            if text[i] == "\\":
+                result.append(unescape[text[i:i + 2]])
+                i += 2
+            else:
+                result.append(text[i])
+                i += 1
+        return "".join(result)
+
+    tables = {}
+    lines = iter(text.split("\n"))
+    for line in lines:
+        if line.startswith("COPY "):
+            name, columns = line[5:].split(" (", 1)
+            columns = [column.strip('"') for column in columns.split(") FROM", 1)[0].split(", ")]
+            rows = []
+            for row in lines:
+                if row == "\\.":
+                    break
+                rows.append([value(v) for v in row.split("\t")])
+            tables[name.strip('"')] = (columns, rows)
+    return tables
+
+
+class ExporterTest(unittest.TestCase):
+    def setUp(self):
+        self.db = ExportDatabase()
+        self.table = self.db.tables[0]
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def assertunique(self, names, ignorecase=False):
+        keys = [name.lower() if ignorecase else name for name in names]
+        self.assertEqual(len(set(keys)), len(keys), names)
+
+    def test_sqlite(self):
+        filename = os.path.join(self.tmpdir.name, "test.sqlite")
+        stats = Counter()
+        write_sqlite(self.db, filename, stats=stats)
+
+        conn = sqlite3.connect(filename)
+        try:
+            tablenames = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            name = self.table.tablename
+            dupname = "%s-2" % self.db.duptable.tablename
+            self.assertEqual(sorted(tablenames), sorted([name, dupname, "_files", "_filereferences"]))
+
+            columns = [row[1] for row in conn.execute('PRAGMA table_info("%s")' % dupname)]
+            self.assertEqual(len(columns), 4)
+            self.assertunique(columns, ignorecase=True)
+            self.assertEqual(columns[1], "Name")
+
+            rows = conn.execute('SELECT * FROM "%s" ORDER BY 1' % name).fetchall()
+            self.assertEqual(len(rows), 3)
+            self.assertEqual(rows[0][:6], (1, 42, TEXT, "Москва", "2020-03-15", "12:30"))
+            # empty fields are NULL.
+            self.assertEqual(rows[1], (2,) + (None,) * (len(self.table.fields) - 1))
+            # integers which do not convert are kept as text.
+            self.assertEqual(rows[2][1], "abc")
+            self.assertEqual(conn.execute('SELECT * FROM "%s"' % dupname).fetchall(), [(5, "a", "b", 3)])
+
+            self.assertEqual(conn.execute("SELECT tablename, recno, filename, extname, filedatarecord FROM _filereferences").fetchall(),
+                             [(name, 1, "report", "pdf", 7)])
+            if self.db.files:
+                self.assertEqual(conn.execute("SELECT recno, data FROM _files").fetchall(), [(7, b"%PDF\x00\x1e\x1b")])
+        finally:
+            conn.close()
+        self.assertEqual(stats[self.table.tableid], 3)
+        self.assertEqual(stats[2], 1)
+
+    def test_pgcopy(self):
+        out = io.StringIO()
+        write_pgcopy(self.db, out)
+        text = out.getvalue()
+        self.assertTrue(text.startswith("SET client_encoding = 'UTF8';\n"))
+
+        tables = parsecopy(text)
+        name = self.table.tablename
+        dupname = "%s-2" % self.db.duptable.tablename
+        self.assertEqual(sorted(tables), sorted([name, dupname]))
+        self.assertEqual(text.count('CREATE TABLE "'), 2)
+
+        columns, rows = tables[name]
+        self.assertEqual(columns, [field.name for field in self.table.fields])
+        self.assertEqual(len(rows), 3)
+        for row in rows:
+            self.assertEqual(len(row), len(columns))
+        # tabs, newlines, carriage returns and backslashes are escaped.
+        self.assertEqual(rows[0][:6], ["1", "42", TEXT, "Москва", "2020-03-15", "12:30"])
+        self.assertEqual(rows[1], ["2"] + [None] * (len(columns) - 1))
+        # contents which the column type can not represent are NULL.
+        self.assertEqual(rows[2][1], None)
+        self.assertEqual(rows[2][4], None)
+        self.assertEqual(rows[2][5], None)
+
+        columns, rows = tables[dupname]
+        self.assertunique(columns)
+        self.assertEqual(rows, [["5", "a", "b", "3"]])
+
+    @unittest.skipUnless(write_parquet, "pyarrow not installed")
+    def test_parquet(self):
+        write_parquet(self.db, self.tmpdir.name, rowgroupsize=2)
+        filenames = sorted(os.listdir(self.tmpdir.name))
+        name = self.table.tablename
+        expected = [name + ".parquet", self.db.duptable.tablename + ".parquet"]
+        expected += ["Files-%s.parquet" % table.abbrev for table in self.db.filetables]
+        self.assertEqual(filenames, sorted(expected))
+
+        data = pyarrow.parquet.read_table(os.path.join(self.tmpdir.name, name + ".parquet"))
+        self.assertEqual(data.num_rows, 3)
+        self.assertEqual(data.column_names, [field.name for field in self.table.fields])
+        rows = data.to_pylist()
+        first = [rows[0][field.name] for field in self.table.fields[:6]]
+        self.assertEqual([str(value) for value in first], ["1", "42", TEXT, "Москва", "2020-03-15", "12:30:00"])
+        self.assertTrue(all(value is None for key, value in rows[1].items() if key != self.table.fields[0].name))
+        self.assertIsNone(rows[2][self.table.fields[1].name])
+
+        data = pyarrow.parquet.read_table(os.path.join(self.tmpdir.name, self.db.duptable.tablename + ".parquet"))
+        self.assertunique(data.column_names)
+        self.assertEqual(data.to_pylist(), [dict(zip(data.column_names, [5, "a", "b", 3]))])
+
+
+class TestDataTest(unittest.TestCase):
+    """
+    Exports the test database itself, the schema is written, there are no live records.
+    """
+    def test_sqlite(self):
+        db = Database(DBDIR, False)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "test.sqlite")
+            write_sqlite(db, filename)
+            conn = sqlite3.connect(filename)
+            try:
+                for table in db.enumerate_tables(files=False):
+                    columns = [row[1] for row in conn.execute('PRAGMA table_info("%s")' % table.tablename)]
+                    self.assertEqual(columns, [field.name for field in table.fields])
+                    self.assertEqual(conn.execute('SELECT COUNT(*) FROM "%s"' % table.tablename).fetchone(), (0,))
+            finally:
+                conn.close()
+
+    def test_pgcopy(self):
+        db = Database(DBDIR, False)
+        out = io.StringIO()
+        write_pgcopy(db, out)
+        tables = parsecopy(out.getvalue())
+        self.assertEqual(sorted(tables), sorted(table.tablename for table in db.enumerate_tables(files=False)))
+        for columns, rows in tables.values():
+            self.assertEqual(rows, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+Checks that the table driven KOD codec gives the same bytes as the original per byte loop,
+with and without numpy.
+
+Run with: python -m unittest discover tests
+"""
+import random
+import unittest
+from crodump import koddecoder
+from crodump.koddecoder import KODcoding, INITIAL_KOD
+
+SHIFTS = [0, 1, 2, 127, 255, 256, 257, 511, 4097, 123456789]
+# lengths around the 16 bit lanes of the big integer backend, and the vector width of numpy.
+LENGTHS = [0, 1, 2, 3, 7, 8, 15, 16, 17, 31, 32, 33, 63, 255, 256, 257, 1000, 4099]
+
+
+def refdecode(kod, o, data):
+    # b[i] = KOD[a[i]] - (i+shift)
+    return bytes((kod[b] - i - o) % 256 for i, b in enumerate(data))
+
+
+def refencode(inv, o, data):
+    # a[i] = INV[b[i] + (i+shift)]
+    return bytes(inv[(b + i + o) % 256] for i, b in enumerate(data))
+
+
+class KODBackendTest(unittest.TestCase):
+    """
+    Runs the checks with the backend selected by `usenumpy`.
+    """
+    usenumpy = False
+
+    def setUp(self):
+        if self.usenumpy and koddecoder.numpy is None:
+            self.skipTest("numpy not installed")
+        self.numpy = koddecoder.numpy
+        if not self.usenumpy:
+            koddecoder.numpy = None
+        self.random = random.Random(1234)
+        kod = list(range(256))
+        self.random.shuffle(kod)
+        self.codings = [KODcoding(), KODcoding(kod)]
+
+    def tearDown(self):
+        koddecoder.numpy = self.numpy
+
+    def randombytes(self, n):
+        return bytes(self.random.randrange(256) for _ in range(n))
+
+    def inverse(self, kod):
+        inv = [0] * 256
+        for i, x in enumerate(kod):
+            inv[x] = i
+        return inv
+
+    def test_decode(self):
+        for coding in self.codings:
+            for o in SHIFTS:
+                for n in LENGTHS:
+                    data = self.randombytes(n)
+                    self.assertEqual(coding.decode(o, data), refdecode(coding.kod, o, data), (o, n))
+
+    def test_encode(self):
+        for coding in self.codings:
+            inv = self.inverse(coding.kod)
+            for o in SHIFTS:
+                for n in LENGTHS:
+                    data = self.randombytes(n)
+                    self.assertEqual(coding.encode(o, data), refencode(inv, o, data), (o, n))
+                    self.assertEqual(coding.decode(o, coding.encode(o, data)), data, (o, n))
+
+    def test_decodebatch(self):
+        for coding in self.codings:
+            items = [(self.random.choice(SHIFTS), self.randombytes(self.random.choice(LENGTHS))) for _ in range(50)]
+            expected = [refdecode(coding.kod, o, data) for o, data in items]
+            self.assertEqual(coding.decodebatch(items), expected)
+            # memoryviews and bytearrays are accepted as well.
+            views = [(o, memoryview(bytearray(data))) for o, data in items]
+            self.assertEqual(coding.decodebatch(views), expected)
+            self.assertEqual(coding.decodebatch([]), [])
+
+    def test_initial_table(self):
+        self.assertEqual(sorted(INITIAL_KOD), list(range(256)))
+        self.assertEqual(koddecoder.new().kod, INITIAL_KOD)
+
+
+class KODNumpyTest(KODBackendTest):
+    usenumpy = True
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+"""
+Checks parsing link field payloads, and resolving them to the referenced records.
+
+Run with: python -m unittest discover tests
+"""
+import struct
+import unittest
+from types import SimpleNamespace
+from crodump.links import LinkResolver, linkindices, linktargets
+from crodump.recindex import RecordIndex
+from crodump.vocabulary import Vocabulary
+
+CITIES = SimpleNamespace(tableid=1, tablename="Cities", fields=[
+    SimpleNamespace(typ=0, name="Recno"),
+    SimpleNamespace(typ=2, name="Name"),
+    SimpleNamespace(typ=3, name="Country"),
+])
+PEOPLE = SimpleNamespace(tableid=2, tablename="People", fields=[
+    SimpleNamespace(typ=0, name="Recno"),
+    SimpleNamespace(typ=2, name="Name"),
+    SimpleNamespace(typ=7, name="City"),
+    SimpleNamespace(typ=9, name="Friends"),
+])
+
+
+class FakeBank:
+    """
+    CroBank with record `recno` at index recno-1, records are the table id followed by the data.
+    """
+    def __init__(self, records):
+        self.records = records
+        self.nrofrecords = len(records)
+        self.reads = []
+
+    def readrec(self, recno):
+        self.reads.append(recno)
+        return self.records[recno - 1]
+
+
+class FakeDatabase:
+    def __init__(self, records, recindex=None, vocabulary=None):
+        self.bank = FakeBank(records)
+        self.recindex = recindex
+        self.vocabulary = vocabulary
+        self.usevocabulary = vocabulary is not None
+        self.passes = 0
+
+    def enumerate_tables(self):
+        return [CITIES, PEOPLE]
+
+    def getvocabulary(self):
+        return self.vocabulary
+
+    def getrecindex(self):
+        return self.recindex
+
+    def enumerate_decoded(self, tables):
+        self.passes += 1
+        for recno, data in enumerate(self.bank.records, 1):
+            if data is None:
+                continue
+            yield recno, data[0] if data else None, None
+
+
+RECORDS = [
+    b"\x01Berlin\x1e5",
+    b"\x01Paris\x1e6",
+    b"\x02Alice\x1e1\x1e4",
+    b"\x02Bob\x1e2\x1e3",
+    b"",
+    None,
+    b"\x05unknown table",
+    b"\x01\x1b\xff",
+]
+
+
+class LinkTargetsTest(unittest.TestCase):
+    def test_linktargets(self):
+        self.assertEqual(linktargets(b"12"), [12])
+        self.assertEqual(linktargets(b"1\x1e2\x1d3 4,5"), [1, 2, 3, 4, 5])
+        self.assertEqual(linktargets(b"1, 2\x00\x00"), [1, 2])
+        self.assertEqual(linktargets(b"\x1e7\x1e"), [7])
+
+    def test_header(self):
+        self.assertEqual(linktargets(struct.pack("<LL", 0, 3) + b"3\x1e4"), [3, 4])
+        # the header is only skipped when its size matches the payload.
+        self.assertIsNone(linktargets(struct.pack("<LL", 0, 5) + b"3\x1e4\x00"))
+
+    def test_invalid(self):
+        for data in (b"", b"\x00", b"\x1e", b"12a", b"-1", b"1\x1fx", b"\xff\xff"):
+            with self.subTest(data):
+                self.assertIsNone(linktargets(data))
+
+    def test_linkindices(self):
+        self.assertEqual(linkindices(PEOPLE), [2, 3])
+        self.assertEqual(linkindices(CITIES), [])
+
+
+class LinkResolverTest(unittest.TestCase):
+    def test_tableof(self):
+        db = FakeDatabase(RECORDS)
+        resolver = LinkResolver(db)
+        self.assertEqual([resolver.tableof(recno) for recno in range(0, 10)],
+                         [None, 1, 1, 2, 2, None, None, 5, 1, None])
+        # the index is built in a single pass.
+        self.assertEqual(db.passes, 1)
+
+    def test_recindex(self):
+        index = RecordIndex(bytes(32), len(RECORDS))
+        for recno, data in enumerate(RECORDS, 1):
+            index.add(recno, data[0] if data else None, 0, 0)
+        db = FakeDatabase(RECORDS, recindex=index)
+        resolver = LinkResolver(db)
+        self.assertEqual(resolver.tableof(1), 1)
+        self.assertEqual(resolver.tableof(4), 2)
+        self.assertIsNone(resolver.tableof(5))
+        self.assertEqual(db.passes, 0)
+
+    def test_keys(self):
+        resolver = LinkResolver(FakeDatabase(RECORDS))
+        self.assertEqual(resolver.keys(b"1\x1e2"), [1, 2])
+        self.assertEqual(resolver.keys(b"7"), [7])
+        # references to empty, deleted or missing records are not resolved.
+        for data in (b"1\x1e5", b"6", b"9", b"0", b"x"):
+            with self.subTest(data):
+                self.assertIsNone(resolver.keys(data))
+
+    def test_content(self):
+        resolver = LinkResolver(FakeDatabase(RECORDS))
+        self.assertEqual(resolver.content(b"2 1"), "2 1")
+        self.assertEqual(resolver.content(b"1\x1e3", ["Name"]), "Berlin; Alice")
+        # link fields of the referenced records are not resolved further, they stay hex dumps.
+        self.assertEqual(resolver.content(b"3", ["Name", "City"]), "Alice 31")
+        # fields missing in the referenced table are skipped.
+        self.assertEqual(resolver.content(b"1\x1e3", ["City", "Missing"]), "; 31")
+        # records of unknown tables, or which do not decode, resolve to nothing.
+        self.assertEqual(resolver.content(b"7\x1e8\x1e2", ["Name"]), "; ; Paris")
+        self.assertIsNone(resolver.content(b"6", ["Name"]))
+        self.assertIsNone(resolver.content(b"bad"))
+
+    def test_tables(self):
+        resolver = LinkResolver(FakeDatabase(RECORDS), tables=[CITIES])
+        self.assertEqual(resolver.content(b"1\x1e3", ["Name"]), "Berlin; ")
+
+    def test_vocabulary(self):
+        vocab = Vocabulary(bytes(32), {5: b"Germany", 6: b"France"})
+        resolver = LinkResolver(FakeDatabase(RECORDS, vocabulary=vocab))
+        self.assertEqual(resolver.content(b"1\x1e2", ["Name", "Country"]), "Berlin Germany; Paris France")
+        resolver = LinkResolver(FakeDatabase(RECORDS))
+        self.assertEqual(resolver.content(b"1\x1e2", ["Country"]), "5; 6")
+
+    def test_cache(self):
+        db = FakeDatabase(RECORDS)
+        resolver = LinkResolver(db, cachesize=2)
+        for data in (b"1", b"2", b"1", b"3", b"2", b"2"):
+            resolver.content(data, ["Name"])
+        # 2 was evicted when reading 3, 1 was used more recently.
+        self.assertEqual(db.bank.reads, [1, 2, 3, 2])
+        self.assertEqual((resolver.hits, resolver.misses), (2, 4))
+        self.assertEqual(list(resolver.cache), [3, 2])
+        self.assertEqual(resolver.stats(), "link cache: 2 hits, 4 misses (33.3% hits)")
+
+    def test_cache_unresolved(self):
+        db = FakeDatabase(RECORDS)
+        resolver = LinkResolver(db)
+        self.assertIsNone(resolver.record(7))
+        self.assertIsNone(resolver.record(7))
+        # records which do not resolve are cached as well, and not read again.
+        self.assertEqual(db.bank.reads, [])
+        self.assertIsNone(resolver.record(8))
+        self.assertIsNone(resolver.record(8))
+        self.assertEqual(db.bank.reads, [8])
+        self.assertEqual(resolver.stats(), "link cache: 2 hits, 2 misses (50.0% hits)")
+        self.assertEqual(LinkResolver(db).stats(), "link cache: 0 hits, 0 misses (0.0% hits)")
+
+
+if __name__ == "__main__":
+    unittest.main()
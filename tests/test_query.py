@@ -0,0 +1,88 @@
+"""
+Checks the matching of `--where` conditions.
+
+Run with: python -m unittest discover tests
+"""
+import unittest
+from types import SimpleNamespace
+from crodump.Datamodel import Record
+from crodump.query import Condition, Query
+
+FIELDS = [
+    SimpleNamespace(typ=0, name="Recno"),
+    SimpleNamespace(typ=1, name="Number"),
+    SimpleNamespace(typ=2, name="Text"),
+    SimpleNamespace(typ=4, name="Date"),
+]
+TABLE = SimpleNamespace(tableid=1, tablename="Test", fields=FIELDS)
+
+
+def makerecord(recno, *values):
+    return Record(recno, FIELDS, "\x1e".join(values).encode("cp1251"))
+
+
+class ConditionTest(unittest.TestCase):
+    def matches(self, text, record):
+        return Condition.parse(TABLE, text).match(record)
+
+    def test_equal(self):
+        record = makerecord(5, "12", "Москва", "1200315")
+        self.assertTrue(self.matches("Text=Москва", record))
+        self.assertFalse(self.matches("Text=Моск", record))
+        self.assertTrue(self.matches("Number=12", record))
+        self.assertTrue(self.matches("Recno=5", record))
+        self.assertTrue(self.matches("Date=2020-03-15", record))
+
+    def test_contains(self):
+        record = makerecord(5, "12", "Москва", "")
+        self.assertTrue(self.matches("Text~оск", record))
+        self.assertFalse(self.matches("Text~Киев", record))
+
+    def test_range(self):
+        record = makerecord(5, "12", "b", "1200315")
+        self.assertTrue(self.matches("Number=10..20", record))
+        # integers are compared numerically, not as text.
+        self.assertFalse(self.matches("Number=2..3", record))
+        self.assertTrue(self.matches("Number=..12", record))
+        self.assertFalse(self.matches("Number=13..", record))
+        self.assertTrue(self.matches("Text=a..c", record))
+        self.assertTrue(self.matches("Date=2020-01-01..2020-12-31", record))
+        self.assertTrue(self.matches("Recno=5..5", record))
+
+    def test_range_zero_bound(self):
+        self.assertTrue(self.matches("Number=0..", makerecord(1, "0")))
+        self.assertTrue(self.matches("Number=-5..0", makerecord(1, "-1")))
+        self.assertFalse(self.matches("Number=0..", makerecord(1, "-1")))
+        self.assertFalse(self.matches("Number=..0", makerecord(1, "1")))
+
+    def test_range_non_numeric_content(self):
+        # an integer field with text content never matches a numeric range.
+        for text in ("Number=0..", "Number=..0", "Number=0..0", "Number=1..9", "Number=-1..1"):
+            self.assertFalse(self.matches(text, makerecord(1, "abc")), text)
+        # nor does a range with a numeric and a non numeric bound.
+        self.assertFalse(self.matches("Number=0..x", makerecord(1, "5")))
+        self.assertFalse(self.matches("Number=0..x", makerecord(1, "abc")))
+
+    def test_empty_content(self):
+        record = makerecord(1, "", "", "")
+        self.assertFalse(self.matches("Number=0..", record))
+        self.assertTrue(self.matches("Text=", record))
+
+
+class QueryTest(unittest.TestCase):
+    def test_match_and_project(self):
+        query = Query(TABLE, ["Text", "Recno"], ["Number=1..", "Text~a"])
+        self.assertTrue(query.match(makerecord(3, "1", "abc")))
+        self.assertFalse(query.match(makerecord(3, "0", "abc")))
+        self.assertEqual([field.content for field in query.project(makerecord(3, "1", "abc"))], ["abc", "3"])
+
+    def test_split(self):
+        query = Query(TABLE, None, ["Number=1", "Text=x"])
+        rest, conditions = query.split({2})
+        self.assertEqual([c.index for c in rest.conditions], [1])
+        self.assertEqual([c.index for c in conditions], [2])
+        self.assertEqual(len(query.conditions), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
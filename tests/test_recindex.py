@@ -0,0 +1,154 @@
+"""
+Checks saving and loading the sidecar record index, and that it is rebuilt for a modified database.
+
+Run with: python -m unittest discover tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from crodump import kodcache, koddecoder
+from crodump.Database import Database
+from crodump.recindex import RecordIndex, indexfingerprint, EMPTY, BROKEN, DELETED, MISSING
+from crodump.tadindex import TadIndex
+
+DBDIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_data", "all_field_types")
+
+FINGERPRINT = bytes(range(32))
+
+
+def makeindex():
+    index = RecordIndex(FINGERPRINT, 5)
+    index.add(1, 3, 100, 250)
+    index.add(2, None, 8, 0)
+    index.broken(3)
+    index.add(5, 0xff, 70000, 0x12345678)
+    index.flags[0] = 0x80
+    index.checksums[4] = 0xdeadbeef
+    return index
+
+
+class RecordIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "sub", "test.idx")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_save_load(self):
+        index = makeindex()
+        self.assertFalse(index.iscomplete())
+        index.save(self.filename)
+        loaded = RecordIndex.load(self.filename, FINGERPRINT)
+        self.assertIsNotNone(loaded)
+        self.assertEqual(loaded.nrofrecords, 5)
+        for recno in range(1, 6):
+            self.assertEqual(loaded.entry(recno), index.entry(recno))
+        self.assertEqual(loaded.tableids[1], EMPTY)
+        self.assertEqual(loaded.tableids[2], BROKEN)
+        self.assertEqual(loaded.tableids[3], MISSING)
+        # no temporary files are left behind.
+        self.assertEqual(os.listdir(os.path.dirname(self.filename)), ["test.idx"])
+
+    def test_complete(self):
+        index = makeindex()
+        index.add(4, 3, 1, 1)
+        self.assertTrue(index.iscomplete())
+        # broken records are read again, since their table is not known.
+        self.assertEqual(index.records([3]), [1, 3, 4])
+        self.assertEqual(index.records([0xff]), [3, 5])
+
+    def test_load_invalid(self):
+        makeindex().save(self.filename)
+        self.assertIsNone(RecordIndex.load(self.filename, bytes(32)))
+        self.assertIsNone(RecordIndex.load(os.path.join(self.tmpdir.name, "missing.idx"), FINGERPRINT))
+
+        with open(self.filename, "rb") as fh:
+            data = fh.read()
+        for name, corrupt in (("truncated", data[:-1]), ("header only", data[:48]), ("magic", b"X" + data[1:]), ("empty", b"")):
+            with self.subTest(name):
+                with open(self.filename, "wb") as fh:
+                    fh.write(corrupt)
+                self.assertIsNone(RecordIndex.load(self.filename, FINGERPRINT))
+
+    def test_fromtad(self):
+        # three entries, the second one deleted, split over two parts.
+        entries = [(0x100, 0x80000010, 1), (0x200, 0xFFFFFFFF, 2), (0x300, 0x20, 3)]
+        data = b"".join(ofs.to_bytes(4, "little") + ln.to_bytes(4, "little") + chk.to_bytes(4, "little") for ofs, ln, chk in entries)
+        parts = [(0, TadIndex(data[:24], False, False)), (2, TadIndex(data[24:], False, False))]
+        index = RecordIndex.fromtad(FINGERPRINT, 3, parts)
+        self.assertEqual(list(index.tableids), [MISSING, DELETED, MISSING])
+        self.assertEqual(list(index.flags), [0x80, 0, 0])
+        self.assertEqual(list(index.checksums), [1, 2, 3])
+
+    def test_indexfingerprint(self):
+        self.assertEqual(indexfingerprint("abc", None), indexfingerprint("abc", None))
+        self.assertNotEqual(indexfingerprint("abc", None), indexfingerprint("abd", None))
+        kod = list(range(256))
+        kod[0], kod[1] = 1, 0
+        self.assertNotEqual(indexfingerprint("abc", koddecoder.new()), indexfingerprint("abc", koddecoder.new(kod)))
+
+
+class DatabaseIndexTest(unittest.TestCase):
+    """
+    Uses a copy of the test database, which is modified to check the index is rebuilt.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dbdir = os.path.join(self.tmpdir.name, "db")
+        shutil.copytree(DBDIR, self.dbdir)
+        self.filename = os.path.join(self.tmpdir.name, "bank.idx")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def enumerate(self, recindex):
+        db = Database(self.dbdir, False, recindex=recindex)
+        tables = {table.tableid: table.fields for table in db.enumerate_tables()}
+        result = [(recno, tableid, item is not None) for recno, tableid, item in db.enumerate_decoded(tables)]
+        return db, result
+
+    def test_build_and_reuse(self):
+        db, expected = self.enumerate(None)
+        db, result = self.enumerate(self.filename)
+        self.assertEqual(result, expected)
+        self.assertTrue(os.path.exists(self.filename))
+        self.assertTrue(db.getrecindex().iscomplete())
+
+        db, result = self.enumerate(self.filename)
+        index = db.getrecindex()
+        self.assertTrue(index.iscomplete())
+        self.assertEqual(index.nrofrecords, db.bank.nrofrecords)
+        self.assertEqual(result, expected)
+
+    def test_modified_bank(self):
+        self.enumerate(self.filename)
+        bankfingerprint = kodcache.fingerprint(self.dbdir, ("Bank",))
+
+        # change the checksum of the last .tad entry.
+        tadname = os.path.join(self.dbdir, "CroBank.tad")
+        with open(tadname, "r+b") as fh:
+            fh.seek(-1, os.SEEK_END)
+            last = fh.read(1)
+            fh.seek(-1, os.SEEK_END)
+            fh.write(bytes([last[0] ^ 0xff]))
+        self.assertNotEqual(kodcache.fingerprint(self.dbdir, ("Bank",)), bankfingerprint)
+
+        db = Database(self.dbdir, False, recindex=self.filename)
+        self.assertFalse(db.getrecindex().iscomplete())
+
+    def test_other_kod(self):
+        self.enumerate(self.filename)
+        kod = list(range(256))
+        kod[0], kod[1] = 1, 0
+        db = Database(self.dbdir, False, koddecoder.new(kod), recindex=self.filename)
+        if db.bank.kod is db.kod:
+            self.assertFalse(db.getrecindex().iscomplete())
+        else:
+            # an unencrypted bank always uses the default table, the index stays valid.
+            self.assertTrue(db.getrecindex().iscomplete())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+Checks that records are split in the same fields as by the original ByteReader based parser.
+
+Run with: python -m unittest discover tests
+"""
+import struct
+import unittest
+from types import SimpleNamespace
+from crodump.Datamodel import Record, tokenize, tokenizebatch
+from crodump.readers import ByteReader
+
+
+def bytereaderfields(data, nrfields):
+    """
+    The raw field values as split by the ByteReader loop which `tokenize` replaced.
+    """
+    values = []
+    rd = ByteReader(data)
+    for _ in range(nrfields):
+        if not rd.eof() and rd.testbyte(0x1b):
+            # read complex record indicated by b"\x1b"
+            rd.readbyte()
+            size = rd.readdword()
+            values.append(rd.readbytes(size))
+        else:
+            values.append(rd.readtoseperator(b"\x1e"))
+    return values
+
+
+def sized(value):
+    return b"\x1b" + struct.pack("<L", len(value)) + value
+
+
+def fileref(name, ext, recno):
+    payload = b"\x1e".join([name, ext, recno])
+    return struct.pack("<LL", 0, len(payload)) + payload
+
+
+# (description, nr of fields, record data)
+CASES = [
+    ("plain", 3, b"a\x1ebc\x1edef"),
+    ("empty fields", 4, b"\x1e\x1eb\x1e"),
+    ("fewer fields than the table", 5, b"a\x1eb"),
+    ("more fields than the table", 2, b"a\x1eb\x1ec\x1ed"),
+    ("trailing separator", 2, b"a\x1eb\x1e"),
+    ("trailing separators", 3, b"a\x1e\x1e\x1e\x1e"),
+    ("empty record", 3, b""),
+    ("sized field", 2, sized(b"x\x1ey") + b"z"),
+    # no separator is skipped after a sized field, the next field starts right after it.
+    ("sized then plain", 3, b"a\x1e" + sized(b"b\x1ec") + b"d\x1ee"),
+    ("sized then separator", 3, b"a\x1e" + sized(b"bc") + b"\x1ed"),
+    ("consecutive sized", 3, sized(b"\x1e") + sized(b"") + sized(b"\x1b\x1e")),
+    ("sized last", 2, b"a\x1e" + sized(b"b\x1e")),
+    ("sized with trailing data", 1, sized(b"ab") + b"\x1ecd"),
+    ("0x1b inside a plain field", 3, b"a\x1bb\x1ec\x1ed"),
+    ("0x1b after the last field", 2, b"a\x1eb\x1e\x1b\xff\xff"),
+    ("zero fields", 0, b"a\x1eb"),
+]
+
+
+class TokenizeTest(unittest.TestCase):
+    def test_cases(self):
+        for description, nrfields, data in CASES:
+            with self.subTest(description):
+                expected = bytereaderfields(data, nrfields) if nrfields else []
+                self.assertEqual(tokenize(data, nrfields), expected)
+
+    def test_truncated_sized_field(self):
+        for data in (b"a\x1e\x1b\x05\x00", b"a\x1e" + b"\x1b" + struct.pack("<L", 10) + b"short"):
+            with self.subTest(data):
+                with self.assertRaises(EOFError):
+                    bytereaderfields(data, 2)
+                with self.assertRaises(EOFError):
+                    tokenize(data, 2)
+
+    def test_truncated_sized_field_beyond_table(self):
+        # a broken sized field after the last field of the table is never read.
+        data = b"a\x1eb\x1e\x1b\xff"
+        self.assertEqual(tokenize(data, 2), bytereaderfields(data, 2))
+
+
+class RecordTest(unittest.TestCase):
+    TABLE = [
+        SimpleNamespace(typ=0, name="Recno"),
+        SimpleNamespace(typ=2, name="Name"),
+        SimpleNamespace(typ=6, name="File"),
+        SimpleNamespace(typ=2, name="Note"),
+    ]
+
+    def test_file_reference(self):
+        ref = fileref(b"report", b"pdf", b"17")
+        record = Record(3, self.TABLE, b"x\x1e" + sized(ref) + b"y")
+        self.assertEqual(record.values, [b"x", ref, b"y"])
+        self.assertEqual(record.fields[2].filename, "report")
+        self.assertEqual(record.fields[2].filedatarecord, "17")
+        self.assertEqual(record.fields[3].content, "y")
+
+    def test_empty_file_reference(self):
+        record = Record(3, self.TABLE, b"x\x1e\x1ey")
+        self.assertEqual(record.fields[2].content, "")
+
+    def test_short_file_reference(self):
+        # file references start with two dwords, shorter ones are reported when splitting the record.
+        for ref in (b"\x01", b"1234567"):
+            with self.subTest(ref):
+                data = b"x\x1e" + ref + b"\x1ey"
+                with self.assertRaises(EOFError):
+                    Record(3, self.TABLE, data)
+                self.assertEqual(tokenizebatch(self.TABLE, [data, b"x"]), [None, [b"x", b"", b""]])
+
+    def test_tokenizebatch(self):
+        datas = [data for description, nrfields, data in CASES if b"\x1b\xff" not in data]
+        results = tokenizebatch(self.TABLE, datas)
+        for data, values in zip(datas, results):
+            with self.subTest(data):
+                try:
+                    expected = Record(1, self.TABLE, data).values
+                except EOFError:
+                    expected = None
+                self.assertEqual(values, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+"""
+Checks resolving dictionary fields through the vocabulary, and caching the vocabulary.
+
+Run with: python -m unittest discover tests
+"""
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+from crodump.Database import Database
+from crodump.Datamodel import Record
+from crodump.query import Query
+from crodump.vocabulary import Vocabulary, dictionaryfields, entrytext, findvocdir, loadvocabulary
+
+DBDIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_data", "all_field_types")
+
+FINGERPRINT = bytes(range(32))
+
+FIELDS = [
+    SimpleNamespace(typ=0, name="Recno"),
+    SimpleNamespace(typ=3, name="City"),
+    SimpleNamespace(typ=2, name="Street"),
+    SimpleNamespace(typ=3, name="Country"),
+]
+TABLE = SimpleNamespace(tableid=1, tablename="Addresses", fields=FIELDS)
+
+
+def makevocabulary():
+    return Vocabulary(FINGERPRINT, {12: "Москва".encode("cp1251"), 13: b"Russia", 100000: b""})
+
+
+class VocabularyTest(unittest.TestCase):
+    def test_resolve(self):
+        vocab = makevocabulary()
+        self.assertEqual(vocab.resolve(b"12"), "Москва".encode("cp1251"))
+        self.assertEqual(vocab.resolve(b"13\x00\x00"), b"Russia")
+        # values which are not the number of an entry are left as they are.
+        self.assertEqual(vocab.resolve(b"14"), b"14")
+        self.assertEqual(vocab.resolve(b"Moscow"), b"Moscow")
+        self.assertEqual(vocab.resolve(b"-12"), b"-12")
+        self.assertEqual(vocab.resolve(b" 12"), b" 12")
+        self.assertEqual(vocab.resolve(b"100000"), b"")
+
+    def test_resolverecord(self):
+        vocab = makevocabulary()
+        record = Record(7, FIELDS, b"12\x1e13\x1e13")
+        # fields decoded before resolving are dropped.
+        self.assertEqual(record.fields[1].content, "12")
+        vocab.resolverecord(record, dictionaryfields({1: FIELDS})[1])
+        self.assertEqual([field.content for field in record.fields], ["7", "Москва", "13", "Russia"])
+
+    def test_resolverecord_empty(self):
+        record = Record(7, FIELDS, b"")
+        makevocabulary().resolverecord(record, [0, 2])
+        self.assertEqual([field.content for field in record.fields], ["7", "", "", ""])
+
+    def test_query_on_resolved_values(self):
+        vocab = makevocabulary()
+        query = Query(TABLE, None, ["City=Москва", "Street~Tver"])
+        query, postconditions = query.split({i + 1 for i in dictionaryfields({1: FIELDS})[1]})
+        self.assertEqual([c.index for c in query.conditions], [2])
+
+        record = Record(7, FIELDS, b"12\x1eTverskaya\x1e13")
+        self.assertTrue(query.match(record))
+        self.assertFalse(all(c.match(record) for c in postconditions))
+        vocab.resolverecord(record, [0, 2])
+        self.assertTrue(all(c.match(record) for c in postconditions))
+
+    def test_dictionaryfields(self):
+        self.assertEqual(dictionaryfields({1: FIELDS, 2: FIELDS[:3], 3: None, 4: FIELDS[2:3]}), {1: [0, 2], 2: [0]})
+
+    def test_entrytext(self):
+        self.assertEqual(entrytext(SimpleNamespace(values=[b"\x00", b"", b"abc\x00", b"def"])), b"abc")
+        self.assertEqual(entrytext(SimpleNamespace(values=[b""])), b"")
+
+
+class VocabularyCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "test.voc")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_save_load(self):
+        vocab = makevocabulary()
+        vocab.save(self.filename)
+        loaded = Vocabulary.load(self.filename, FINGERPRINT)
+        self.assertEqual(loaded.entries, vocab.entries)
+        self.assertIsNone(Vocabulary.load(self.filename, bytes(32)))
+        self.assertIsNone(Vocabulary.load(os.path.join(self.tmpdir.name, "missing.voc"), FINGERPRINT))
+
+        with open(self.filename, "rb") as fh:
+            data = fh.read()
+        for name, corrupt in (("truncated entry", data[:-1]), ("truncated header", data[:-3]), ("magic", b"X" + data[1:])):
+            with self.subTest(name):
+                with open(self.filename, "wb") as fh:
+                    fh.write(corrupt)
+                self.assertIsNone(Vocabulary.load(self.filename, FINGERPRINT))
+
+    def test_loadvocabulary(self):
+        vocdir = findvocdir(DBDIR)
+        self.assertIsNotNone(vocdir)
+        opened = []
+
+        def opendb():
+            opened.append(vocdir)
+            return Database(vocdir, False)
+
+        with mock.patch.dict(os.environ, {"XDG_CACHE_HOME": self.tmpdir.name}):
+            vocab = loadvocabulary(vocdir, opendb, None)
+            self.assertEqual(len(opened), 1)
+            cached = loadvocabulary(vocdir, opendb, None)
+            self.assertEqual(len(opened), 1)
+            self.assertEqual(cached.entries, vocab.entries)
+            # without the cache, the vocabulary database is read again.
+            loadvocabulary(vocdir, opendb, None, usecache=False)
+            self.assertEqual(len(opened), 2)
+
+    def test_getvocabulary(self):
+        with mock.patch.dict(os.environ, {"XDG_CACHE_HOME": self.tmpdir.name}):
+            self.assertIsNotNone(Database(DBDIR, False, vocabulary=True).getvocabulary())
+            # a database without Voc subdirectory has no vocabulary.
+            self.assertIsNone(Database(findvocdir(DBDIR), False, vocabulary=True).getvocabulary())
+
+
+if __name__ == "__main__":
+    unittest.main()